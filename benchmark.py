@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+CPU benchmark: veri hattı, eğitim adımı ve üretim (generate/compare).
+Küçük, rastgele başlatılmış bir GPT-2 ile internet olmadan çalışır; sonuçlar JSON'a yazılır
+ve bir baseline ile karşılaştırılabilir (eşik aşılırsa çıkış kodu 1).
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+from src.utils import configure_cpu_threads
+
+SUITES = ("data", "train", "generate")
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU benchmark suite")
+    parser.add_argument("--suites", type=str, default=",".join(SUITES), help=f"Comma separated subset of {', '.join(SUITES)}")
+    parser.add_argument("--output", type=str, default="benchmark_results.json", help="Where to write the JSON report")
+    parser.add_argument("--baseline", type=str, default=None, help="Report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed relative slowdown before a metric regresses")
+    parser.add_argument("--save-baseline", action="store_true", help="Also write the report to --baseline")
+    parser.add_argument("--datasets", type=str, nargs="+", default=None, help="Dataset files (default: dataset.json Zogoria_QA_clean.json)")
+    parser.add_argument("--quick", action="store_true", help="Fewer repetitions, for a smoke run")
+    parser.add_argument("--threads", type=int, default=None, help="torch threads (default: physical cores)")
+    parser.add_argument("--work-dir", type=str, default=None, help="Scratch directory (default: a temp dir)")
+    args = parser.parse_args()
+
+    suites = [s.strip() for s in args.suites.split(",") if s.strip()]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"Unknown suite(s): {', '.join(sorted(unknown))}")
+
+    # Imported after argument parsing so --help stays fast
+    from src.benchmark import DEFAULT_DATASETS, compare_to_baseline, format_comparison, load_report, run_benchmarks
+
+    configure_cpu_threads(args.threads)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="llm-bench-")
+    try:
+        report = run_benchmarks(work_dir, suites, datasets=args.datasets or DEFAULT_DATASETS, quick=args.quick)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"📊 {len(report['metrics'])} metrics written to {args.output}")
+
+    if not args.baseline:
+        return
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        shutil.copy(args.output, args.baseline)
+        print(f"💾 Baseline saved to {args.baseline}")
+        return
+
+    baseline = load_report(args.baseline)
+    if baseline is None:
+        print(f"❌ Baseline not found: {args.baseline}")
+        sys.exit(2)
+    rows = compare_to_baseline(report, baseline, args.threshold)
+    print(format_comparison(rows))
+    regressions = [row["metric"] for row in rows if row["regression"]]
+    if regressions:
+        print(f"❌ {len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    print(f"✅ No regressions beyond {args.threshold:.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+JSONL dosyasındaki soruları toplu (batch) olarak cevaplar ve sonuçları satır satır JSONL'e yazar.
+Yarıda kalırsa aynı komutla yeniden çalıştırın: çıktıda bulunan id'ler atlanır.
+"""
+import argparse
+import json
+import sys
+from src.config import AppConfig
+from src.bulk_inference import MODES
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline bulk inference over a JSONL file")
+    parser.add_argument("--config", type=str, default="config.yaml", help="Path to config file")
+    parser.add_argument("--input", type=str, required=True, help="JSONL (or JSON array) of questions")
+    parser.add_argument("--output", type=str, required=True, help="Results JSONL, appended to when resuming")
+    parser.add_argument("--mode", type=str, default="compare", choices=MODES, help="Which model(s) answer")
+    parser.add_argument("--adapter", type=str, default=None, help="Adapter under inference.adapters_root (default adapter if omitted)")
+    parser.add_argument("--batch-size", type=int, default=None, help="Questions per generate call, overriding inference.max_batch_size (default derived from it)")
+    parser.add_argument("--bucket-size", type=int, default=256, help="Questions read and sorted by length at a time")
+    parser.add_argument("--id-field", type=str, default="id", help="Record field with a unique id (default: line number)")
+    parser.add_argument("--question-field", type=str, default="question", help="Record field with the question")
+    args = parser.parse_args()
+
+    config = AppConfig.load_from_yaml(args.config)
+    # torch/transformers yalnızca config okunduktan sonra import edilir
+    from src.bulk_inference import run_bulk
+    from src.evaluator import Evaluator
+    evaluator = Evaluator(config)
+
+    if args.adapter:
+        try:
+            evaluator.check_adapter(args.adapter)
+        except (KeyError, ValueError) as e:
+            print(f"❌ {e.args[0]}")
+            sys.exit(1)
+
+    summary = run_bulk(
+        evaluator,
+        args.input,
+        args.output,
+        mode=args.mode,
+        adapter=args.adapter,
+        batch_size=args.batch_size,
+        bucket_size=args.bucket_size,
+        id_field=args.id_field,
+        question_field=args.question_field,
+    )
+    print(f"✅ {summary['questions']} answered, {summary['skipped']} already done -> {args.output}")
+    print(json.dumps(summary, indent=2))
+
+if __name__ == "__main__":
+    main()
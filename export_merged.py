@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+Eğitilmiş LoRA adapter'ını base ağırlıklarla birleştirip servis için safetensors checkpoint yazar.
+Evaluator'da kullanmak için config'e inference.merged_checkpoint ekleyin.
+"""
+import argparse
+from src.config import AppConfig
+from src.merge_export import DTYPES, export_merged
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a merged adapter checkpoint")
+    parser.add_argument("--config", type=str, default="config.yaml", help="Path to config file")
+    parser.add_argument("--adapter", type=str, default=None, help="Adapter directory (default: training.output_dir)")
+    parser.add_argument("--output", type=str, default=None, help="Output directory (default: <adapter>-merged)")
+    parser.add_argument("--dtype", type=str, default="float16", choices=sorted(DTYPES), help="Weight dtype of the checkpoint")
+    args = parser.parse_args()
+
+    config = AppConfig.load_from_yaml(args.config)
+    adapter_path = (args.adapter or config.training.output_dir).rstrip("/")
+    output_dir = args.output or f"{adapter_path}-merged"
+
+    manifest = export_merged(config.model, adapter_path, output_dir, args.dtype)
+    print(f"✅ {output_dir} (adapter sha256 {manifest['adapter_sha256'][:12]}, {manifest['dtype']})")
+
+if __name__ == "__main__":
+    main()
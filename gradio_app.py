@@ -3,29 +3,41 @@ import requests
 import json
 
 def compare_models(question):
+    # Cevaplar /compare/stream üzerinden token token gelir
+    answers = {"base_model": "", "finetuned_model": ""}
+    stats = {"base_model": "", "finetuned_model": ""}
+
+    def render():
+        return (
+            f"**Base Model**{stats['base_model']}:\n{answers['base_model']}",
+            f"**Fine-tuned Model**{stats['finetuned_model']}:\n{answers['finetuned_model']}"
+        )
+
     try:
-        response = requests.post(
-            "http://localhost:8000/compare",
+        with requests.post(
+            "http://localhost:8000/compare/stream",
             json={"question": question},
+            stream=True,
             timeout=120
-        )
-        if response.status_code == 200:
-            data = response.json()
-            base_answer = data["base_model"]["answer"]
-            finetuned_answer = data["finetuned_model"]["answer"]
-            base_time = data["base_model"]["response_time_ms"]
-            finetuned_time = data["finetuned_model"]["response_time_ms"]
-            
-            return (
-                f"**Base Model** ({base_time}ms):\n{base_answer}",
-                f"**Fine-tuned Model** ({finetuned_time}ms):\n{finetuned_answer}"
-            )
-        else:
-            error_msg = f"API Error: {response.status_code}"
-            return error_msg, error_msg
+        ) as response:
+            if response.status_code != 200:
+                error_msg = f"API Error: {response.status_code}"
+                yield error_msg, error_msg
+                return
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data: "):
+                    continue
+                event = json.loads(line[len("data: "):])
+                if event["type"] == "token":
+                    answers[event["model"]] += event["text"]
+                elif event["type"] == "done":
+                    stats[event["model"]] = f" ({event['total_ms']}ms, ilk token {event['ttft_ms']}ms)"
+                else:
+                    continue
+                yield render()
     except Exception as e:
         error_msg = f"Connection Error: {str(e)}"
-        return error_msg, error_msg
+        yield error_msg, error_msg
 
 with gr.Blocks(title="LLM Model Comparison") as demo:
     gr.Markdown("# 🤖 LLM Model Comparison Tool")
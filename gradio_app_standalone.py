@@ -1,7 +1,6 @@
 import gradio as gr
 import os
 from src.config import AppConfig
-from src.evaluator import Evaluator
 
 # Global evaluator
 evaluator = None
@@ -12,6 +11,8 @@ def initialize_evaluator():
     if os.path.exists(config_path):
         try:
             config = AppConfig.load_from_yaml(config_path)
+            # torch/transformers yalnızca model yüklenirken import edilir
+            from src.evaluator import Evaluator
             evaluator = Evaluator(config)
             return "✅ Model yüklendi!"
         except Exception as e:
@@ -21,22 +22,25 @@ def initialize_evaluator():
 
 def compare_models(question):
     if not evaluator:
-        return "❌ Model yüklenmedi", "❌ Model yüklenmedi"
+        yield "❌ Model yüklenmedi", "❌ Model yüklenmedi"
+        return
     
+    answers = {"base_model": "", "finetuned_model": ""}
+    stats = {"base_model": "", "finetuned_model": ""}
     try:
-        result = evaluator.compare(question)
-        base_answer = result["base_model"]["answer"]
-        finetuned_answer = result["finetuned_model"]["answer"]
-        base_time = result["base_model"]["response_time_ms"]
-        finetuned_time = result["finetuned_model"]["response_time_ms"]
-        
-        return (
-            f"**Base Model** ({base_time}ms):\n{base_answer}",
-            f"**Fine-tuned Model** ({finetuned_time}ms):\n{finetuned_answer}"
-        )
+        # Tokenlar üretildikçe ekrana yansır
+        for event in evaluator.stream_compare(question):
+            if event["type"] == "token":
+                answers[event["model"]] += event["text"]
+            elif event["type"] == "done":
+                stats[event["model"]] = f" ({event['total_ms']}ms)"
+            yield (
+                f"**Base Model**{stats['base_model']}:\n{answers['base_model'].strip()}",
+                f"**Fine-tuned Model**{stats['finetuned_model']}:\n{answers['finetuned_model'].strip()}"
+            )
     except Exception as e:
         error_msg = f"❌ Hata: {str(e)}"
-        return error_msg, error_msg
+        yield error_msg, error_msg
 
 with gr.Blocks(title="LLM Model Comparison") as demo:
     gr.Markdown("# 🤖 LLM Model Comparison Tool")
@@ -1,49 +1,95 @@
 import argparse
-from src.config import AppConfig
-from src.utils import setup_logger, print_system_info, set_seed
-from src.model_loader import load_model, load_tokenizer
-from src.data_handler import load_dataset
-from src.trainer import LLMTrainer
-import torch
+import json
 import os
+import sys
+from src.config import AppConfig
+from src.utils import setup_logger, print_system_info, set_seed, configure_cpu_threads
+
+# torch/transformers/peft are imported inside main() only for an actual training run,
+# so --help, --check-config and config errors return immediately
 
 # GPU kullanımını zorla
 os.environ["CUDA_VISIBLE_DEVICES"] = "0"
 os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "max_split_size_mb:512"
 
-# CPU thread sayısını sınırla
-torch.set_num_threads(4)
-os.environ["OMP_NUM_THREADS"] = "4"
-os.environ["MKL_NUM_THREADS"] = "4"
-
 logger = setup_logger("Main")
 
+def check_config(config: AppConfig) -> bool:
+    # Dry run: config and dataset only, nothing is tokenized or loaded
+    from src.records import validate_records
+
+    ok = True
+    try:
+        summary = validate_records(config.data.dataset_path)
+    except (FileNotFoundError, ValueError) as e:
+        logger.error(f"Dataset: {e}")
+        return False
+    logger.info(f"Dataset: {summary['records']} records in {summary['files']} file(s)")
+    if summary["records"] == 0 or summary["not_an_object"]:
+        logger.error(f"Dataset has {summary['not_an_object']} non-object record(s) out of {summary['records']}")
+        ok = False
+    for field in ("instruction", "output"):
+        if summary[f"missing_{field}"]:
+            logger.warning(f"{summary[f'missing_{field}']} record(s) have an empty '{field}'")
+
+    if config.data.streaming and config.data.packing:
+        logger.error("data.streaming and data.packing cannot be combined")
+        ok = False
+    if config.data.streaming and config.training.max_steps <= 0:
+        logger.error("data.streaming needs training.max_steps, the dataset length is unknown")
+        ok = False
+    if config.model.name_or_path.startswith(("/", "./", "../")) and not os.path.isdir(config.model.name_or_path):
+        logger.error(f"Model directory not found: {config.model.name_or_path}")
+        ok = False
+    return ok
+
 def main():
     parser = argparse.ArgumentParser(description="LLM Fine-Tuning Platform")
     parser.add_argument("--config", type=str, default="config.yaml", help="Path to config file")
+    parser.add_argument("--check-config", action="store_true", help="Validate the config and dataset, then exit")
+    parser.add_argument("--import-report", nargs="?", const="table", choices=["table", "json"],
+                        help="Measure import times of the project modules, then exit")
     args = parser.parse_args()
 
-    print_system_info()
-    set_seed(42)
+    if args.import_report:
+        from src.import_profile import format_report, import_report
+        rows = import_report()
+        print(json.dumps(rows, indent=2) if args.import_report == "json" else format_report(rows))
+        return
 
     logger.info(f"Loading configuration from {args.config}")
     try:
         config = AppConfig.load_from_yaml(args.config)
     except Exception as e:
         logger.error(f"Failed to load config: {e}")
-        return
+        sys.exit(1)
+
+    if args.check_config:
+        ok = check_config(config)
+        logger.info("Config OK" if ok else "Config check failed")
+        sys.exit(0 if ok else 1)
+
+    from src.model_loader import load_model, load_tokenizer
+    from src.data_handler import load_train_eval_datasets
+    from src.trainer import LLMTrainer
+
+    print_system_info()
+    set_seed(42)
+
+    # CPU thread sayısını config'e göre sınırla (model.max_cpu_threads)
+    configure_cpu_threads(config.model.max_cpu_threads)
 
     # Load Tokenizer
     tokenizer = load_tokenizer(config.model)
 
     # Load Dataset
-    dataset = load_dataset(config.data, tokenizer)
+    dataset, eval_dataset = load_train_eval_datasets(config.data, tokenizer, pad_to_max_length=config.training.batching == "fixed")
 
     # Load Model
     model = load_model(config.model, config.peft)
 
     # Initialize Trainer
-    trainer = LLMTrainer(config, model, tokenizer, dataset)
+    trainer = LLMTrainer(config, model, tokenizer, dataset, eval_dataset)
 
     # Start Training
     trainer.train()
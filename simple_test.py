@@ -4,7 +4,6 @@ Basit test scripti - Gradio olmadan
 """
 import os
 from src.config import AppConfig
-from src.evaluator import Evaluator
 
 def main():
     config_path = os.getenv("CONFIG_PATH", "config_gtx1650.yaml")
@@ -12,6 +11,8 @@ def main():
     try:
         print("🔄 Model yükleniyor...")
         config = AppConfig.load_from_yaml(config_path)
+        # torch/transformers yalnızca config okunduktan sonra import edilir
+        from src.evaluator import Evaluator
         evaluator = Evaluator(config)
         print("✅ Model yüklendi!")
         
@@ -0,0 +1,168 @@
+import glob
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence
+
+from peft import PeftModel
+
+from .utils import setup_logger
+
+logger = setup_logger("AdapterRegistry")
+
+# PEFT's name for "no adapter" in mixed-adapter batches
+BASE_ADAPTER_NAME = "__base__"
+
+
+def adapter_version(adapter_path: str) -> str:
+    # Changes whenever the adapter files are rewritten, without hashing the weights
+    parts = [os.path.abspath(adapter_path)]
+    for name in sorted(os.listdir(adapter_path)):
+        if name.startswith("adapter_"):
+            stat = os.stat(os.path.join(adapter_path, name))
+            parts.append(f"{name}:{stat.st_size}:{stat.st_mtime_ns}")
+    return "|".join(parts)
+
+
+class AdapterRegistry:
+    """LoRA adapters found under an experiments root, loaded on demand onto one base model.
+
+    Adapters are named after their directory. `ensure` loads whatever a batch needs and
+    evicts the least recently used ones beyond `max_resident` or `max_memory_mb`; an adapter
+    whose files changed on disk is reloaded. Loading only reads the adapter weights, the base
+    model stays in place. Mutates the model, so callers serialize it with generation.
+
+    Once `frozen` (the base layers were quantized, PEFT cannot attach adapters to them) only the
+    resident adapters are served, in the version that was loaded, and nothing is evicted.
+    """
+
+    def __init__(self, base_model, root: Optional[str] = None, max_resident: int = 4,
+                 max_memory_mb: Optional[float] = None, on_unload: Optional[Callable[[str], None]] = None):
+        self.model = base_model
+        self.root = root
+        self.max_resident = max_resident
+        self.max_memory_mb = max_memory_mb
+        self.on_unload = on_unload
+        self._paths: Dict[str, str] = {}
+        self._pinned = set()
+        # name -> (version, bytes), least recently used first
+        self._resident: "OrderedDict[str, tuple]" = OrderedDict()
+        self.frozen = False
+        self.loads = 0
+        self.reloads = 0
+        self.evictions = 0
+        self.load_ms = 0.0
+
+    @staticmethod
+    def peft_name(name: str) -> str:
+        # Adapter names end up in module keys, which cannot contain dots
+        return re.sub(r"[^0-9A-Za-z_]", "_", name)
+
+    def register(self, name: str, path: str, pinned: bool = False):
+        self._paths[name] = path
+        if pinned:
+            self._pinned.add(name)
+
+    def discover(self) -> Dict[str, str]:
+        if self.root:
+            for config_path in sorted(glob.glob(os.path.join(self.root, "*", "adapter_config.json"))):
+                path = os.path.dirname(config_path)
+                name = os.path.basename(path)
+                if name not in self._paths and os.path.abspath(path) not in map(os.path.abspath, self._paths.values()):
+                    self._paths[name] = path
+        return dict(self._paths)
+
+    def path(self, name: str) -> str:
+        if name not in self._paths:
+            # May have been trained since the last scan
+            self.discover()
+        if name not in self._paths:
+            raise KeyError(f"Unknown adapter: {name}")
+        return self._paths[name]
+
+    def version(self, name: str) -> str:
+        if self.frozen and name in self._resident:
+            return self._resident[name][0]
+        return adapter_version(self.path(name))
+
+    def check_loadable(self, name: str):
+        """Raises ValueError if `name` would have to be loaded but the registry is frozen."""
+        if self.frozen and name != BASE_ADAPTER_NAME and name not in self._resident:
+            raise ValueError(f"Adapter {name} is not loaded and adapters cannot be loaded onto a quantized model")
+
+    def ensure(self, names: Sequence[str]) -> List[str]:
+        """Make every adapter in `names` resident and return the PEFT adapter names to generate with."""
+        needed = [name for name in dict.fromkeys(names) if name != BASE_ADAPTER_NAME]
+        for name in needed:
+            self.check_loadable(name)
+            version = self.version(name)
+            if name in self._resident:
+                if self._resident[name][0] != version:
+                    logger.info(f"Adapter {name} changed on disk, reloading")
+                    self._unload(name)
+                    self.reloads += 1
+                    self._load(name, version)
+                self._resident.move_to_end(name)
+            else:
+                self._load(name, version)
+        self._evict(keep=set(needed))
+        return [name if name == BASE_ADAPTER_NAME else self.peft_name(name) for name in names]
+
+    def _load(self, name: str, version: str):
+        path = self._paths[name]
+        start = time.perf_counter()
+        if isinstance(self.model, PeftModel):
+            self.model.load_adapter(path, adapter_name=self.peft_name(name))
+        else:
+            self.model = PeftModel.from_pretrained(self.model, path, adapter_name=self.peft_name(name))
+        self.model.eval()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._resident[name] = (version, self._adapter_bytes(name))
+        self.loads += 1
+        self.load_ms += elapsed_ms
+        logger.info(f"Loaded adapter {name} from {path} in {elapsed_ms:.0f}ms")
+
+    def _unload(self, name: str):
+        self.model.delete_adapter(self.peft_name(name))
+        del self._resident[name]
+        if self.on_unload:
+            self.on_unload(name)
+
+    def _adapter_bytes(self, name: str) -> int:
+        marker = f".{self.peft_name(name)}."
+        return sum(p.numel() * p.element_size() for n, p in self.model.named_parameters() if marker in n)
+
+    def resident_mb(self) -> float:
+        return sum(size for _, size in self._resident.values()) / 2**20
+
+    def _over_budget(self) -> bool:
+        if len(self._resident) > self.max_resident:
+            return True
+        return self.max_memory_mb is not None and self.resident_mb() > self.max_memory_mb
+
+    def _evict(self, keep: set):
+        # Adapters of the current batch and pinned ones stay even if that overshoots the budget
+        for name in list(self._resident):
+            if not self._over_budget():
+                break
+            if name in keep or name in self._pinned:
+                continue
+            logger.info(f"Evicting adapter {name}")
+            self._unload(name)
+            self.evictions += 1
+
+    def stats(self) -> Dict:
+        return {
+            "available": sorted(self.discover()),
+            "resident": list(self._resident),
+            "pinned": sorted(self._pinned),
+            "resident_mb": round(self.resident_mb(), 2),
+            "max_resident": self.max_resident,
+            "max_memory_mb": self.max_memory_mb,
+            "frozen": self.frozen,
+            "loads": self.loads,
+            "reloads": self.reloads,
+            "evictions": self.evictions,
+            "avg_load_ms": round(self.load_ms / self.loads, 2) if self.loads else 0.0,
+        }
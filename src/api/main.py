@@ -1,55 +1,357 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
+from typing import List, Optional
 from ..config import AppConfig
-from ..evaluator import Evaluator
+from ..response_cache import ResponseCache
+from .metrics import CONTENT_TYPE, THROUGHPUT_BUCKETS, MetricsRegistry, process_memory
+from .scheduler import BatchScheduler, QueueFullError, SchedulerStoppedError
+import asyncio
+import json
 import os
 import contextlib
+import threading
+import time
 
 # Global objects
 evaluator = None
+scheduler = None
+response_cache = None
+# state: loading | ready | failed | disabled; timings in seconds per completed phase
+startup = {"state": "loading", "timings": {}, "error": None}
+
+# Served on /metrics. Generation metrics are labelled by model path: model="base" or
+# "finetuned" (with the adapter name), mode="batch" (scheduled) or "stream" (SSE)
+metrics = MetricsRegistry()
+GENERATION_LABELS = ["model", "adapter", "mode"]
+HTTP_REQUESTS = metrics.counter("llm_http_requests_total", "HTTP requests by route and status", ["route", "method", "status"])
+HTTP_LATENCY = metrics.histogram("llm_http_request_duration_seconds", "Time until the response starts (headers for streams)", ["route"])
+HTTP_IN_FLIGHT = metrics.gauge("llm_http_requests_in_flight", "HTTP requests being handled")
+ACTIVE_STREAMS = metrics.gauge("llm_active_streams", "SSE responses still streaming")
+GENERATIONS = metrics.counter("llm_generations_total", "Generated answers", GENERATION_LABELS)
+PROMPT_TOKENS = metrics.counter("llm_prompt_tokens_total", "Prompt tokens of scheduled generations", GENERATION_LABELS)
+GENERATED_TOKENS = metrics.counter("llm_generated_tokens_total", "Generated tokens", GENERATION_LABELS)
+QUEUE_WAIT = metrics.histogram("llm_queue_wait_seconds", "Time a question waited for its micro-batch")
+PREFILL_LATENCY = metrics.histogram("llm_prefill_seconds", "Prompt processing time until the first token", GENERATION_LABELS)
+DECODE_LATENCY = metrics.histogram("llm_decode_seconds", "Time from the first to the last token", GENERATION_LABELS)
+TOTAL_LATENCY = metrics.histogram("llm_generation_seconds", "Prefill plus decode time of one answer", GENERATION_LABELS)
+TTFT = metrics.histogram("llm_time_to_first_token_seconds", "From enqueue (batch) or request start (stream) to the first token", GENERATION_LABELS)
+DECODE_THROUGHPUT = metrics.histogram("llm_decode_tokens_per_second", "Per-answer decode speed", GENERATION_LABELS, buckets=THROUGHPUT_BUCKETS)
+metrics.gauge("llm_model_ready", "1 once the model is loaded", fn=lambda: int(startup["state"] == "ready"))
+metrics.gauge("llm_queue_depth", "Questions waiting for a micro-batch", fn=lambda: scheduler.queue_depth if scheduler else 0)
+metrics.gauge("llm_batch_rows_in_flight", "Questions in the micro-batch being generated", fn=lambda: scheduler.in_flight if scheduler else 0)
+metrics.gauge("llm_process_memory_bytes", "Process memory", ["type"], fn=process_memory)
+
+def cache_counts() -> dict:
+    # (hits, lookups) per cache; coalesced requests count as response cache hits
+    counts = {}
+    if response_cache is not None:
+        stats = response_cache.stats()
+        counts["response"] = (stats["hits"] + stats["coalesced"], stats["hits"] + stats["misses"] + stats["coalesced"])
+    if evaluator and evaluator.prefix_cache is not None:
+        stats = evaluator.prefix_cache.stats()
+        counts["prefix"] = (stats["hits"], stats["lookups"])
+    return counts
+
+metrics.counter("llm_cache_hits_total", "Cache hits", ["cache"],
+                fn=lambda: {(cache,): hits for cache, (hits, _) in cache_counts().items()})
+metrics.counter("llm_cache_lookups_total", "Cache lookups", ["cache"],
+                fn=lambda: {(cache,): lookups for cache, (_, lookups) in cache_counts().items()})
+metrics.gauge("llm_cache_hit_ratio", "Cache hits / lookups since startup", ["cache"],
+              fn=lambda: {(cache,): hits / lookups if lookups else 0.0 for cache, (hits, lookups) in cache_counts().items()})
+
+def observe_generation(model: str, adapter: Optional[str], mode: str, generated: int, prefill_s: float,
+                       total_s: float, ttft_s: float, prompt_tokens: Optional[int] = None):
+    labels = {"model": model, "adapter": (adapter or "") if model == "finetuned" else "", "mode": mode}
+    decode_s = max(0.0, total_s - prefill_s)
+    GENERATIONS.inc(**labels)
+    GENERATED_TOKENS.inc(generated, **labels)
+    if prompt_tokens is not None:
+        PROMPT_TOKENS.inc(prompt_tokens, **labels)
+    PREFILL_LATENCY.observe(prefill_s, **labels)
+    DECODE_LATENCY.observe(decode_s, **labels)
+    TOTAL_LATENCY.observe(total_s, **labels)
+    TTFT.observe(ttft_s, **labels)
+    if generated > 1 and decode_s > 0:
+        DECODE_THROUGHPUT.observe((generated - 1) / decode_s, **labels)
+
+def run_compare_batch(loaded, items: List[tuple]) -> List[dict]:
+    # items are (question, adapter, enqueued_at) triples
+    started = time.perf_counter()
+    results = loaded.compare_batch([q for q, _, _ in items], [a for _, a, _ in items])
+    for (_, adapter, enqueued_at), result in zip(items, results):
+        queue_wait = started - enqueued_at
+        QUEUE_WAIT.observe(queue_wait)
+        for model, row in (("base", result["base_model"]), ("finetuned", result["finetuned_model"])):
+            prefill_s = row["prefill_ms"] / 1000
+            observe_generation(
+                model, adapter or loaded.default_adapter, "batch", row["generated_tokens"], prefill_s,
+                row["response_time_ms"] / 1000, queue_wait + prefill_s, row["tokens_used"] - row["generated_tokens"],
+            )
+    return results
+
+def create_evaluator(config: AppConfig, timings: dict):
+    # transformers/peft are imported here, so the server itself starts without waiting for them
+    start = time.perf_counter()
+    from ..evaluator import Evaluator
+    timings["import"] = round(time.perf_counter() - start, 3)
+    return Evaluator(config, startup_timings=timings)
+
+async def load_evaluator(config: AppConfig):
+    global evaluator, scheduler, response_cache
+    start = time.perf_counter()
+    try:
+        # Runs on a thread: the event loop keeps answering /health and /ready meanwhile
+        loaded = await asyncio.to_thread(create_evaluator, config, startup["timings"])
+    except Exception as e:
+        startup.update(state="failed", error=str(e))
+        print(f"Model loading failed: {e}")
+        return
+
+    # Concurrent /compare calls are merged into micro-batches on one inference worker;
+    # one batch may mix adapters
+    scheduler = BatchScheduler(
+        lambda items: run_compare_batch(loaded, items),
+        max_batch_size=config.inference.max_batch_size,
+        max_wait_ms=config.inference.max_wait_ms,
+        max_queue_size=config.inference.max_queue_size,
+    )
+    await scheduler.start()
+    if config.inference.response_cache:
+        if loaded.deterministic:
+            response_cache = ResponseCache(config.inference.response_cache_size, config.inference.response_cache_ttl_s)
+        else:
+            print("Response cache disabled: sampling without inference.seed is not deterministic")
+    # Published last, so requests never see a half-initialized server
+    evaluator = loaded
+    startup["timings"]["total"] = round(time.perf_counter() - start, 3)
+    startup["state"] = "ready"
 
 @contextlib.asynccontextmanager
 async def lifespan(app: FastAPI):
-    global evaluator
     # Load config and initialize evaluator on startup
     # Assuming config.yaml is in the root where we run this
     config_path = os.getenv("CONFIG_PATH", "config.yaml")
+    loader = None
     if os.path.exists(config_path):
         config = AppConfig.load_from_yaml(config_path)
-        evaluator = Evaluator(config)
+        loader = asyncio.create_task(load_evaluator(config))
+        if not config.inference.background_load:
+            await loader
     else:
+        startup["state"] = "disabled"
         print(f"Warning: {config_path} not found. API generic mode.")
     yield
-    # Cleanup if needed
+    if loader and not loader.done():
+        # The loading thread cannot be interrupted; shutdown just stops waiting for it
+        loader.cancel()
+    if scheduler:
+        await scheduler.stop()
 
 app = FastAPI(title="LLM Fine-Tuning Platform API", lifespan=lifespan)
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_IN_FLIGHT.dec()
+        # The route template keeps label values bounded; unknown paths share one label
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        HTTP_REQUESTS.inc(route=path, method=request.method, status=status)
+        HTTP_LATENCY.observe(time.perf_counter() - start, route=path)
+
 class CompareRequest(BaseModel):
     question: str
+    adapter: Optional[str] = None  # Adapter directory under inference.adapters_root, default if omitted
 
 class ModelStats(BaseModel):
     answer: str
     tokens_used: int
     response_time_ms: float
+    tokens_per_s: Optional[float] = None
 
 class CompareResponse(BaseModel):
     question: str
     base_model: ModelStats
     finetuned_model: ModelStats
 
-@app.post("/compare", response_model=CompareResponse)
-async def compare_models(request: CompareRequest):
+class GenerateRequest(BaseModel):
+    question: str
+    use_adapter: bool = True
+    adapter: Optional[str] = None
+
+class CompareBatchRequest(BaseModel):
+    questions: List[str]
+    adapter: Optional[str] = None
+
+class CompareBatchResponse(BaseModel):
+    results: List[CompareResponse]
+
+def require_evaluator():
     if not evaluator:
+        if startup["state"] == "loading":
+            raise HTTPException(status_code=503, detail="Model is loading", headers={"Retry-After": "5"})
         raise HTTPException(status_code=503, detail="Evaluator not initialized")
-    
-    results = evaluator.compare(request.question)
-    return results
+
+def check_adapter(adapter: Optional[str]):
+    require_evaluator()
+    if adapter is not None:
+        try:
+            evaluator.check_adapter(adapter)
+        except KeyError as e:
+            raise HTTPException(status_code=404, detail=str(e.args[0]))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+async def schedule_compare(questions: List[str], adapter: Optional[str] = None) -> List[dict]:
+    require_evaluator()
+    enqueued_at = time.perf_counter()
+    try:
+        return await scheduler.submit_many([(question, adapter, enqueued_at) for question in questions])
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    except SchedulerStoppedError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+async def schedule_compare_one(question: str, adapter: Optional[str] = None) -> dict:
+    return (await schedule_compare([question], adapter))[0]
+
+async def cached_compare(question: str, adapter: Optional[str] = None) -> dict:
+    if response_cache is None:
+        return await schedule_compare_one(question, adapter)
+    key = ResponseCache.make_key(question, evaluator.cache_identity(adapter))
+    # Entries hold one result, so /compare and /compare/batch share them
+    result = await response_cache.get_or_compute(key, lambda: schedule_compare_one(question, adapter))
+    # The cached entry may come from a differently spaced variant of the question
+    return {**result, "question": question}
+
+@app.post("/compare", response_model=CompareResponse)
+async def compare_models(request: CompareRequest):
+    check_adapter(request.adapter)
+    return await cached_compare(request.question, request.adapter)
+
+@app.post("/compare/batch", response_model=CompareBatchResponse)
+async def compare_models_batch(request: CompareBatchRequest):
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="questions must not be empty")
+    check_adapter(request.adapter)
+
+    if response_cache is None:
+        results = await schedule_compare(request.questions, request.adapter)
+    else:
+        # All misses go to the scheduler in one submit_many, so a 429 leaves none of them running
+        identity = evaluator.cache_identity(request.adapter)
+        keys = [ResponseCache.make_key(q, identity) for q in request.questions]
+        results = await response_cache.get_or_compute_many(
+            keys, lambda indices: schedule_compare([request.questions[i] for i in indices], request.adapter)
+        )
+        # Cached entries may come from differently spaced variants of the questions
+        results = [{**result, "question": q} for result, q in zip(results, request.questions)]
+    return {"results": results}
+
+def observe_stream_event(event: dict, model: Optional[str], adapter: Optional[str]):
+    if event["type"] != "done":
+        return
+    # Compare streams tag every event with base_model/finetuned_model
+    model = {"base_model": "base", "finetuned_model": "finetuned"}.get(event.get("model"), model)
+    ttft_s = event["ttft_ms"] / 1000
+    observe_generation(model, adapter or evaluator.default_adapter, "stream", event["tokens"],
+                       ttft_s, event["total_ms"] / 1000, ttft_s)
+
+def _close_events(events, pending: asyncio.Future):
+    # Called once the in-flight next() has returned; its outcome was either consumed or is moot
+    if not pending.cancelled():
+        pending.exception()
+    events.close()
+
+async def sse_events(events, cancel: threading.Event, model: Optional[str] = None, adapter: Optional[str] = None):
+    # The evaluator iterator blocks on the decoding thread, so pull each event off the event loop
+    ACTIVE_STREAMS.inc()
+    pending = None
+    try:
+        while True:
+            # Shielded: a disconnect must not abandon the thread still running next()
+            pending = asyncio.ensure_future(asyncio.to_thread(next, events, None))
+            event = await asyncio.shield(pending)
+            if event is None:
+                break
+            observe_stream_event(event, model, adapter)
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+        yield f"data: {json.dumps({'type': 'end'})}\n\n"
+    finally:
+        ACTIVE_STREAMS.dec()
+        # Client gone or stream finished: the event stops generation even while next() is running
+        cancel.set()
+        if pending is None or pending.done():
+            events.close()
+        else:
+            # Closing a generator that is still executing raises ValueError, so wait for next() to return
+            pending.add_done_callback(lambda task: _close_events(events, task))
+
+def sse_response(events, cancel: threading.Event, model: Optional[str] = None,
+                 adapter: Optional[str] = None) -> StreamingResponse:
+    return StreamingResponse(
+        sse_events(events, cancel, model, adapter),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/compare/stream")
+async def compare_models_stream(request: CompareRequest):
+    check_adapter(request.adapter)
+    cancel = threading.Event()
+    return sse_response(evaluator.stream_compare(request.question, request.adapter, cancel=cancel), cancel,
+                        adapter=request.adapter)
+
+@app.post("/generate/stream")
+async def generate_stream(request: GenerateRequest):
+    check_adapter(request.adapter)
+    cancel = threading.Event()
+    return sse_response(
+        evaluator.stream_batch([request.question], use_adapter=request.use_adapter, adapter=request.adapter, cancel=cancel),
+        cancel,
+        model="finetuned" if request.use_adapter else "base",
+        adapter=request.adapter,
+    )
+
+@app.get("/adapters")
+def list_adapters():
+    require_evaluator()
+    return {"default": evaluator.default_adapter, "merged": evaluator.merged_manifest, **evaluator.adapters.stats()}
+
+@app.get("/cache/stats")
+def cache_stats():
+    stats = {"response_cache": {"enabled": False}, "prefix_cache": {"enabled": False}}
+    if response_cache is not None:
+        stats["response_cache"] = {"enabled": True, **response_cache.stats()}
+    if evaluator and evaluator.prefix_cache is not None:
+        stats["prefix_cache"] = {"enabled": True, **evaluator.prefix_cache.stats()}
+    return stats
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    # async on purpose: rendering never waits for the worker threads running generate()
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
 
 @app.get("/health")
 def health_check():
-    return {"status": "ok"}
+    # Liveness only: answers while the model is still loading
+    return {"status": "ok", "state": startup["state"]}
+
+@app.get("/ready")
+def readiness_check():
+    body = {"ready": startup["state"] == "ready", **startup}
+    if not body["ready"]:
+        return JSONResponse(status_code=503, content=body)
+    return body
 
 @app.get("/web")
 def web_interface():
@@ -0,0 +1,157 @@
+import asyncio
+from typing import Any, Callable, List, Optional, Tuple
+
+from ..utils import setup_logger
+
+logger = setup_logger("Scheduler")
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class SchedulerStoppedError(Exception):
+    pass
+
+
+class BatchScheduler:
+    """Collects concurrent requests into micro-batches for a single inference worker.
+
+    Callers await `submit`; the worker takes the first queued item, waits up to
+    `max_wait_ms` for more (up to `max_batch_size`), runs `batch_fn` on a thread so the
+    event loop keeps serving, and resolves every caller's future with its own result.
+
+    A request that fits in `max_queue_size` is admitted or rejected as a whole. A larger one
+    could never fit at once, so it is admitted in chunks as the worker drains the queue;
+    only its first chunk can be rejected.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 8,
+                 max_wait_ms: float = 10.0, max_queue_size: int = 64):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue_size = max_queue_size
+        self.in_flight = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._dequeued: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._dequeued = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._queue is not None and not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(SchedulerStoppedError("Scheduler stopped"))
+        if self._dequeued is not None:
+            # Wakes requests waiting for room so they fail instead of waiting forever
+            self._dequeued.set()
+
+    async def submit(self, item: Any) -> Any:
+        return (await self.submit_many([item]))[0]
+
+    async def submit_many(self, items: List[Any]) -> List[Any]:
+        if not self.running:
+            raise SchedulerStoppedError("Scheduler is not running")
+        # All-or-nothing admission of the first chunk, so a rejected request never half-fills the queue
+        first = items[:self.max_queue_size]
+        if self.queue_depth + len(first) > self.max_queue_size:
+            raise QueueFullError(f"Queue full ({self.queue_depth}/{self.max_queue_size})")
+
+        futures = self._enqueue(first)
+        rest = items[len(first):]
+        try:
+            while rest:
+                room = self.max_queue_size - self.queue_depth
+                if room > 0:
+                    futures += self._enqueue(rest[:room])
+                    rest = rest[room:]
+                    continue
+                self._dequeued.clear()
+                await self._dequeued.wait()
+                if not self.running:
+                    raise SchedulerStoppedError("Scheduler stopped")
+            return list(await asyncio.gather(*futures))
+        except BaseException:
+            # Queued chunks of a cancelled or failed request are dropped by the worker
+            for future in futures:
+                future.cancel()
+            raise
+
+    def _enqueue(self, items: List[Any]) -> List[asyncio.Future]:
+        loop = asyncio.get_running_loop()
+        futures = []
+        for item in items:
+            future = loop.create_future()
+            self._queue.put_nowait((item, future))
+            futures.append(future)
+        return futures
+
+    async def _collect(self) -> List[Tuple[Any, asyncio.Future]]:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            getter = asyncio.ensure_future(self._queue.get())
+            try:
+                done, _ = await asyncio.wait({getter}, timeout=timeout)
+            except asyncio.CancelledError:
+                getter.cancel()
+                raise
+            if not done:
+                getter.cancel()
+                # get() may have taken an item just before the cancellation landed; keep it rather than lose it
+                await asyncio.wait({getter})
+                if getter.cancelled():
+                    break
+            batch.append(getter.result())
+        self._dequeued.set()
+        # Callers that disconnected while queued are dropped before spending compute on them
+        return [(item, future) for item, future in batch if not future.done()]
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+
+            self.in_flight = len(batch)
+            try:
+                results = await asyncio.to_thread(self.batch_fn, [item for item, _ in batch])
+            except Exception as e:
+                logger.error(f"Batch of {len(batch)} failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finally:
+                self.in_flight = 0
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
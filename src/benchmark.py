@@ -0,0 +1,333 @@
+import json
+import os
+import platform
+import shutil
+import subprocess
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+from transformers import TrainerCallback
+
+from .config import AppConfig
+from .records import format_prompt, format_sample, iter_records, split_sample
+from .utils import setup_logger
+
+logger = setup_logger("Benchmark")
+
+BENCHMARK_VERSION = 1
+DEFAULT_DATASETS = ("dataset.json", "Zogoria_QA_clean.json")
+
+
+def metric(value: float, unit: str, higher_is_better: bool, gate: bool = True) -> Dict:
+    # gate=False metrics (tail latencies) are reported but too noisy to fail a run on
+    return {"value": round(float(value), 4), "unit": unit, "higher_is_better": higher_is_better, "gate": gate}
+
+
+def latency_metrics(prefix: str, seconds: Sequence[float]) -> Dict[str, Dict]:
+    ms = np.asarray(seconds) * 1000
+    return {
+        f"{prefix}.p50_ms": metric(np.percentile(ms, 50), "ms", False),
+        f"{prefix}.p90_ms": metric(np.percentile(ms, 90), "ms", False, gate=False),
+        f"{prefix}.p99_ms": metric(np.percentile(ms, 99), "ms", False, gate=False),
+    }
+
+
+def make_tiny_model(path: str, texts: Sequence[str], vocab_size: int = 2000, n_layer: int = 2,
+                    n_embd: int = 128, n_head: int = 4, n_positions: int = 512) -> str:
+    """Randomly initialised GPT-2 with a byte-level BPE tokenizer trained on `texts`; no hub access."""
+    from tokenizers import ByteLevelBPETokenizer
+    from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+
+    os.makedirs(path, exist_ok=True)
+    eos = "<|endoftext|>"
+    bpe = ByteLevelBPETokenizer()
+    bpe.train_from_iterator(texts, vocab_size=vocab_size, special_tokens=[eos], show_progress=False)
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=bpe._tokenizer, eos_token=eos, bos_token=eos, unk_token=eos)
+    tokenizer.save_pretrained(path)
+
+    torch.manual_seed(0)
+    config = GPT2Config(
+        vocab_size=len(tokenizer), n_layer=n_layer, n_embd=n_embd, n_head=n_head, n_positions=n_positions,
+        bos_token_id=tokenizer.eos_token_id, eos_token_id=tokenizer.eos_token_id,
+    )
+    GPT2LMHeadModel(config).save_pretrained(path, safe_serialization=True)
+    return path
+
+
+def make_random_adapter(model_path: str, adapter_path: str, r: int = 8, seed: int = 0) -> str:
+    # Non-zero LoRA B so the fine-tuned path really differs from the base model
+    from peft import LoraConfig, get_peft_model
+    from transformers import AutoModelForCausalLM
+
+    model = get_peft_model(
+        AutoModelForCausalLM.from_pretrained(model_path),
+        LoraConfig(r=r, lora_alpha=2 * r, target_modules=["c_attn"], task_type="CAUSAL_LM"),
+    )
+    generator = torch.Generator().manual_seed(seed)
+    for name, param in model.named_parameters():
+        if "lora_B" in name:
+            param.data = torch.randn(param.shape, generator=generator) * 0.02
+    model.save_pretrained(adapter_path)
+    return adapter_path
+
+
+def bench_config(work_dir: str, data_dir: str, model_path: str, **sections) -> AppConfig:
+    config = {
+        "model": {"name_or_path": model_path, "quantization_bit": None, "device": "cpu"},
+        "peft": {"r": 8, "lora_alpha": 16, "target_modules": ["c_attn"]},
+        "training": {"output_dir": os.path.join(work_dir, "experiments", "bench"), "optim": "adamw_torch",
+                     "resume_from_checkpoint": False, "logging_steps": 10 ** 6, "save_steps": 10 ** 6},
+        "data": {"dataset_path": data_dir, "max_seq_length": 256,
+                 "token_cache_dir": os.path.join(work_dir, "token_cache")},
+    }
+    for section, values in sections.items():
+        config.setdefault(section, {}).update(values)
+    return AppConfig(**config)
+
+
+def bench_data(config: AppConfig, tokenizer, repeats: int) -> Dict[str, Dict]:
+    from .data_handler import DynamicPaddingCollator, TokenBudgetBatchSampler, load_dataset
+    from .records import resolve_dataset_files
+    from .token_cache import build_token_cache
+    from torch.utils.data import DataLoader
+
+    results = {}
+    files = resolve_dataset_files(config.data.dataset_path)
+    samples = [split_sample(item, tokenizer.eos_token) for path in files for item in iter_records(path)]
+    work_dir = os.path.dirname(config.data.token_cache_dir)
+
+    # Tokenization into the token cache, the cold-start cost of every new dataset
+    rates = []
+    for i in range(repeats):
+        path = os.path.join(work_dir, "bench_cache", str(i))
+        start = time.perf_counter()
+        build_token_cache(path, samples, tokenizer, config.data.max_seq_length)
+        rates.append(len(samples) / (time.perf_counter() - start))
+    results["data.tokenize.samples_per_s"] = metric(np.median(rates), "samples/s", True)
+
+    load_dataset(config.data, tokenizer)  # builds the cache, the timed call below is a hit
+    start = time.perf_counter()
+    dataset = load_dataset(config.data, tokenizer)
+    results["data.cache_hit_load_ms"] = metric((time.perf_counter() - start) * 1000, "ms", False)
+
+    for padded in (True, False):
+        dataset.pad_to_max_length = padded
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for index in range(len(dataset)):
+                dataset[index]
+        rate = repeats * len(dataset) / (time.perf_counter() - start)
+        results[f"data.getitem.{'padded' if padded else 'unpadded'}.samples_per_s"] = metric(rate, "samples/s", True)
+
+    response_only = config.data.supervision == "response"
+    loaders = {
+        "fixed": lambda: DataLoader(dataset, batch_size=4, shuffle=True,
+                                    collate_fn=DynamicPaddingCollator(tokenizer.pad_token_id, response_only=response_only)),
+        "token_budget": lambda: DataLoader(dataset, collate_fn=DynamicPaddingCollator(tokenizer.pad_token_id, 8, response_only),
+                                           batch_sampler=TokenBudgetBatchSampler(dataset.lengths, 1024, seed=0)),
+    }
+    for name, make_loader in loaders.items():
+        dataset.pad_to_max_length = name == "fixed"
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for _ in make_loader():
+                pass
+        rate = repeats * len(dataset) / (time.perf_counter() - start)
+        results[f"data.loader.{name}.samples_per_s"] = metric(rate, "samples/s", True)
+    return results
+
+
+class StepTimer(TrainerCallback):
+    def __init__(self):
+        self.durations: List[float] = []
+        self._start = None
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        self._start = time.perf_counter()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        self.durations.append(time.perf_counter() - self._start)
+
+
+class TokenCountingCollator:
+    # Counts the real (unpadded) tokens of every batch handed to the model
+    def __init__(self, collator: Callable):
+        self.collator = collator
+        self.tokens = 0
+        self.samples = 0
+
+    def __call__(self, features):
+        batch = self.collator(features)
+        if "attention_mask" in batch:
+            self.tokens += int(batch["attention_mask"].sum())
+        else:
+            self.tokens += batch["input_ids"].numel()
+        self.samples += batch["input_ids"].shape[0]
+        return batch
+
+
+def bench_train(config: AppConfig, tokenizer, steps: int, warmup_steps: int = 2) -> Dict[str, Dict]:
+    from peft import LoraConfig, get_peft_model
+    from transformers import AutoModelForCausalLM
+    from .data_handler import load_dataset
+    from .trainer import LLMTrainer
+
+    results = {}
+    for batching in ("fixed", "token_budget"):
+        run_config = config.model_copy(deep=True)
+        run_config.training.batching = batching
+        run_config.training.batch_size = 4
+        run_config.training.gradient_accumulation_steps = 1
+        run_config.training.max_tokens_per_batch = 1024
+        run_config.training.max_steps = warmup_steps + steps
+
+        torch.manual_seed(0)
+        model = get_peft_model(
+            AutoModelForCausalLM.from_pretrained(config.model.name_or_path),
+            LoraConfig(r=config.peft.r, lora_alpha=config.peft.lora_alpha,
+                       target_modules=config.peft.target_modules, task_type="CAUSAL_LM"),
+        )
+        dataset = load_dataset(run_config.data, tokenizer, pad_to_max_length=batching == "fixed")
+        timer = StepTimer()
+        trainer = LLMTrainer(run_config, model, tokenizer, dataset).build_trainer(callbacks=[timer])
+        counter = TokenCountingCollator(trainer.data_collator)
+        trainer.data_collator = counter
+        trainer.train()
+
+        # The first steps include allocator and autograd warmup
+        timed = timer.durations[warmup_steps:]
+        per_step = counter.tokens / len(timer.durations)
+        results.update(latency_metrics(f"train.{batching}.step", timed))
+        results[f"train.{batching}.tokens_per_s"] = metric(per_step * len(timed) / sum(timed), "tokens/s", True)
+    return results
+
+
+def bench_generation(config: AppConfig, questions: List[str], batch_sizes: Sequence[int], repeats: int) -> Dict[str, Dict]:
+    from .evaluator import Evaluator
+
+    results = {}
+    evaluator = Evaluator(config)
+    tokenizer = evaluator.tokenizer
+
+    def generated_tokens(question: str, row: Dict) -> int:
+        return row["tokens_used"] - len(tokenizer(format_prompt(question))["input_ids"])
+
+    latencies = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        evaluator.generate_response(questions[i % len(questions)], use_adapter=True)
+        latencies.append(time.perf_counter() - start)
+    results.update(latency_metrics("generate.single", latencies))
+
+    for batch_size in batch_sizes:
+        batch = [questions[i % len(questions)] for i in range(batch_size)]
+        latencies, tokens = [], 0
+        for _ in range(repeats):
+            start = time.perf_counter()
+            rows = evaluator.generate_batch(batch, use_adapter=True)
+            latencies.append(time.perf_counter() - start)
+            tokens += sum(generated_tokens(q, row) for q, row in zip(batch, rows))
+        results.update(latency_metrics(f"generate.batch{batch_size}", latencies))
+        results[f"generate.batch{batch_size}.tokens_per_s"] = metric(tokens / sum(latencies), "tokens/s", True)
+
+        latencies = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            evaluator.compare_batch(batch)
+            latencies.append(time.perf_counter() - start)
+        results.update(latency_metrics(f"compare.batch{batch_size}", latencies))
+        results[f"compare.batch{batch_size}.pairs_per_s"] = metric(batch_size * repeats / sum(latencies), "pairs/s", True)
+    return results
+
+
+def environment() -> Dict:
+    import transformers
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "benchmark_version": BENCHMARK_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": commit or None,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+    }
+
+
+def run_benchmarks(work_dir: str, suites: Sequence[str], datasets: Sequence[str] = DEFAULT_DATASETS,
+                   quick: bool = False) -> Dict:
+    """Build the tiny model and adapter under `work_dir`, run the selected suites and return the report."""
+    repeats = 3 if quick else 10
+    shutil.rmtree(work_dir, ignore_errors=True)
+    data_dir = os.path.join(work_dir, "data")
+    os.makedirs(data_dir)
+    for path in datasets:
+        shutil.copy(path, data_dir)
+
+    records = [item for path in datasets for item in iter_records(path)]
+    texts = [format_sample(item, "") for item in records]
+    model_path = make_tiny_model(os.path.join(work_dir, "model"), texts)
+    config = bench_config(work_dir, data_dir, model_path)
+
+    from .model_loader import load_tokenizer
+    tokenizer = load_tokenizer(config.model)
+
+    metrics = {}
+    if "data" in suites:
+        logger.info("Benchmark: data pipeline")
+        metrics.update(bench_data(config, tokenizer, repeats))
+    if "train" in suites:
+        logger.info("Benchmark: training steps")
+        metrics.update(bench_train(config, tokenizer, steps=5 if quick else 20))
+    if "generate" in suites:
+        logger.info("Benchmark: generation")
+        make_random_adapter(model_path, config.training.output_dir)
+        gen_config = config.model_copy(deep=True)
+        gen_config.inference.do_sample = False
+        gen_config.inference.max_new_tokens = 32
+        gen_config.inference.adapters_root = os.path.dirname(config.training.output_dir)
+        questions = [item["instruction"] for item in records]
+        metrics.update(bench_generation(gen_config, questions, (1, 4, 8), repeats))
+
+    return {"meta": {**environment(), "quick": quick, "suites": list(suites)}, "metrics": metrics}
+
+
+def compare_to_baseline(report: Dict, baseline: Dict, threshold: float) -> List[Dict]:
+    """Relative change of every metric present in both reports; gated ones worse than `threshold` regress."""
+    rows = []
+    for name, current in report["metrics"].items():
+        previous = baseline.get("metrics", {}).get(name)
+        if previous is None or not previous["value"]:
+            continue
+        change = (current["value"] - previous["value"]) / previous["value"]
+        worse = -change if current["higher_is_better"] else change
+        rows.append({
+            "metric": name,
+            "baseline": previous["value"],
+            "current": current["value"],
+            "change": round(change, 4),
+            "regression": current["gate"] and worse > threshold,
+        })
+    return rows
+
+
+def format_comparison(rows: List[Dict]) -> str:
+    lines = [f"{'metric':<42} {'baseline':>12} {'current':>12} {'change':>8}"]
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        lines.append(f"{row['metric']:<42} {row['baseline']:>12.2f} {row['current']:>12.2f} {row['change']:>+8.1%}{flag}")
+    return "\n".join(lines)
+
+
+def load_report(path: str) -> Optional[Dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
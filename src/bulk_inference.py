@@ -0,0 +1,130 @@
+import json
+import os
+import time
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from .records import iter_records
+from .utils import setup_logger
+
+logger = setup_logger("BulkInference")
+
+MODES = ("base", "finetuned", "compare")
+
+def iter_questions(input_path: str, id_field: str = "id", question_field: str = "question") -> Iterator[Tuple[str, str]]:
+    # (id, question) per record; records without an id are keyed by their position in the file
+    for index, record in enumerate(iter_records(input_path)):
+        if isinstance(record, str):
+            yield str(index), record
+            continue
+        question = record.get(question_field)
+        if not question:
+            logger.warning(f"Record {index} has no '{question_field}', skipped")
+            continue
+        yield str(record.get(id_field, index)), question
+
+def completed_ids(output_path: str) -> Set[str]:
+    """IDs already in `output_path`. A torn last line from a crash is cut off so appending stays valid."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    valid_end = 0
+    with open(output_path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                done.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError):
+                break
+            valid_end += len(line)
+    if valid_end != os.path.getsize(output_path):
+        logger.warning(f"Truncating an incomplete record at the end of {output_path}")
+        with open(output_path, "r+b") as f:
+            f.truncate(valid_end)
+    return done
+
+def iter_buckets(items: Iterator[Tuple[str, str]], bucket_size: int) -> Iterator[List[Tuple[str, str]]]:
+    bucket = []
+    for item in items:
+        bucket.append(item)
+        if len(bucket) == bucket_size:
+            yield bucket
+            bucket = []
+    if bucket:
+        yield bucket
+
+def run_bulk(evaluator, input_path: str, output_path: str, mode: str = "compare", adapter: Optional[str] = None,
+             batch_size: Optional[int] = None, bucket_size: int = 256, id_field: str = "id",
+             question_field: str = "question", progress: bool = True) -> Dict:
+    """Answer every question of `input_path` and append one JSON line per question to `output_path`.
+
+    Questions are read `bucket_size` at a time, sorted by prompt token length and generated in
+    batches of `batch_size` (which overrides inference.max_batch_size when given), so rows of one
+    generate call need little padding. Each batch is written and flushed before the next starts;
+    a rerun skips IDs already in the output.
+    """
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {', '.join(MODES)}")
+    if adapter is not None:
+        # Raises KeyError for an unknown adapter (ValueError if it cannot be loaded) before any work is done
+        evaluator.check_adapter(adapter)
+    configured = evaluator.config.inference.max_batch_size
+    max_rows = None
+    if batch_size is None:
+        # compare runs base and fine-tuned rows of a question in the same generate call
+        batch_size = configured if mode != "compare" else max(1, configured // 2)
+    else:
+        # An explicit batch size overrides inference.max_batch_size, which would otherwise re-split each batch
+        max_rows = batch_size * 2 if mode == "compare" else batch_size
+        if max_rows > configured:
+            logger.info(f"Batch size {batch_size} overrides inference.max_batch_size ({configured}): "
+                        f"up to {max_rows} rows per generate call")
+
+    done = completed_ids(output_path)
+    if done:
+        logger.info(f"Resuming: {len(done)} question(s) already in {output_path}")
+    pending = ((qid, q) for qid, q in iter_questions(input_path, id_field, question_field) if qid not in done)
+
+    from tqdm import tqdm
+    bar = tqdm(desc="Questions", unit="q", disable=not progress)
+    questions = generated_tokens = 0
+    start = time.perf_counter()
+    with open(output_path, "a", encoding="utf-8") as out:
+        for bucket in iter_buckets(pending, bucket_size):
+            lengths = [len(ids) for ids in evaluator.tokenizer([q for _, q in bucket])["input_ids"]]
+            ordered = [item for _, item in sorted(zip(lengths, bucket), key=lambda pair: pair[0])]
+            for offset in range(0, len(ordered), batch_size):
+                batch = ordered[offset:offset + batch_size]
+                texts = [q for _, q in batch]
+                if mode == "compare":
+                    results = evaluator.compare_batch(texts, [adapter] * len(texts), max_batch_size=max_rows)
+                else:
+                    rows = evaluator.generate_batch(texts, use_adapter=mode == "finetuned", adapter=adapter,
+                                                    max_batch_size=max_rows)
+                    results = [{"question": q, f"{mode}_model": row} for q, row in zip(texts, rows)]
+
+                for (qid, _), result in zip(batch, results):
+                    out.write(json.dumps({"id": qid, **result}, ensure_ascii=False) + "\n")
+                    generated_tokens += sum(
+                        result[key]["generated_tokens"] for key in ("base_model", "finetuned_model") if key in result
+                    )
+                out.flush()
+                questions += len(batch)
+                elapsed = time.perf_counter() - start
+                bar.update(len(batch))
+                bar.set_postfix(tokens_per_s=round(generated_tokens / elapsed))
+    bar.close()
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "questions": questions,
+        "skipped": len(done),
+        "generated_tokens": generated_tokens,
+        "seconds": round(elapsed, 2),
+        "questions_per_s": round(questions / elapsed, 3) if elapsed > 0 else 0.0,
+        "tokens_per_s": round(generated_tokens / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+    logger.info(
+        f"Answered {questions} question(s) in {elapsed:.1f}s: "
+        f"{summary['questions_per_s']:.2f} questions/s, {summary['tokens_per_s']:.1f} tokens/s"
+    )
+    return summary
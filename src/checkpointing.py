@@ -0,0 +1,117 @@
+import os
+import re
+import shutil
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+import torch
+from .utils import setup_logger
+
+logger = setup_logger("Checkpointing")
+
+CHECKPOINT_PATTERN = re.compile(r"^checkpoint-(\d+)$")
+TMP_PREFIX = ".tmp-"
+
+def to_cpu(obj):
+    # Detached CPU copies of every tensor in a nested state dict, so training can keep updating the originals
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {key: to_cpu(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(value) for value in obj)
+    return obj
+
+def _fsync(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def rotate_checkpoints(output_dir: str, keep_last: Optional[int], best_checkpoint: Optional[str] = None):
+    """Deletes every `checkpoint-N` in `output_dir` except the newest `keep_last` and the best one."""
+    if keep_last is None or not os.path.isdir(output_dir):
+        return
+    steps = sorted(
+        (int(match.group(1)), name)
+        for name in os.listdir(output_dir)
+        if (match := CHECKPOINT_PATTERN.match(name)) and os.path.isdir(os.path.join(output_dir, name))
+    )
+    keep = {name for _, name in steps[-keep_last:]}
+    if best_checkpoint:
+        keep.add(os.path.basename(os.path.normpath(best_checkpoint)))
+    for _, name in steps:
+        if name not in keep:
+            logger.info(f"Deleting {name} (keeping the last {keep_last} and the best checkpoint)")
+            shutil.rmtree(os.path.join(output_dir, name), ignore_errors=True)
+
+class CheckpointWriter:
+    """Writes checkpoint directories from in-memory snapshots, on a background thread by default.
+
+    Files go into `.tmp-checkpoint-N` and the directory is renamed to `checkpoint-N` once all of
+    them are synced to disk, so get_last_checkpoint never picks up a partial checkpoint; leftovers
+    of an interrupted write are removed on start. At most one write is in flight: the next submit
+    waits for it, which bounds the host memory held by snapshots. After each write, retention
+    keeps the newest `keep_last` checkpoints plus the best one.
+    """
+
+    def __init__(self, output_dir: str, keep_last: Optional[int] = None, background: bool = True):
+        self.output_dir = output_dir
+        self.keep_last = keep_last
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint") if background else None
+        self._pending: Optional[Future] = None
+        self._remove_partial()
+
+    def _remove_partial(self):
+        if not os.path.isdir(self.output_dir):
+            return
+        for name in os.listdir(self.output_dir):
+            if name.startswith(TMP_PREFIX) and CHECKPOINT_PATTERN.match(name[len(TMP_PREFIX):]):
+                logger.warning(f"Removing incomplete checkpoint {name}")
+                shutil.rmtree(os.path.join(self.output_dir, name), ignore_errors=True)
+
+    def wait(self) -> float:
+        """Blocks until the pending write is done, re-raising its error; returns the seconds waited."""
+        if self._pending is None:
+            return 0.0
+        start = time.perf_counter()
+        pending, self._pending = self._pending, None
+        pending.result()
+        return time.perf_counter() - start
+
+    def submit(self, name: str, files: Dict[str, Callable[[str], None]], best_checkpoint: Optional[str] = None):
+        """Writes `output_dir/name`; `files` maps each file name to a function writing it to a given path."""
+        self.wait()
+        if self._executor is None:
+            self._write(name, files, best_checkpoint)
+        else:
+            self._pending = self._executor.submit(self._write, name, files, best_checkpoint)
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def _write(self, name: str, files: Dict[str, Callable[[str], None]], best_checkpoint: Optional[str]):
+        start = time.perf_counter()
+        final = os.path.join(self.output_dir, name)
+        tmp = os.path.join(self.output_dir, TMP_PREFIX + name)
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        size = 0
+        for filename, write in files.items():
+            path = os.path.join(tmp, filename)
+            write(path)
+            _fsync(path)
+            size += os.path.getsize(path)
+        if os.path.exists(final):
+            # The same step saved again (a resumed run); the new directory replaces it as a whole
+            shutil.rmtree(final)
+        os.replace(tmp, final)
+        _fsync(self.output_dir)
+        logger.info(f"Wrote {final} ({size / 2**20:.1f} MiB) in {time.perf_counter() - start:.2f}s")
+        rotate_checkpoints(self.output_dir, self.keep_last, best_checkpoint)
@@ -8,6 +8,11 @@ class ModelConfig(BaseModel):
     quantization_bit: Optional[int] = Field(4, description="4 or 8 bit quantization")
     use_gradient_checkpointing: bool = True
     trust_remote_code: bool = False
+    device: str = Field("cuda", description="'cuda', 'cpu' (inference only) or 'auto'")
+    cpu_dtype: str = Field("float32", description="Weight dtype on the CPU backend: 'float32' or 'bfloat16'")
+    dynamic_int8: bool = Field(False, description="CPU backend: dynamically quantize nn.Linear layers to int8. "
+                               "Only the default adapter is served then; requests for other adapters get a 400")
+    max_cpu_threads: Optional[int] = Field(None, description="torch intra-op threads; defaults to the physical core count")
     
     @validator("quantization_bit")
     def validate_quantization(cls, v):
@@ -15,6 +20,18 @@ class ModelConfig(BaseModel):
             raise ValueError("Quantization must be 4, 8, or None")
         return v
 
+    @validator("device")
+    def validate_device(cls, v):
+        if v not in ["cuda", "cpu", "auto"]:
+            raise ValueError("Device must be 'cuda', 'cpu' or 'auto'")
+        return v
+
+    @validator("cpu_dtype")
+    def validate_cpu_dtype(cls, v):
+        if v not in ["float32", "bfloat16"]:
+            raise ValueError("cpu_dtype must be 'float32' or 'bfloat16'")
+        return v
+
 class PeftConfig(BaseModel):
     r: int = 16
     lora_alpha: int = 32
@@ -30,22 +47,117 @@ class TrainingConfig(BaseModel):
     learning_rate: float = 2e-4
     logging_steps: int = 10
     save_steps: int = 50
+    save_total_limit: Optional[int] = Field(3, description="Newest checkpoints kept besides the best one; None keeps all")
+    async_checkpointing: bool = Field(True, description="Serialize checkpoints on a background thread while training continues")
     output_dir: str = "outputs"
     optim: str = "paged_adamw_32bit"
     max_steps: int = -1
     warmup_steps: int = 0
     resume_from_checkpoint: bool = True
+    dataloader_num_workers: int = 0
+    dataloader_prefetch_factor: Optional[int] = Field(None, description="Batches prefetched per worker, needs dataloader_num_workers > 0")
+    batching: str = Field("fixed", description="'fixed' pads every sample to max_seq_length, 'token_budget' builds length-bucketed batches")
+    max_tokens_per_batch: int = Field(4096, description="Padded token budget per batch in 'token_budget' mode")
+    metrics_file: Optional[str] = Field("metrics.jsonl", description="Per-step throughput/timing JSONL written into output_dir; null disables it")
+    peak_tflops: Optional[float] = Field(None, description="Peak TFLOP/s of one device, enables the MFU estimate")
+    eval_steps: Optional[int] = Field(None, description="Evaluate on the held-out split every N steps; defaults to save_steps")
+    eval_batch_size: int = Field(8, description="Samples per no-grad eval batch")
+    early_stopping_patience: Optional[int] = Field(3, description="Stop after this many evaluations without improvement; None disables")
+    early_stopping_threshold: float = Field(0.0, description="Minimum eval_loss decrease that counts as an improvement")
+
+    @validator("batching")
+    def validate_batching(cls, v):
+        if v not in ["fixed", "token_budget"]:
+            raise ValueError("Batching must be 'fixed' or 'token_budget'")
+        return v
+
+    @validator("save_total_limit")
+    def validate_save_total_limit(cls, v):
+        if v is not None and v < 1:
+            raise ValueError("save_total_limit must be at least 1")
+        return v
+
+    @validator("eval_steps")
+    def validate_eval_steps(cls, v, values):
+        # The best checkpoint is picked among saved ones, so every save has to follow an evaluation
+        if v is not None and values.get("save_steps", 0) % v != 0:
+            raise ValueError("save_steps must be a multiple of eval_steps")
+        return v
     
 class DataConfig(BaseModel):
-    dataset_path: str = Field(..., description="Path to JSON dataset")
+    dataset_path: str = Field(..., description="JSON/JSONL file, directory of shards or glob pattern")
     max_seq_length: int = 2048
-    validation_split_percentage: int = 10
+    validation_split_percentage: int = Field(10, description="Share of samples held out for evaluation; 0 disables evaluation")
+    streaming: bool = Field(False, description="Stream and tokenize records on the fly instead of caching the whole corpus")
+    shuffle_buffer_size: int = Field(10000, description="Samples held in the streaming shuffle buffer")
+    packing: bool = Field(False, description="Concatenate several samples into each max_seq_length row")
+    token_cache_dir: str = Field(".cache/tokenized", description="Where pre-tokenized datasets are cached")
+    tokenization_workers: int = Field(1, description="Processes used to build the token cache")
+    tokenization_batch_size: int = Field(1000, description="Texts per tokenizer call when building the token cache")
+    supervision: str = Field("full", description="'full' trains on prompt and response tokens, 'response' only on the response")
+
+    @validator("supervision")
+    def validate_supervision(cls, v):
+        if v not in ["full", "response"]:
+            raise ValueError("Supervision must be 'full' or 'response'")
+        return v
+
+class InferenceConfig(BaseModel):
+    max_new_tokens: int = 256
+    do_sample: bool = True
+    temperature: float = 0.7
+    top_p: float = 0.9
+    repetition_penalty: float = 1.1
+    seed: Optional[int] = Field(None, description="Reseed before every generate call; makes sampled answers cacheable")
+    max_batch_size: int = Field(8, description="Prompts per generate call in batched generation")
+    max_wait_ms: float = Field(10.0, description="How long the API scheduler waits to fill a micro-batch")
+    max_queue_size: int = Field(64, description="Queued questions before the API answers 429; larger batches are admitted in chunks as the queue drains")
+    instruction: Optional[str] = Field(None, description="Fixed instruction; questions then go into the Input section as in training")
+    prefix_cache: bool = Field(True, description="Reuse key/values of shared prompt prefixes across generate calls")
+    prefix_cache_prefixes: List[str] = Field(default_factory=list, description="Extra prompt prefixes to precompute")
+    response_cache: bool = Field(True, description="Cache API answers when decoding is deterministic")
+    response_cache_size: int = 1024
+    response_cache_ttl_s: Optional[float] = 3600.0
+    compare_mode: str = Field("mixed", description="'mixed' runs base and fine-tuned rows in one batch, 'sequential' runs two passes")
+    adapters_root: Optional[str] = Field("experiments", description="Directory whose subdirectories hold adapters selectable per request")
+    max_resident_adapters: int = Field(4, description="Adapters kept loaded at once, least recently used are evicted")
+    adapter_memory_budget_mb: Optional[float] = Field(None, description="Evict adapters while their weights exceed this size")
+    merged_checkpoint: Optional[str] = Field(None, description="Checkpoint from export_merged.py serving the default adapter without LoRA overhead; the base model is loaded on the first base/other-adapter request and both stay resident from then on")
+    warmup_prompt: Optional[str] = Field("Merhaba", description="Generated once at startup so the first request is not slow; None disables")
+    warmup_max_new_tokens: int = 4
+    background_load: bool = Field(True, description="API: answer /health at once and load the model in the background")
+
+    @validator("compare_mode")
+    def validate_compare_mode(cls, v):
+        if v not in ["mixed", "sequential"]:
+            raise ValueError("compare_mode must be 'mixed' or 'sequential'")
+        return v
+
+class ProfilingConfig(BaseModel):
+    skip_first: int = Field(10, description="Optimizer steps ignored before the first profiling cycle")
+    wait: int = Field(0, description="Idle steps at the start of every cycle")
+    warmup: int = Field(1, description="Steps traced but discarded, profiler startup cost lands here")
+    active: int = Field(3, description="Steps recorded per cycle")
+    repeat: int = Field(1, description="Number of cycles; 0 repeats until training ends")
+    record_shapes: bool = True
+    profile_memory: bool = Field(True, description="Track tensor allocations per operator")
+    with_stack: bool = Field(False, description="Record Python stacks (large traces)")
+    output_subdir: str = Field("profiler", description="Trace directory inside training.output_dir")
+    top_ops: int = Field(25, description="Rows in the top-operators summary")
+
+    @validator("active")
+    def validate_active(cls, v):
+        if v < 1:
+            raise ValueError("profiling.active must be at least 1")
+        return v
 
 class AppConfig(BaseModel):
     model: ModelConfig
     peft: PeftConfig
     training: TrainingConfig
     data: DataConfig
+    inference: InferenceConfig = Field(default_factory=InferenceConfig)
+    profiling: Optional[ProfilingConfig] = Field(None, description="torch.profiler capture of selected training steps; absent = off")
     
     @classmethod
     def load_from_yaml(cls, path: str):
@@ -1,68 +1,415 @@
-import json
+import bisect
+import random
+import numpy as np
 import torch
-from torch.utils.data import Dataset
-from typing import List, Dict
+import torch.distributed as dist
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 from .config import DataConfig
+from .records import iter_records, resolve_dataset_files, split_sample
+from .token_cache import TokenCache, encode_samples, get_token_cache
 from .utils import setup_logger
 
 logger = setup_logger("DataHandler")
 
 class InstructDataset(Dataset):
-    def __init__(self, data: List[Dict], tokenizer, max_seq_length: int):
-        self.data = data
-        self.tokenizer = tokenizer
+    # Samples are tokenized once into a TokenCache; __getitem__ only slices the memory-mapped arrays
+    def __init__(self, cache: TokenCache, pad_token_id: int, max_seq_length: int, pad_to_max_length: bool = True):
+        self.cache = cache
+        self.pad_token_id = pad_token_id
         self.max_seq_length = max_seq_length
+        # When False, samples are returned unpadded and DynamicPaddingCollator pads per batch
+        self.pad_to_max_length = pad_to_max_length
 
     def __len__(self):
-        return len(self.data)
+        return len(self.cache)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return self.cache.lengths
 
     def __getitem__(self, index):
-        item = self.data[index]
-        instruction = item.get("instruction", "")
-        input_text = item.get("input", "")
-        output_text = item.get("output", "")
-
-        # Format prompt (Simplified alpaca-like format)
-        if input_text:
-            prompt = f"### Instruction:\n{instruction}\n\n### Input:\n{input_text}\n\n### Response:\n"
+        return encode_features(self.cache[index], self.pad_token_id, self.max_seq_length, self.pad_to_max_length,
+                               prompt_length=int(self.cache.prompt_lengths[index]))
+
+def encode_features(token_ids, pad_token_id: int, max_seq_length: int, pad_to_max_length: bool = True,
+                    prompt_length: int = 0) -> Dict[str, torch.Tensor]:
+    # No labels here: DynamicPaddingCollator builds them for the whole batch from attention_mask
+    # and prompt_length, instead of every sample cloning and masking its own copy
+    ids = torch.from_numpy(np.asarray(token_ids, dtype=np.int64))
+    length = len(ids)
+    if pad_to_max_length:
+        input_ids = torch.full((max_seq_length,), pad_token_id, dtype=torch.long)
+        input_ids[:length] = ids
+        attention_mask = torch.zeros(max_seq_length, dtype=torch.long)
+        attention_mask[:length] = 1
+    else:
+        input_ids = ids
+        attention_mask = torch.ones(length, dtype=torch.long)
+
+    return {
+        "input_ids": input_ids,
+        "attention_mask": attention_mask,
+        "prompt_length": torch.tensor(prompt_length, dtype=torch.long)
+    }
+
+class StreamingInstructDataset(IterableDataset):
+    """Tokenizes records on the fly from JSON/JSONL shards without holding the corpus in memory.
+
+    Every (rank, worker) pair reads a disjoint part of the stream: whole files when there are
+    at least as many files as readers, otherwise every n-th record. A bounded buffer shuffles
+    within the stream, so memory stays flat regardless of corpus size.
+
+    The order depends only on the seed, the epoch and the reader layout, so `resume_from`
+    can continue an interrupted epoch where it stopped: each reader replays its records and
+    shuffle buffer up to that point without tokenizing or collating the skipped samples.
+    Every sample carries the worker that read it (`data_worker`, popped by the trainer), so
+    the consumed samples of each worker and the worker due next can be saved exactly.
+    """
+
+    # The dataset splits itself across ranks, the trainer must not shard it again
+    shards_by_rank = True
+
+    def __init__(self, files: Sequence[str], tokenizer, max_seq_length: int, pad_to_max_length: bool = True,
+                 shuffle_buffer_size: int = 10000, seed: int = 42):
+        self.files = list(files)
+        self.tokenizer = tokenizer
+        self.max_seq_length = max_seq_length
+        self.pad_to_max_length = pad_to_max_length
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.seed = seed
+        self.epoch = 0
+        # (epoch, batches, batch_size, worker_samples, next_worker) of this rank at the resumed checkpoint
+        self._resume = None
+
+    def set_epoch(self, epoch: int):
+        # The trainer counts epochs of a resumed streaming run from 0 again
+        self.epoch = epoch + (self._resume[0] if self._resume else 0)
+
+    def resume_from(self, epoch: int, batches: int, batch_size: int, worker_samples: Optional[List[int]] = None,
+                    next_worker: int = 0):
+        """Start `epoch` where this rank stopped: worker i after its first `worker_samples[i]` samples,
+        with worker `next_worker` delivering the next batch. Without per-worker counts the first
+        `batches` batches of `batch_size` samples are assumed to have come from the workers in turn."""
+        if worker_samples is None:
+            next_worker = 0
+        self._resume = (epoch, batches, batch_size, worker_samples, next_worker)
+        self.epoch = epoch
+
+    def _resuming(self) -> bool:
+        return self._resume is not None and self.epoch == self._resume[0]
+
+    def _worker(self):
+        worker = get_worker_info()
+        if worker is None:
+            return 0, 1
+        worker_id = worker.id
+        if self._resuming():
+            # The DataLoader asks its workers in turn starting at 0; rotate so the saved next one goes first
+            worker_id = (worker_id + self._resume[4]) % worker.num_workers
+        return worker_id, worker.num_workers
+
+    def _shard(self):
+        rank, world_size = 0, 1
+        if dist.is_available() and dist.is_initialized():
+            rank, world_size = dist.get_rank(), dist.get_world_size()
+        worker_id, num_workers = self._worker()
+        return rank * num_workers + worker_id, world_size * num_workers
+
+    def _skipped_samples(self) -> int:
+        if not self._resuming():
+            return 0
+        _, batches, batch_size, worker_samples, _ = self._resume
+        worker_id, num_workers = self._worker()
+        if worker_samples is not None:
+            return worker_samples[worker_id]
+        # Only exact while every worker still had batches left
+        return len(range(worker_id, batches, num_workers)) * batch_size
+
+    def _records(self, shard_id: int, num_shards: int) -> Iterator[Dict]:
+        # Same file order on every reader, so the split below stays disjoint
+        files = list(self.files)
+        random.Random(self.seed + self.epoch).shuffle(files)
+        if len(files) >= num_shards:
+            for path in files[shard_id::num_shards]:
+                yield from iter_records(path)
+        else:
+            records = (record for path in files for record in iter_records(path))
+            for i, record in enumerate(records):
+                if i % num_shards == shard_id:
+                    yield record
+
+    def _tokenize(self, record: Dict) -> Tuple[np.ndarray, int]:
+        ids, prompt_lengths = encode_samples(self.tokenizer, [split_sample(record, self.tokenizer.eos_token)],
+                                             self.max_seq_length)
+        return np.asarray(ids[0], dtype=np.int32), prompt_lengths[0]
+
+    def _features(self, sample, worker_id: int) -> Dict[str, torch.Tensor]:
+        if not isinstance(sample, tuple):
+            # Read while skipping, tokenized only now that it is actually yielded
+            sample = self._tokenize(sample)
+        ids, prompt_length = sample
+        features = encode_features(ids, self.tokenizer.pad_token_id, self.max_seq_length, self.pad_to_max_length,
+                                   prompt_length=prompt_length)
+        features["data_worker"] = worker_id
+        return features
+
+    def __iter__(self):
+        shard_id, num_shards = self._shard()
+        worker_id, _ = self._worker()
+        rng = random.Random(f"{self.seed}-{self.epoch}-{shard_id}")
+        skip = self._skipped_samples()
+        # Buffer holds compact token arrays; tensors are only built on yield. Records read
+        # while skipping stay raw, most of them are dropped without ever being tokenized.
+        buffer: List = []
+        for record in self._records(shard_id, num_shards):
+            sample = record if skip > 0 else self._tokenize(record)
+            if len(buffer) < self.shuffle_buffer_size:
+                buffer.append(sample)
+                continue
+            i = rng.randrange(len(buffer))
+            sample, buffer[i] = buffer[i], sample
+            if skip > 0:
+                skip -= 1
+                continue
+            yield self._features(sample, worker_id)
+        rng.shuffle(buffer)
+        for sample in buffer[skip:]:
+            yield self._features(sample, worker_id)
+
+def pack_lengths(lengths: Sequence[int], capacity: int) -> List[List[int]]:
+    # Best-fit decreasing bin packing; returns sample indices per row
+    order = np.argsort(-np.asarray(lengths), kind="stable")
+    bins: List[List[int]] = []
+    free: List[tuple] = []  # sorted (remaining capacity, bin id)
+    for idx in order:
+        length = int(lengths[idx])
+        pos = bisect.bisect_left(free, (length, -1))
+        if pos < len(free):
+            remaining, bin_id = free.pop(pos)
         else:
-            prompt = f"### Instruction:\n{instruction}\n\n### Response:\n"
-        
-        full_text = prompt + output_text + self.tokenizer.eos_token
-
-        # Tokenize
-        tokenized = self.tokenizer(
-            full_text,
-            max_length=self.max_seq_length,
-            padding="max_length",
-            truncation=True,
-            return_tensors="pt"
+            remaining, bin_id = capacity, len(bins)
+            bins.append([])
+        bins[bin_id].append(int(idx))
+        bisect.insort(free, (remaining - length, bin_id))
+    return bins
+
+class PackedDataset(Dataset):
+    """Several short samples concatenated into each max_seq_length row.
+
+    Rows carry no attention_mask; position_ids restart at 0 for every sample (and for the
+    trailing padding), which transformers turns into a block-diagonal causal mask so samples
+    never attend across each other. The first label of every sample is ignored so the last
+    token of one sample is never trained to predict the next sample; with `response_only` the
+    labels of the prompt tokens are ignored as well. `num_tokens` holds the unpadded length of
+    the row; InstructTrainer pops it before the forward pass.
+    """
+
+    def __init__(self, cache: TokenCache, pad_token_id: int, max_seq_length: int, response_only: bool = False):
+        self.cache = cache
+        self.pad_token_id = pad_token_id
+        self.max_seq_length = max_seq_length
+        self.response_only = response_only
+        self.rows = pack_lengths(cache.lengths, max_seq_length)
+
+        real_tokens = int(cache.lengths.sum())
+        self.efficiency = real_tokens / max(1, len(self.rows) * max_seq_length)
+        logger.info(
+            f"Packed {len(cache)} samples into {len(self.rows)} rows of {max_seq_length} tokens "
+            f"(packing efficiency {self.efficiency:.1%})"
         )
 
-        input_ids = tokenized["input_ids"][0]
-        attention_mask = tokenized["attention_mask"][0]
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.full(len(self.rows), self.max_seq_length)
+
+    def __getitem__(self, index):
+        input_ids = torch.full((self.max_seq_length,), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((self.max_seq_length,), -100, dtype=torch.long)
+        position_ids = torch.arange(self.max_seq_length, dtype=torch.long)
 
-        # Labels: Mask the prompt part for loss calculation (optional but standard)
-        # For simplicity in this v1, we train on the whole sequence or just masking? 
-        # Making labels = input_ids for CausalLM. 
-        # ideally we should mask the user prompt, but simple CausalLM fine-tuning works without valid masking too, just slightly less efficient.
-        # Let's do simple clone for now.
-        labels = input_ids.clone()
-        
-        # Simple masking of padding tokens
-        # -100 is the ignore index for CrossEntropyLoss
-        labels[attention_mask == 0] = -100
+        start = 0
+        for sample_index in self.rows[index]:
+            ids = torch.from_numpy(np.asarray(self.cache[sample_index], dtype=np.int64))
+            end = start + len(ids)
+            first_label = max(1, int(self.cache.prompt_lengths[sample_index])) if self.response_only else 1
+            input_ids[start:end] = ids
+            labels[start + first_label:end] = ids[first_label:]
+            position_ids[start:end] = torch.arange(len(ids))
+            start = end
+        position_ids[start:] = torch.arange(self.max_seq_length - start)
 
         return {
+            "input_ids": input_ids,
+            "position_ids": position_ids,
+            "labels": labels,
+            "num_tokens": start
+        }
+
+class TokenBudgetBatchSampler:
+    """Groups samples of similar length into batches of at most `max_tokens` padded tokens.
+
+    Batches are built once from the length-sorted index (fairseq-style), so their count is
+    stable across epochs; only the batch order is reshuffled each epoch.
+    """
+
+    def __init__(self, lengths: Sequence[int], max_tokens: int, shuffle: bool = True, seed: int = 42):
+        self.lengths = np.asarray(lengths)
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+        rng = np.random.default_rng(seed)
+        # Random tie-break so equal-length samples are not always batched together
+        order = np.lexsort((rng.permutation(len(self.lengths)), self.lengths))
+        self.batches: List[List[int]] = []
+        batch: List[int] = []
+        for idx in order:
+            length = int(self.lengths[idx])
+            # Sorted ascending, so the new sample is the longest in the batch
+            if batch and length * (len(batch) + 1) > max_tokens:
+                self.batches.append(batch)
+                batch = []
+            batch.append(int(idx))
+        if batch:
+            self.batches.append(batch)
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __iter__(self):
+        order = range(len(self.batches))
+        if self.shuffle:
+            order = np.random.default_rng(self.seed + self.epoch).permutation(len(self.batches))
+        for i in order:
+            yield list(self.batches[i])
+
+class DynamicPaddingCollator:
+    """Pads each batch only to its longest sequence and builds the labels.
+
+    Labels are the input ids with padding set to -100 (masked by attention_mask, not by token
+    id, since pad_token is often eos and the final eos must still be learned). With
+    `response_only` the first `prompt_length` positions of each sample are masked too.
+    Already padded features pass through with the same rule.
+    """
+
+    def __init__(self, pad_token_id: int, pad_to_multiple_of: Optional[int] = None, response_only: bool = False):
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self.response_only = response_only
+
+    def __call__(self, features: List[Dict[str, torch.Tensor]]) -> Dict[str, torch.Tensor]:
+        max_len = max(len(f["input_ids"]) for f in features)
+        if self.pad_to_multiple_of:
+            max_len = -(-max_len // self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        input_ids = torch.full((len(features), max_len), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(features), max_len), dtype=torch.long)
+        for i, f in enumerate(features):
+            n = len(f["input_ids"])
+            input_ids[i, :n] = f["input_ids"]
+            attention_mask[i, :n] = f["attention_mask"]
+
+        labels = input_ids.masked_fill(attention_mask == 0, -100)
+        if self.response_only:
+            prompt_lengths = torch.tensor([int(f.get("prompt_length", 0)) for f in features])
+            labels.masked_fill_(torch.arange(max_len) < prompt_lengths[:, None], -100)
+
+        batch = {
             "input_ids": input_ids,
             "attention_mask": attention_mask,
             "labels": labels
         }
+        if "data_worker" in features[0]:
+            # A batch comes from a single streaming worker; the trainer pops it to track the data position
+            batch["data_worker"] = features[0]["data_worker"]
+        return batch
+
+def split_indices(num_samples: int, percentage: int, seed: int = 42):
+    # Fixed seed, so a resumed run evaluates on the same held-out samples
+    if percentage <= 0 or num_samples < 2:
+        return np.arange(num_samples), np.arange(0)
+    num_eval = min(num_samples - 1, max(1, num_samples * percentage // 100))
+    order = np.random.default_rng(seed).permutation(num_samples)
+    return np.sort(order[num_eval:]), np.sort(order[:num_eval])
+
+def length_sorted_batches(lengths: Sequence[int], batch_size: int) -> List[List[int]]:
+    # Longest first: an eval batch that does not fit in memory fails on the first step
+    order = np.argsort(-np.asarray(lengths), kind="stable")
+    return [order[i:i + batch_size].tolist() for i in range(0, len(order), batch_size)]
 
-def load_dataset(data_config: DataConfig, tokenizer):
+def _load_token_cache(data_config: DataConfig, tokenizer, files: List[str]) -> TokenCache:
+    def samples():
+        return (split_sample(item, tokenizer.eos_token) for path in files for item in iter_records(path))
+
+    return get_token_cache(
+        files,
+        tokenizer,
+        data_config.max_seq_length,
+        data_config.token_cache_dir,
+        samples,
+        num_proc=data_config.tokenization_workers,
+        batch_size=data_config.tokenization_batch_size,
+    )
+
+def _cached_dataset(cache, data_config: DataConfig, tokenizer, pad_to_max_length: bool):
+    if data_config.packing:
+        return PackedDataset(cache, tokenizer.pad_token_id, data_config.max_seq_length,
+                             response_only=data_config.supervision == "response")
+    return InstructDataset(cache, tokenizer.pad_token_id, data_config.max_seq_length, pad_to_max_length)
+
+def load_dataset(data_config: DataConfig, tokenizer, pad_to_max_length: bool = True):
+    # Every sample, no held-out split
     logger.info(f"Loading dataset from {data_config.dataset_path}")
-    with open(data_config.dataset_path, 'r') as f:
-        data = json.load(f)
-    
-    logger.info(f"Found {len(data)} samples")
-    return InstructDataset(data, tokenizer, data_config.max_seq_length)
+    files = resolve_dataset_files(data_config.dataset_path)
+    if len(files) > 1:
+        logger.info(f"Found {len(files)} dataset shards")
+
+    if data_config.streaming:
+        if data_config.packing:
+            raise ValueError("Packing needs the token cache and cannot be combined with streaming")
+        return StreamingInstructDataset(
+            files,
+            tokenizer,
+            data_config.max_seq_length,
+            pad_to_max_length=pad_to_max_length,
+            shuffle_buffer_size=data_config.shuffle_buffer_size,
+        )
+
+    cache = _load_token_cache(data_config, tokenizer, files)
+    return _cached_dataset(cache, data_config, tokenizer, pad_to_max_length)
+
+def load_train_eval_datasets(data_config: DataConfig, tokenizer, pad_to_max_length: bool = True):
+    """Train dataset plus a held-out eval dataset of validation_split_percentage of the samples.
+
+    Both are views of the same token cache. Eval samples are never packed or padded to
+    max_seq_length; the trainer batches them by length. The eval dataset is None when the
+    split is 0 or the data is streamed.
+    """
+    if data_config.streaming or data_config.validation_split_percentage <= 0:
+        if data_config.streaming and data_config.validation_split_percentage > 0:
+            logger.warning("The validation split needs the token cache, streaming trains without evaluation")
+        return load_dataset(data_config, tokenizer, pad_to_max_length), None
+
+    logger.info(f"Loading dataset from {data_config.dataset_path}")
+    files = resolve_dataset_files(data_config.dataset_path)
+    if len(files) > 1:
+        logger.info(f"Found {len(files)} dataset shards")
+    cache = _load_token_cache(data_config, tokenizer, files)
+
+    train_indices, eval_indices = split_indices(len(cache), data_config.validation_split_percentage)
+    if len(eval_indices) == 0:
+        logger.warning("Too few samples for a validation split, training without evaluation")
+        return _cached_dataset(cache, data_config, tokenizer, pad_to_max_length), None
+    logger.info(f"Held out {len(eval_indices)} of {len(cache)} samples for evaluation")
+    train_dataset = _cached_dataset(cache.subset(train_indices), data_config, tokenizer, pad_to_max_length)
+    eval_dataset = InstructDataset(cache.subset(eval_indices), tokenizer.pad_token_id, data_config.max_seq_length,
+                                   pad_to_max_length=False)
+    return train_dataset, eval_dataset
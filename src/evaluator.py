@@ -1,105 +1,581 @@
+import contextlib
+import os
+import queue
+import threading
 import torch
 import time
-from typing import Dict
+from transformers import StoppingCriteria, StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
+from typing import Callable, Dict, Iterator, List, Optional
+from .adapter_registry import BASE_ADAPTER_NAME, AdapterRegistry
 from .config import AppConfig
-from .model_loader import load_model, load_tokenizer
-from .utils import setup_logger
+from .records import format_prompt
+from .merge_export import is_stale, read_manifest
+from .model_loader import load_model, load_tokenizer, quantize_dynamic_int8, resolve_device
+from .prefix_cache import PrefixCache
+from .utils import setup_logger, timed
 from peft import PeftModel
 
 logger = setup_logger("Evaluator")
 
+# Prefix-cache state of rows served by the merged checkpoint
+MERGED_STATE_NAME = "__merged__"
+
+class RowFinishTimer(StoppingCriteria):
+    # Never stops generation; only records when the first token arrived (end of prefill)
+    # and when each row first emits eos
+    def __init__(self, eos_token_id: int, batch_size: int):
+        self.eos_token_id = eos_token_id
+        self.first_token_at: Optional[float] = None
+        self.finished_at: List[Optional[float]] = [None] * batch_size
+
+    def __call__(self, input_ids, scores, **kwargs):
+        now = time.time()
+        if self.first_token_at is None:
+            self.first_token_at = now
+        done = (input_ids[:, -1] == self.eos_token_id).tolist()
+        for i, is_done in enumerate(done):
+            if is_done and self.finished_at[i] is None:
+                self.finished_at[i] = now
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+class TokenStreamer(BaseStreamer):
+    """Hands every decoding step to a queue with the time it arrived.
+
+    Also acts as a stopping criterion so a disconnected client can cancel generation.
+    """
+
+    def __init__(self, cancelled: Optional[threading.Event] = None):
+        self.queue = queue.Queue()
+        self.cancelled = cancelled if cancelled is not None else threading.Event()
+        self._prompt_seen = False
+
+    def put(self, value):
+        # generate() first pushes the prompt ids, then one token per row per step
+        if not self._prompt_seen:
+            self._prompt_seen = True
+            return
+        self.queue.put((time.time(), value.view(-1).tolist()))
+
+    def end(self):
+        self.queue.put(None)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.cancelled.is_set(), dtype=torch.bool, device=input_ids.device)
+
 class Evaluator:
-    def __init__(self, config: AppConfig):
+    def __init__(self, config: AppConfig, startup_timings: Optional[Dict[str, float]] = None):
+        # startup_timings is filled phase by phase (seconds), so a caller can report progress while loading
         self.config = config
-        self.tokenizer = load_tokenizer(config.model)
+        self.startup_timings = startup_timings if startup_timings is not None else {}
+        timings = self.startup_timings
+        with timed(timings, "tokenizer"):
+            self.tokenizer = load_tokenizer(config.model)
+        # Decoder-only batched generation needs the prompts right-aligned
+        self.tokenizer.padding_side = "left"
         
         # Load base model
-        # We load it in inference mode
-        self.base_model = load_model(config.model, inference_mode=True)
-        
-        # Try to load adapter if available
-        self.model = self.base_model
-        adapter_path = f"{config.training.output_dir}"
-        import os
-        if os.path.exists(adapter_path):
+        # We load it in inference mode. Next to a merged checkpoint it is only needed for base
+        # answers and other adapters, so it is loaded on the first such request (see _ensure_base_model)
+        self.base_model = None
+        if not config.inference.merged_checkpoint:
+            with timed(timings, "weights"):
+                self.base_model = load_model(config.model, inference_mode=True)
+        self.prefix_cache = None
+
+        # Adapters under inference.adapters_root are loaded on demand; the one in
+        # training.output_dir is the default and stays resident
+        self.adapters = AdapterRegistry(
+            self.base_model,
+            root=config.inference.adapters_root,
+            max_resident=config.inference.max_resident_adapters,
+            max_memory_mb=config.inference.adapter_memory_budget_mb,
+            on_unload=self._on_adapter_unload,
+        )
+        self.default_adapter = None
+        self.merged_model = None
+        self.merged_manifest = None
+        with timed(timings, "adapter"):
+            self._load_default_adapter()
+
+        self.quantized = resolve_device(config.model) == "cpu" and config.model.dynamic_int8
+        if self.quantized:
+            with timed(timings, "quantize"):
+                if self.model is not None:
+                    quantize_dynamic_int8(self.model)
+                if self.merged_model is not None:
+                    quantize_dynamic_int8(self.merged_model)
+            # PEFT cannot inject LoRA layers next to quantized Linear modules
+            self.adapters.frozen = True
+
+        # Adapter switching mutates the model, so generate calls from different threads take turns
+        self._generate_lock = threading.Lock()
+
+        if config.inference.prefix_cache:
+            with timed(timings, "prefix_cache"):
+                self.prefix_cache = PrefixCache(self.tokenizer, self._cacheable_prefixes())
+                self._warm_prefix_cache()
+
+        if config.inference.warmup_prompt:
+            with timed(timings, "warmup"):
+                self.warmup()
+        logger.info("Startup: " + " | ".join(f"{phase} {seconds:.2f}s" for phase, seconds in timings.items()))
+
+    def _load_default_adapter(self):
+        adapter_path = f"{self.config.training.output_dir}"
+        if self.config.inference.merged_checkpoint:
+            self._load_merged(self.config.inference.merged_checkpoint)
+        elif os.path.exists(adapter_path):
+            name = os.path.basename(os.path.normpath(adapter_path))
             try:
                 logger.info(f"Loading LoRA adapter from {adapter_path}")
-                self.model = PeftModel.from_pretrained(self.base_model, adapter_path)
+                self.adapters.register(name, adapter_path, pinned=True)
+                self.adapters.ensure([name])
+                self.default_adapter = name
             except Exception as e:
                 logger.warning(f"Could not load adapter: {e}. Running in base model mode only.")
         else:
             logger.warning(f"No adapter found at {adapter_path}. Running purely with base model.")
 
-    def generate_response(self, question: str, use_adapter: bool = False) -> Dict:
-        # Prompt formatting
-        input_text = f"### Instruction:\n{question}\n\n### Response:\n"
-        inputs = self.tokenizer(input_text, return_tensors="pt")
-        if torch.cuda.is_available():
-            inputs = inputs.to("cuda")
-        
-        # Enable/Disable adapter
-        if isinstance(self.model, PeftModel):
-            if use_adapter:
-                self.model.enable_adapter_layers()
+    def warmup(self):
+        # A short compare runs the same paths as a real request (allocator, kernels, adapter switching)
+        inference = self.config.inference
+        self.config.inference = inference.model_copy(update={"max_new_tokens": inference.warmup_max_new_tokens})
+        try:
+            if self.model is None:
+                # Comparing would load the base model that a merged checkpoint defers
+                self.generate_batch([inference.warmup_prompt], use_adapter=True)
             else:
-                 # Standard PeftModel doesn't have a global "disable" that works instantly for inference 
-                 # without `disable_adapter_layers()` or context manager `disable_adapter()`.
-                 # The context manager is safest.
-                 pass 
-        
-        start_time = time.time()
-        
-        # Generation Logic with Context Manager for Base Model
-        if isinstance(self.model, PeftModel) and not use_adapter:
-             with self.model.disable_adapter():
-                outputs = self.model.generate(
-                    **inputs, 
-                    max_new_tokens=256, 
-                    pad_token_id=self.tokenizer.eos_token_id,
-                    do_sample=True,
-                    temperature=0.7,
-                    top_p=0.9,
-                    repetition_penalty=1.1
-                )
-        else:
-            # Either it's not a PeftModel, or we WANT to use the adapter
-            outputs = self.model.generate(
-                **inputs, 
-                max_new_tokens=256, 
-                pad_token_id=self.tokenizer.eos_token_id,
-                do_sample=True,
-                temperature=0.7,
-                top_p=0.9,
-                repetition_penalty=1.1
-            )
-            
-        end_time = time.time()
-        
-        generated_text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-        # Extract response part logic if needed, but returning full text is fine for 1st pass.
-        # Let's try to remove the prompt.
-        response_text = generated_text.replace(input_text, "").strip()
+                self.compare_batch([inference.warmup_prompt])
+        finally:
+            self.config.inference = inference
 
-        tokens_used = len(outputs[0])
-        duration_ms = (end_time - start_time) * 1000
-        
+    def _load_merged(self, checkpoint: str):
+        # The default adapter is served by the merged weights, so it is never applied through PEFT
+        manifest = read_manifest(checkpoint)
+        if manifest is None:
+            raise FileNotFoundError(f"{checkpoint} has no merge manifest, export it with export_merged.py")
+        if manifest["base_model"] != self.config.model.name_or_path:
+            logger.warning(f"Merged checkpoint was built on {manifest['base_model']}, not {self.config.model.name_or_path}")
+        if is_stale(manifest):
+            logger.warning(f"Adapter {manifest['adapter_path']} changed after {checkpoint} was exported")
+        self.merged_model = load_model(self.config.model, inference_mode=True, name_or_path=checkpoint)
+        self.merged_manifest = manifest
+        self.default_adapter = manifest["adapter_name"]
+        logger.info(f"Loaded merged checkpoint {checkpoint} ({manifest['dtype']})")
+
+    def check_adapter(self, name: str):
+        """Raises KeyError for an unknown adapter and ValueError for one that cannot be loaded."""
+        self.adapters.path(name)
+        if not self._uses_merged([name]):
+            self.adapters.check_loadable(name)
+
+    @property
+    def model(self):
+        # Becomes a PeftModel once the first adapter is loaded; None until _ensure_base_model
+        # when a merged checkpoint serves the default adapter
+        return self.adapters.model
+
+    def _ensure_base_model(self):
+        # Runs under the generate lock before anything uses the base model or a PEFT adapter
+        if self.adapters.model is not None:
+            return
+        logger.info("Loading the base model for base answers and non-merged adapters")
+        start = time.perf_counter()
+        model = load_model(self.config.model, inference_mode=True)
+        if self.quantized:
+            quantize_dynamic_int8(model)
+        self.base_model = self.adapters.model = model
+        logger.info(f"Loaded the base model in {time.perf_counter() - start:.1f}s")
+
+    def _on_adapter_unload(self, name: str):
+        if self.prefix_cache is not None:
+            self.prefix_cache.discard(lambda state: state != BASE_ADAPTER_NAME and state[0] == name)
+
+    def _format_prompt(self, question: str) -> str:
+        # With inference.instruction set, prompts match the instruction/input layout used in training
+        if self.config.inference.instruction:
+            return format_prompt(self.config.inference.instruction, question)
+        return format_prompt(question)
+
+    def _cacheable_prefixes(self) -> List[str]:
+        prefixes = ["### Instruction:\n"]
+        if self.config.inference.instruction:
+            # Everything in front of the question for the instruction/input layout
+            prompt = self._format_prompt("")
+            prefixes.append(prompt[:prompt.index("\n\n### Response:")])
+        return prefixes + list(self.config.inference.prefix_cache_prefixes)
+
+    def _row_adapters(self, n: int, use_adapter: bool, adapter_names: Optional[List[str]],
+                      adapter: Optional[str]) -> Optional[List[str]]:
+        # Registry name or BASE_ADAPTER_NAME per row; None runs every row on the bare base model
+        if adapter_names is not None:
+            return adapter_names
+        name = adapter or self.default_adapter
+        return [name] * n if use_adapter and name else None
+
+    def _uses_merged(self, names: Optional[List[str]]) -> bool:
+        return self.merged_model is not None and names is not None and all(n == self.default_adapter for n in names)
+
+    def _row_states(self, names: Optional[List[str]], n: int) -> List:
+        # Adapter state of each row; prefix key/values differ per state
+        if names is None:
+            return [BASE_ADAPTER_NAME] * n
+        if self._uses_merged(names):
+            return [(MERGED_STATE_NAME, self.merged_manifest["adapter_sha256"])] * n
+        versions = {name: self.adapters.version(name) for name in set(names) if name != BASE_ADAPTER_NAME}
+        return [name if name == BASE_ADAPTER_NAME else (name, versions[name]) for name in names]
+
+    def _prefix_kv(self, prefix: tuple, state):
+        model = self.model
+        kwargs = {}
+        if state != BASE_ADAPTER_NAME and state[0] == MERGED_STATE_NAME:
+            model = self.merged_model
+        elif isinstance(model, PeftModel):
+            kwargs["adapter_names"] = [
+                BASE_ADAPTER_NAME if state == BASE_ADAPTER_NAME else self.adapters.peft_name(state[0])
+            ]
+        input_ids = torch.tensor([prefix], device=model.device)
+        with torch.inference_mode():
+            outputs = model(input_ids=input_ids, use_cache=True, **kwargs)
+        return [(layer[0], layer[1]) for layer in outputs.past_key_values]
+
+    def _warm_prefix_cache(self):
+        states = set()
+        if self.model is not None:
+            # A deferred base model gets its prefixes computed on first use
+            states.update(self._row_states(None, 1))
+        if self.default_adapter:
+            states.update(self._row_states([self.default_adapter], 1))
+        with self._generate_lock:
+            for prefix in self.prefix_cache.prefixes:
+                for state in states:
+                    self.prefix_cache.get(prefix, state, lambda: self._prefix_kv(prefix, state))
+        logger.info(f"Prefix cache ready: {len(self.prefix_cache.prefixes)} prefix(es) x {len(states)} adapter state(s)")
+
+    def _prefix_cached_inputs(self, prompts: List[str], states: List, device) -> Optional[Dict]:
+        encoded = self.tokenizer(prompts)["input_ids"]
+        prefix = self.prefix_cache.match(encoded)
+        if prefix is None:
+            return None
+        rows = [self.prefix_cache.get(prefix, state, lambda: self._prefix_kv(prefix, state)) for state in states]
+        self.prefix_cache.record_hit(prefix, states)
+
+        # Padding goes between the cached prefix and the rest, so every row's prefix sits at
+        # positions 0..n-1 like in the cache; position ids follow the attention mask
+        width = max(len(ids) for ids in encoded)
+        n = len(prefix)
+        input_ids, attention_mask = [], []
+        for ids in encoded:
+            gap = width - len(ids)
+            input_ids.append(list(prefix) + [self.tokenizer.pad_token_id] * gap + ids[n:])
+            attention_mask.append([1] * n + [0] * gap + [1] * (len(ids) - n))
         return {
-            "answer": response_text,
-            "tokens_used": tokens_used,
-            "response_time_ms": round(duration_ms, 2)
+            "input_ids": torch.tensor(input_ids, device=device),
+            "attention_mask": torch.tensor(attention_mask, device=device),
+            "past_key_values": PrefixCache.batch_cache(rows),
+        }
+
+    @property
+    def deterministic(self) -> bool:
+        # Greedy decoding, or sampling reseeded before every call
+        return not self.config.inference.do_sample or self.config.inference.seed is not None
+
+    def cache_identity(self, adapter: Optional[str] = None) -> Dict:
+        # Everything besides the question that decides the generated answers
+        name = adapter or self.default_adapter
+        if name and self._uses_merged([name]):
+            adapter_identity = f"merged:{self.merged_manifest['adapter_sha256']}"
+        else:
+            adapter_identity = self.adapters.version(name) if name else None
+        return {
+            "model": self.config.model.name_or_path,
+            "adapter": adapter_identity,
+            "generation": {k: v for k, v in self._generation_kwargs().items() if k != "pad_token_id"},
+            "seed": self.config.inference.seed,
+            "instruction": self.config.inference.instruction,
+        }
+
+    def _generation_kwargs(self) -> Dict:
+        inference = self.config.inference
+        kwargs = {
+            "max_new_tokens": inference.max_new_tokens,
+            "pad_token_id": self.tokenizer.eos_token_id,
+            "do_sample": inference.do_sample,
+            "repetition_penalty": inference.repetition_penalty,
         }
+        if inference.do_sample:
+            kwargs.update(temperature=inference.temperature, top_p=inference.top_p)
+        return kwargs
+
+    def _base_context(self):
+        if not isinstance(self.model, PeftModel):
+            return contextlib.nullcontext()
+        # The context manager is the safest way to run the base model through a PeftModel
+        return self.model.disable_adapter()
+
+    def _prepare(self, questions: List[str], use_adapter: bool, adapter_names: Optional[List[str]],
+                 adapter: Optional[str] = None):
+        # With adapter_names every row picks its own adapter (mixed-adapter batch) and use_adapter is ignored;
+        # otherwise use_adapter rows run `adapter`, or the default adapter when it is None
+        # Returns the model to generate with: the merged checkpoint serves default-adapter-only batches
+        names = self._row_adapters(len(questions), use_adapter, adapter_names, adapter)
+        merged = self._uses_merged(names)
+        if not merged:
+            self._ensure_base_model()
+        peft_names = self.adapters.ensure(names) if names is not None and not merged else None
+        model = self.merged_model if merged else self.model
+        prompts = [self._format_prompt(q) for q in questions]
+        inputs = None
+        if self.prefix_cache is not None:
+            inputs = self._prefix_cached_inputs(prompts, self._row_states(names, len(prompts)), model.device)
+        if inputs is None:
+            inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(model.device)
+        generate_kwargs = self._generation_kwargs()
+        if self.config.inference.seed is not None:
+            torch.manual_seed(self.config.inference.seed)
+        context = contextlib.nullcontext()
+        if peft_names is None or not isinstance(self.model, PeftModel):
+            # Merged rows run a plain model that already carries the adapter
+            if not merged:
+                context = self._base_context()
+        elif len(set(peft_names)) == 1 and peft_names[0] != BASE_ADAPTER_NAME:
+            # Switching the active adapter only flips flags, and skips the per-row split of mixed batches
+            self.model.set_adapter(peft_names[0])
+        else:
+            generate_kwargs["adapter_names"] = peft_names
+        return model, inputs, generate_kwargs, context
+
+    def _generate_chunk(self, questions: List[str], use_adapter: bool = False,
+                        adapter_names: Optional[List[str]] = None, adapter: Optional[str] = None) -> List[Dict]:
+        eos_id = self.tokenizer.eos_token_id
+        timer = RowFinishTimer(eos_id, len(questions))
+
+        with self._generate_lock:
+            model, inputs, generate_kwargs, context = self._prepare(questions, use_adapter, adapter_names, adapter)
+            prompt_width = inputs["input_ids"].shape[1]
+            start_time = time.time()
+            with torch.inference_mode(), context:
+                outputs = model.generate(**inputs, **generate_kwargs, stopping_criteria=StoppingCriteriaList([timer]))
+            end_time = time.time()
+
+        results = []
+        total_generated = 0
+        prefill_ms = ((timer.first_token_at or end_time) - start_time) * 1000
+        for row, prompt_len, finished_at in zip(outputs, inputs["attention_mask"].sum(dim=1).tolist(), timer.finished_at):
+            new_tokens = row[prompt_width:]
+            # Rows that finished early are padded with eos; count up to and including the first one
+            eos_positions = (new_tokens == eos_id).nonzero()
+            generated = int(eos_positions[0]) + 1 if len(eos_positions) else len(new_tokens)
+            total_generated += generated
+            duration_ms = ((finished_at or end_time) - start_time) * 1000
+            results.append({
+                "answer": self.tokenizer.decode(new_tokens[:generated], skip_special_tokens=True).strip(),
+                "tokens_used": prompt_len + generated,
+                "response_time_ms": round(duration_ms, 2),
+                "tokens_per_s": round(generated / max(duration_ms / 1000, 1e-9), 2),
+                "generated_tokens": generated,
+                "prefill_ms": round(prefill_ms, 2),
+            })
+        logger.info(
+            f"Generated {total_generated} tokens for {len(results)} row(s) on {model.device}: "
+            f"{total_generated / max(end_time - start_time, 1e-9):.1f} tokens/s"
+        )
+        return results
+
+    def _chunked(self, questions: List[str], chunk_size: int, generate_fn: Callable[[List[int]], List]) -> List:
+        # Similar prompt lengths share a generate call to keep left padding small; generate_fn gets indices
+        order = sorted(range(len(questions)), key=lambda i: len(questions[i]))
+        results = [None] * len(questions)
+        for start in range(0, len(order), chunk_size):
+            chunk = order[start:start + chunk_size]
+            for i, result in zip(chunk, generate_fn(chunk)):
+                results[i] = result
+        return results
+
+    def generate_batch(self, questions: List[str], use_adapter: bool = False,
+                       adapter: Optional[str] = None, max_batch_size: Optional[int] = None) -> List[Dict]:
+        # response_time_ms is measured per row, from the start of its generate call until it emitted eos
+        # max_batch_size (rows per generate call) overrides inference.max_batch_size
+        return self._chunked(
+            questions,
+            max_batch_size or self.config.inference.max_batch_size,
+            lambda chunk: self._generate_chunk([questions[i] for i in chunk], use_adapter, adapter=adapter),
+        )
+
+    def stream_batch(self, questions: List[str], use_adapter: bool = False,
+                     adapter_names: Optional[List[str]] = None, adapter: Optional[str] = None,
+                     cancel: Optional[threading.Event] = None) -> Iterator[Dict]:
+        """Yield token and per-row completion events while the rows are being decoded.
+
+        Events carry the row index; times are measured from the start of the request.
+        Closing the iterator early cancels the generation, and so does setting `cancel`,
+        which unlike close() is safe while another thread is inside next().
+        """
+        start_time = time.time()
+        streamer = TokenStreamer(cancel)
+        eos_id = self.tokenizer.eos_token_id
+
+        def run():
+            try:
+                with self._generate_lock:
+                    if streamer.cancelled.is_set():
+                        # Cancelled while waiting for another generation to finish
+                        streamer.end()
+                        return
+                    model, inputs, generate_kwargs, context = self._prepare(questions, use_adapter, adapter_names, adapter)
+                    with torch.inference_mode(), context:
+                        model.generate(
+                            **inputs,
+                            **generate_kwargs,
+                            streamer=streamer,
+                            stopping_criteria=StoppingCriteriaList([streamer]),
+                        )
+            except Exception as e:
+                streamer.queue.put(e)
+                streamer.end()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+
+        n = len(questions)
+        tokens: List[List[int]] = [[] for _ in range(n)]
+        texts = [""] * n
+        first_at: List[Optional[float]] = [None] * n
+        last_at = [start_time] * n
+        done = [False] * n
+        try:
+            while True:
+                item = streamer.queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                arrived_at, step_tokens = item
+                for row, token in enumerate(step_tokens):
+                    if done[row]:
+                        continue
+                    if first_at[row] is None:
+                        first_at[row] = arrived_at
+                    tokens[row].append(token)
+                    # Decode the whole row and emit the new suffix; hold back incomplete multi-byte characters
+                    text = self.tokenizer.decode(tokens[row], skip_special_tokens=True)
+                    if not text.endswith("\ufffd") and len(text) > len(texts[row]):
+                        yield {
+                            "type": "token",
+                            "row": row,
+                            "text": text[len(texts[row]):],
+                            "index": len(tokens[row]) - 1,
+                            "elapsed_ms": round((arrived_at - start_time) * 1000, 2),
+                            "delta_ms": round((arrived_at - last_at[row]) * 1000, 2),
+                        }
+                        texts[row] = text
+                    last_at[row] = arrived_at
+                    if token == eos_id:
+                        done[row] = True
+                        yield from self._finish_row(row, tokens[row], texts[row], start_time, first_at[row], arrived_at)
+            end_time = time.time()
+            for row in range(n):
+                if not done[row]:
+                    yield from self._finish_row(row, tokens[row], texts[row], start_time, first_at[row], end_time)
+        finally:
+            streamer.cancelled.set()
+
+    def _finish_row(self, row: int, tokens: List[int], emitted: str, start_time: float,
+                    first_at: Optional[float], end_at: float) -> Iterator[Dict]:
+        # Flush text that was held back waiting for the rest of a multi-byte character
+        text = self.tokenizer.decode(tokens, skip_special_tokens=True)
+        if len(text) > len(emitted):
+            yield {
+                "type": "token",
+                "row": row,
+                "text": text[len(emitted):],
+                "index": len(tokens) - 1,
+                "elapsed_ms": round((end_at - start_time) * 1000, 2),
+                "delta_ms": 0.0,
+            }
+        decode_s = end_at - first_at if first_at is not None and len(tokens) > 1 else 0.0
+        yield {
+            "type": "done",
+            "row": row,
+            "tokens": len(tokens),
+            "ttft_ms": round(((first_at or end_at) - start_time) * 1000, 2),
+            "total_ms": round((end_at - start_time) * 1000, 2),
+            "tokens_per_s": round((len(tokens) - 1) / decode_s, 2) if decode_s > 0 else None,
+        }
+
+    def stream_compare(self, question: str, adapter: Optional[str] = None,
+                       cancel: Optional[threading.Event] = None) -> Iterator[Dict]:
+        # Row 0 is the base model, row 1 the fine-tuned model
+        name = adapter or self.default_adapter
+        # The merged checkpoint is a separate model, so its rows cannot share a batch with base rows
+        if self.config.inference.compare_mode == "mixed" and name and not self._uses_merged([name]):
+            events = self.stream_batch([question, question], adapter_names=[BASE_ADAPTER_NAME, name], cancel=cancel)
+            for event in events:
+                event["model"] = "base_model" if event.pop("row") == 0 else "finetuned_model"
+                yield event
+            return
+        for model_name, use_adapter in (("base_model", False), ("finetuned_model", True)):
+            if cancel is not None and cancel.is_set():
+                return
+            for event in self.stream_batch([question], use_adapter=use_adapter, adapter=adapter, cancel=cancel):
+                event.pop("row")
+                event["model"] = model_name
+                yield event
+
+    def generate_response(self, question: str, use_adapter: bool = False, adapter: Optional[str] = None) -> Dict:
+        return self.generate_batch([question], use_adapter, adapter)[0]
+
+    def compare(self, question: str, adapter: Optional[str] = None):
+        return self.compare_batch([question], [adapter])[0]
+
+    def _compare_mixed_chunk(self, questions: List[str], names: List[str]) -> List[Dict]:
+        # Base and fine-tuned rows share one decoding loop; the LoRA delta is only applied to the latter
+        n = len(questions)
+        adapter_names = [BASE_ADAPTER_NAME] * n + names
+        rows = self._generate_chunk(questions + questions, adapter_names=adapter_names)
+        return [
+            {
+                "question": question,
+                "base_model": base,
+                "finetuned_model": finetuned
+            }
+            for question, base, finetuned in zip(questions, rows[:n], rows[n:])
+        ]
+
+    def compare_batch(self, questions: List[str], adapters: Optional[List[Optional[str]]] = None,
+                      max_batch_size: Optional[int] = None) -> List[Dict]:
+        # adapters names the fine-tuned adapter per question; None picks the default adapter
+        max_batch_size = max_batch_size or self.config.inference.max_batch_size
+        names = [adapter or self.default_adapter for adapter in (adapters or [None] * len(questions))]
+        if self.config.inference.compare_mode == "mixed" and all(names) and not any(self._uses_merged([n]) for n in names):
+            logger.info(f"Generating {len(questions)} base/finetuned pair(s) in mixed-adapter batches...")
+            chunk_size = max(1, max_batch_size // 2)
+            return self._chunked(
+                questions,
+                chunk_size,
+                lambda chunk: self._compare_mixed_chunk([questions[i] for i in chunk], [names[i] for i in chunk]),
+            )
 
-    def compare(self, question: str):
         # 1. Base Model
-        logger.info("Generating with Base Model...")
-        base_stats = self.generate_response(question, use_adapter=False)
+        logger.info(f"Generating {len(questions)} answer(s) with Base Model...")
+        base_stats = self.generate_batch(questions, use_adapter=False, max_batch_size=max_batch_size)
         
-        # 2. Finetuned Model
-        logger.info("Generating with Finetuned Model...")
-        finetuned_stats = self.generate_response(question, use_adapter=True)
+        # 2. Finetuned Model, one pass per adapter
+        logger.info(f"Generating {len(questions)} answer(s) with Finetuned Model...")
+        finetuned_stats = [None] * len(questions)
+        for name in dict.fromkeys(names):
+            indices = [i for i, n in enumerate(names) if n == name]
+            stats = self.generate_batch([questions[i] for i in indices], use_adapter=True, adapter=name,
+                                        max_batch_size=max_batch_size)
+            for i, result in zip(indices, stats):
+                finetuned_stats[i] = result
         
-        return {
-            "question": question,
-            "base_model": base_stats,
-            "finetuned_model": finetuned_stats
-        }
+        return [
+            {
+                "question": question,
+                "base_model": base,
+                "finetuned_model": finetuned
+            }
+            for question, base, finetuned in zip(questions, base_stats, finetuned_stats)
+        ]
@@ -0,0 +1,65 @@
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Sequence
+
+# Light modules come first; their "pulls torch" column is the regression to watch
+DEFAULT_MODULES = (
+    "src.config",
+    "src.records",
+    "src.utils",
+    "src.api.scheduler",
+    "torch",
+    "transformers",
+    "peft",
+    "src.data_handler",
+    "src.trainer",
+    "src.evaluator",
+)
+HEAVY_MODULES = ("torch", "transformers", "peft")
+# `python -c` puts the working directory on sys.path, so src.* resolves from here wherever main.py was started
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_LINE_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure_import(module: str, top: int = 5) -> Dict:
+    """Import `module` in a fresh interpreter under `-X importtime` and summarize the log."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=PROJECT_ROOT,
+    )
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed"
+        return {"module": module, "error": error}
+
+    entries = []
+    for line in result.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            self_us, cumulative_us, _, name = match.groups()
+            entries.append((name, int(self_us), int(cumulative_us)))
+    loaded = {name for name, _, _ in entries}
+    cumulative = next((c for name, _, c in reversed(entries) if name == module), sum(s for _, s, _ in entries))
+    slowest = sorted(entries, key=lambda entry: entry[1], reverse=True)[:top]
+    return {
+        "module": module,
+        "cumulative_ms": round(cumulative / 1000, 1),
+        "heavy": [name for name in HEAVY_MODULES if name in loaded and name != module],
+        "slowest": [{"module": name, "self_ms": round(self_us / 1000, 1)} for name, self_us, _ in slowest],
+    }
+
+
+def import_report(modules: Sequence[str] = DEFAULT_MODULES) -> List[Dict]:
+    return [measure_import(module) for module in modules]
+
+
+def format_report(rows: List[Dict]) -> str:
+    lines = [f"{'module':<22} {'import ms':>10}  pulls in"]
+    for row in rows:
+        if "error" in row:
+            lines.append(f"{row['module']:<22} {'-':>10}  {row['error']}")
+            continue
+        lines.append(f"{row['module']:<22} {row['cumulative_ms']:>10.1f}  {', '.join(row['heavy']) or '-'}")
+    return "\n".join(lines)
@@ -0,0 +1,111 @@
+import glob
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import torch
+from peft import PeftModel
+from transformers import AutoModelForCausalLM
+
+from .config import ModelConfig
+from .model_loader import load_tokenizer
+from .token_cache import files_sha256
+from .utils import setup_logger
+
+logger = setup_logger("MergeExport")
+
+MANIFEST_NAME = "merge_manifest.json"
+MANIFEST_VERSION = 1
+DTYPES = {"float16": torch.float16, "bfloat16": torch.bfloat16, "float32": torch.float32}
+
+
+def model_dir(name_or_path: str) -> str:
+    if os.path.isdir(name_or_path):
+        return name_or_path
+    from huggingface_hub import snapshot_download
+    return snapshot_download(name_or_path, local_files_only=True)
+
+
+def weight_files(directory: str, prefix: str = "") -> List[str]:
+    # safetensors when present, otherwise the pickled .bin shards
+    for pattern in (f"{prefix}*.safetensors", f"{prefix}*.bin"):
+        files = sorted(glob.glob(os.path.join(directory, pattern)))
+        if files:
+            return files
+    return []
+
+
+def read_manifest(checkpoint_dir: str) -> Optional[Dict]:
+    path = os.path.join(checkpoint_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def export_merged(model_config: ModelConfig, adapter_path: str, output_dir: str, dtype: str = "float16") -> Dict:
+    """Merge a LoRA adapter into the base weights and save a safetensors checkpoint with a manifest.
+
+    The base is loaded unquantized on CPU: merging into 4/8-bit weights would round the
+    LoRA delta away. The checkpoint is written to a temp dir and renamed into place.
+    """
+    torch_dtype = DTYPES[dtype]
+    base_files = weight_files(model_dir(model_config.name_or_path))
+    adapter_files = weight_files(adapter_path, prefix="adapter_model")
+    if not adapter_files:
+        raise FileNotFoundError(f"No adapter weights found in {adapter_path}")
+
+    start = time.time()
+    logger.info(f"Merging {adapter_path} into {model_config.name_or_path} ({dtype})")
+    model = AutoModelForCausalLM.from_pretrained(
+        model_config.name_or_path,
+        trust_remote_code=model_config.trust_remote_code,
+        dtype=torch_dtype,
+        low_cpu_mem_usage=True,
+        local_files_only=True  # Offline mod
+    )
+    model = PeftModel.from_pretrained(model, adapter_path).merge_and_unload()
+    with open(os.path.join(adapter_path, "adapter_config.json"), "r", encoding="utf-8") as f:
+        peft_config = json.load(f)
+
+    manifest = {
+        "manifest_version": MANIFEST_VERSION,
+        "base_model": model_config.name_or_path,
+        "base_sha256": files_sha256(base_files) if base_files else None,
+        "adapter_name": os.path.basename(os.path.normpath(adapter_path)),
+        "adapter_path": os.path.abspath(adapter_path),
+        "adapter_sha256": files_sha256(adapter_files),
+        "lora": {k: peft_config.get(k) for k in ("r", "lora_alpha", "target_modules")},
+        "dtype": dtype,
+        "created_at": time.time(),
+    }
+
+    parent = os.path.dirname(os.path.abspath(output_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+    try:
+        model.save_pretrained(tmp_dir, safe_serialization=True)
+        load_tokenizer(model_config).save_pretrained(tmp_dir)
+        with open(os.path.join(tmp_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+        os.replace(tmp_dir, output_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    logger.info(f"Merged checkpoint written to {output_dir} in {time.time() - start:.1f}s")
+    return manifest
+
+
+def is_stale(manifest: Dict) -> bool:
+    # The adapter was retrained after the export (only checkable where the adapter still exists)
+    adapter_path = manifest.get("adapter_path")
+    if not adapter_path or not os.path.isdir(adapter_path):
+        return False
+    files = weight_files(adapter_path, prefix="adapter_model")
+    return any(os.path.getmtime(path) > manifest["created_at"] for path in files)
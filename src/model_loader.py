@@ -1,8 +1,9 @@
 import torch
+from typing import Optional
 from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
 from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training, TaskType
 from .config import ModelConfig, PeftConfig
-from .utils import setup_logger
+from .utils import setup_logger, configure_cpu_threads
 
 logger = setup_logger("ModelLoader")
 
@@ -26,11 +27,62 @@ def load_tokenizer(model_config: ModelConfig):
         logger.info("Setting pad_token to eos_token")
     return tokenizer
 
-def load_model(model_config: ModelConfig, peft_config: PeftConfig = None, inference_mode: bool = False):
+def resolve_device(model_config: ModelConfig) -> str:
+    if model_config.device == "auto":
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    return model_config.device
+
+def load_cpu_model(model_config: ModelConfig, name_or_path: Optional[str] = None):
+    name_or_path = name_or_path or model_config.name_or_path
+    dtype = torch.bfloat16 if model_config.cpu_dtype == "bfloat16" else torch.float32
+    if model_config.dynamic_int8 and dtype != torch.float32:
+        logger.warning("Dynamic int8 quantization needs float32 weights, loading in float32")
+        dtype = torch.float32
+    if model_config.quantization_bit is not None:
+        logger.warning("bitsandbytes quantization needs CUDA, ignoring quantization_bit on CPU")
+
+    threads = configure_cpu_threads(model_config.max_cpu_threads)
+    logger.info(f"Loading model {name_or_path} on CPU ({dtype}, {threads} threads)")
+    model = AutoModelForCausalLM.from_pretrained(
+        name_or_path,
+        trust_remote_code=model_config.trust_remote_code,
+        dtype=dtype,
+        low_cpu_mem_usage=True,
+        local_files_only=True  # Offline mod
+    )
+    model.eval()
+    return model
+
+def quantize_dynamic_int8(model):
+    """Quantize nn.Linear weights to int8 in place; activations are quantized on the fly.
+
+    Run it after the adapter is attached: LoRA A/B layers stay in float, so adapters can
+    still be switched per request, while their base layers (or merged weights) become int8.
+    lm_head is left alone, it is the most quality-sensitive projection.
+    """
+    targets = {
+        name for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear) and "lora_" not in name and not name.endswith("lm_head")
+    }
+    if not targets:
+        logger.warning("No nn.Linear layers to quantize (GPT-2 style models use Conv1D)")
+        return model
+    logger.info(f"Applying dynamic int8 quantization to {len(targets)} linear layers")
+    return torch.ao.quantization.quantize_dynamic(model, targets, dtype=torch.qint8, inplace=True)
+
+def load_model(model_config: ModelConfig, peft_config: PeftConfig = None, inference_mode: bool = False,
+               name_or_path: Optional[str] = None):
+    # name_or_path overrides model_config.name_or_path, e.g. for a merged checkpoint
+    if resolve_device(model_config) == "cpu":
+        if not inference_mode:
+            raise RuntimeError("The CPU backend is inference-only, training requires CUDA.")
+        return load_cpu_model(model_config, name_or_path)
+
     if not torch.cuda.is_available():
         raise RuntimeError("CUDA not available! GPU required for this model.")
-    
-    logger.info(f"Loading model {model_config.name_or_path} on GPU. Inference Mode: {inference_mode}")
+
+    name_or_path = name_or_path or model_config.name_or_path
+    logger.info(f"Loading model {name_or_path} on GPU. Inference Mode: {inference_mode}")
     
     bnb_config = None
     if model_config.quantization_bit in [4, 8]:
@@ -44,11 +96,11 @@ def load_model(model_config: ModelConfig, peft_config: PeftConfig = None, infere
         )
 
     model = AutoModelForCausalLM.from_pretrained(
-        model_config.name_or_path,
+        name_or_path,
         quantization_config=bnb_config,
         device_map="auto",
         trust_remote_code=model_config.trust_remote_code,
-        torch_dtype=torch.float16,
+        dtype=torch.float16,
         low_cpu_mem_usage=True,
         use_cache=False if not inference_mode else True,
         local_files_only=True  # Offline mod
@@ -0,0 +1,86 @@
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import torch
+from transformers import DynamicCache
+
+# Per-layer (key, value) tensors for a single row
+LayerKV = List[Tuple[torch.Tensor, torch.Tensor]]
+
+
+class PrefixCache:
+    """Past key/values of registered prompt prefixes, one entry per prefix and adapter state.
+
+    A batch can reuse an entry when every row's token ids start with the prefix ids, so
+    prefill only has to cover what follows. Prefixes are matched on token ids, never on
+    text, so a tokenizer that merges across the boundary simply gets no hit.
+    """
+
+    def __init__(self, tokenizer, prefixes: Sequence[str]):
+        registered = {}
+        for prefix in prefixes:
+            ids = tokenizer(prefix)["input_ids"]
+            if ids:
+                registered[tuple(ids)] = prefix
+        # Longest first, so the most specific prefix wins
+        self.prefixes = sorted(registered, key=len, reverse=True)
+        self._entries: Dict[tuple, Tuple[LayerKV, float]] = {}
+        self.lookups = 0
+        self.hits = 0
+        self.tokens_saved = 0
+        self.prefill_ms_saved = 0.0
+
+    def match(self, rows: Sequence[Sequence[int]]) -> Optional[Tuple[int, ...]]:
+        self.lookups += 1
+        for prefix in self.prefixes:
+            n = len(prefix)
+            # At least one token must follow the prefix so generate has logits to start from
+            if all(len(ids) > n and tuple(ids[:n]) == prefix for ids in rows):
+                return prefix
+        return None
+
+    def get(self, prefix: Tuple[int, ...], state_key, build: Callable[[], LayerKV]) -> LayerKV:
+        key = (prefix, state_key)
+        entry = self._entries.get(key)
+        if entry is None:
+            start = time.perf_counter()
+            layers = build()
+            entry = (layers, (time.perf_counter() - start) * 1000)
+            self._entries[key] = entry
+        return entry[0]
+
+    def record_hit(self, prefix: Tuple[int, ...], state_keys: Sequence):
+        # Saved time is estimated from the single-row prefill measured when each entry was built
+        self.hits += 1
+        self.tokens_saved += len(prefix) * len(state_keys)
+        self.prefill_ms_saved += sum(self._entries[(prefix, key)][1] for key in state_keys)
+
+    def discard(self, state_matches: Callable[[object], bool]):
+        # Drops the entries of adapter states that are gone, e.g. an evicted or reloaded adapter
+        for key in [key for key in self._entries if state_matches(key[1])]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    @staticmethod
+    def batch_cache(rows: Sequence[LayerKV]) -> DynamicCache:
+        # torch.cat copies, so generate never grows the stored tensors
+        layers = [
+            (torch.cat([row[i][0] for row in rows]), torch.cat([row[i][1] for row in rows]))
+            for i in range(len(rows[0]))
+        ]
+        if hasattr(DynamicCache, "from_legacy_cache"):
+            return DynamicCache.from_legacy_cache(tuple(layers))
+        return DynamicCache(layers)
+
+    def stats(self) -> Dict:
+        return {
+            "prefixes": len(self.prefixes),
+            "entries": len(self._entries),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            "prefill_tokens_saved": self.tokens_saved,
+            "prefill_ms_saved_estimate": round(self.prefill_ms_saved, 2),
+        }
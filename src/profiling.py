@@ -0,0 +1,79 @@
+import os
+import torch
+from transformers import TrainerCallback
+from .config import ProfilingConfig
+from .utils import setup_logger
+
+logger = setup_logger("Profiler")
+
+class ProfilerCallback(TrainerCallback):
+    """Runs torch.profiler over a window of optimizer steps.
+
+    The schedule advances once per optimizer step (on_step_end), so skip_first/wait/warmup/
+    active count optimizer steps, not micro-batches. Every finished cycle writes a Chrome
+    trace (chrome://tracing or ui.perfetto.dev) and a top-operators table to
+    `<output_dir>/<output_subdir>`.
+    """
+
+    def __init__(self, config: ProfilingConfig, output_dir: str):
+        self.config = config
+        self.output_dir = os.path.join(output_dir, config.output_subdir)
+        self.profiler = None
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.process_index = args.process_index
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        self.profiler = torch.profiler.profile(
+            activities=activities,
+            schedule=torch.profiler.schedule(
+                skip_first=self.config.skip_first,
+                wait=self.config.wait,
+                warmup=self.config.warmup,
+                active=self.config.active,
+                repeat=self.config.repeat,
+            ),
+            on_trace_ready=self._export,
+            record_shapes=self.config.record_shapes,
+            profile_memory=self.config.profile_memory,
+            with_stack=self.config.with_stack,
+        )
+        self.profiler.start()
+        # Steps are counted from here, a resumed run profiles relative to its own start
+        self.first_step = state.global_step
+        logger.info(
+            f"Profiling {self.config.active} step(s) after step "
+            f"{self.first_step + self.config.skip_first + self.config.wait + self.config.warmup}, "
+            f"traces go to {self.output_dir}"
+        )
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if self.profiler is not None:
+            self.profiler.step()
+
+    def on_train_end(self, args, state, control, **kwargs):
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler = None
+
+    def _export(self, prof):
+        # step_num is the profiler's own counter: the first optimizer step after the window
+        last_step = self.first_step + prof.step_num
+        name = f"step{last_step - self.config.active + 1}-{last_step}_rank{self.process_index}"
+        trace_path = os.path.join(self.output_dir, f"trace_{name}.json")
+        prof.export_chrome_trace(trace_path)
+
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        averages = prof.key_averages()
+        table = averages.table(sort_by=f"self_{device}_time_total", row_limit=self.config.top_ops)
+        summary_path = os.path.join(self.output_dir, f"top_ops_{name}.txt")
+        with open(summary_path, "w", encoding="utf-8") as f:
+            f.write(table + "\n")
+        if self.config.profile_memory:
+            memory = averages.table(sort_by=f"self_{device}_memory_usage", row_limit=self.config.top_ops)
+            with open(summary_path, "a", encoding="utf-8") as f:
+                f.write("\n" + memory + "\n")
+        logger.info(f"Profiled steps {name}: {trace_path}, {summary_path}")
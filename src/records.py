@@ -0,0 +1,65 @@
+import glob
+import json
+import os
+from typing import Dict, Iterator, List, Tuple
+
+# Dataset file helpers without any ML dependencies, shared by data_handler and the config dry run
+
+DATA_EXTENSIONS = (".json", ".jsonl")
+
+def resolve_dataset_files(dataset_path: str) -> List[str]:
+    # A single file, a directory of shards or a glob pattern
+    if os.path.isdir(dataset_path):
+        files = [os.path.join(dataset_path, name) for name in os.listdir(dataset_path) if name.endswith(DATA_EXTENSIONS)]
+    elif glob.has_magic(dataset_path):
+        files = glob.glob(dataset_path)
+    else:
+        files = [dataset_path]
+    files = sorted(files)
+    if not files or not all(os.path.isfile(path) for path in files):
+        raise FileNotFoundError(f"No dataset files found for {dataset_path}")
+    return files
+
+def iter_records(path: str) -> Iterator[Dict]:
+    # JSONL is read line by line; a plain JSON array has to be loaded whole
+    with open(path, 'r', encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)
+
+def format_prompt(instruction: str, input_text: str = "") -> str:
+    # Format prompt (Simplified alpaca-like format)
+    if input_text:
+        return f"### Instruction:\n{instruction}\n\n### Input:\n{input_text}\n\n### Response:\n"
+    return f"### Instruction:\n{instruction}\n\n### Response:\n"
+
+def split_sample(item: Dict, eos_token: str) -> Tuple[str, str]:
+    # (prompt, completion); the token cache records where the completion starts
+    prompt = format_prompt(item.get("instruction", ""), item.get("input", ""))
+    return prompt, item.get("output", "") + eos_token
+
+def format_sample(item: Dict, eos_token: str) -> str:
+    return "".join(split_sample(item, eos_token))
+
+def validate_records(dataset_path: str) -> Dict:
+    # Reads every record once without tokenizing; malformed JSON raises with the file name
+    summary = {"files": 0, "records": 0, "not_an_object": 0, "missing_instruction": 0, "missing_output": 0}
+    for path in resolve_dataset_files(dataset_path):
+        summary["files"] += 1
+        try:
+            for record in iter_records(path):
+                summary["records"] += 1
+                if not isinstance(record, dict):
+                    summary["not_an_object"] += 1
+                    continue
+                if not record.get("instruction"):
+                    summary["missing_instruction"] += 1
+                if not record.get("output"):
+                    summary["missing_output"] += 1
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{path}: invalid JSON ({e})") from e
+    return summary
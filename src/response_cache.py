@@ -0,0 +1,131 @@
+import asyncio
+import hashlib
+import json
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    # No case folding: Turkish dotted/dotless i make lower-casing lossy
+    return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFKC", question)).strip()
+
+
+class ResponseCache:
+    """LRU + TTL cache of generation results with single-flight coalescing.
+
+    Concurrent `get_or_compute` calls for the same key share one in-flight computation.
+    The computation runs as its own task, so a caller that disconnects does not cancel
+    it for the others. `get_or_compute_many` computes all misses of a batch in one call, so
+    the batch is admitted or rejected downstream as a whole. Only deterministic results
+    should be stored here.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_s: Optional[float] = 3600.0):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(question: str, identity: Dict) -> str:
+        raw = json.dumps({"q": normalize_question(question), **identity}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def put(self, key: str, value: Any):
+        expires_at = time.monotonic() + self.ttl_s if self.ttl_s else float("inf")
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        found, value = self.get(key)
+        if found:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_done(key, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def get_or_compute_many(self, keys: Sequence[str],
+                                  compute: Callable[[List[int]], Awaitable[List[Any]]]) -> List[Any]:
+        """Like `get_or_compute` for every key; `compute` gets the positions of the distinct misses
+        in `keys` and returns their values in that order."""
+        results: List[Any] = [None] * len(keys)
+        missing: Dict[str, int] = {}
+        for i, key in enumerate(keys):
+            found, value = self.get(key)
+            if found:
+                self.hits += 1
+                results[i] = value
+            elif key in self._inflight or key in missing:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+                missing[key] = i
+
+        if missing:
+            batch = asyncio.ensure_future(compute(list(missing.values())))
+            for n, key in enumerate(missing):
+                task = asyncio.ensure_future(self._batch_item(batch, n))
+                self._inflight[key] = task
+                task.add_done_callback(lambda t, key=key: self._on_done(key, t))
+
+        pending = {i: self._inflight[key] for i, key in enumerate(keys) if key in self._inflight}
+        values = await asyncio.gather(*(asyncio.shield(task) for task in pending.values()))
+        for i, value in zip(pending, values):
+            results[i] = value
+        return results
+
+    @staticmethod
+    async def _batch_item(batch: asyncio.Future, n: int) -> Any:
+        return (await batch)[n]
+
+    def _on_done(self, key: str, task: asyncio.Future):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self.put(key, task.result())
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "in_flight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
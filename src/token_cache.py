@@ -0,0 +1,292 @@
+import collections
+import hashlib
+import itertools
+import json
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import time
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+from .utils import setup_logger
+
+logger = setup_logger("TokenCache")
+
+# Bump when the on-disk layout or the tokenization recipe changes
+CACHE_VERSION = 2
+TOKEN_DTYPE = np.int32
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def files_sha256(paths: Sequence[str]) -> str:
+    if len(paths) == 1:
+        return file_sha256(paths[0])
+    h = hashlib.sha256()
+    for path in paths:
+        h.update(os.path.basename(path).encode())
+        h.update(file_sha256(path).encode())
+    return h.hexdigest()
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    # name_or_path alone is not enough: the same path can hold a re-trained vocab
+    h = hashlib.sha256()
+    h.update(type(tokenizer).__name__.encode())
+    h.update(str(getattr(tokenizer, "name_or_path", "")).encode())
+    h.update(str(len(tokenizer)).encode())
+    h.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True, default=str).encode())
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        # truncation/padding in the serialized state are runtime settings left by the last call
+        state = json.loads(backend.to_str())
+        state.pop("truncation", None)
+        state.pop("padding", None)
+        h.update(json.dumps(state, sort_keys=True).encode())
+    else:
+        h.update(json.dumps(tokenizer.get_vocab(), sort_keys=True).encode())
+    return h.hexdigest()[:16]
+
+
+def cache_key(dataset_hash: str, tokenizer_fp: str, max_seq_length: int) -> str:
+    raw = f"v{CACHE_VERSION}:{dataset_hash}:{tokenizer_fp}:{max_seq_length}"
+    return hashlib.sha256(raw.encode()).hexdigest()[:20]
+
+
+class TokenCache:
+    """Pre-tokenized samples stored as one flat memory-mapped token array plus offsets.
+
+    `prompt_lengths` holds, per sample, how many leading tokens are prompt; everything after
+    is the response. It is recorded once at tokenization time so label masking costs nothing later.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        tokens_path = os.path.join(path, "tokens.bin")
+        if os.path.getsize(tokens_path) > 0:
+            self.tokens = np.memmap(tokens_path, dtype=TOKEN_DTYPE, mode="r")
+        else:
+            self.tokens = np.zeros(0, dtype=TOKEN_DTYPE)
+        self.prompt_lengths = np.load(os.path.join(path, "prompt_lengths.npy"), mmap_mode="r")
+        self._lengths = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        return self.tokens[self.offsets[index]:self.offsets[index + 1]]
+
+    @property
+    def lengths(self) -> np.ndarray:
+        if self._lengths is None:
+            self._lengths = np.diff(np.asarray(self.offsets))
+        return self._lengths
+
+    @property
+    def num_tokens(self) -> int:
+        return int(self.offsets[-1])
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, "meta.json"))
+
+    def subset(self, indices: Sequence[int]) -> "TokenCacheSubset":
+        return TokenCacheSubset(self, indices)
+
+
+class TokenCacheSubset:
+    # Same read interface as TokenCache over selected samples (train/eval split), no copy of the tokens
+    def __init__(self, cache: TokenCache, indices: Sequence[int]):
+        self.cache = cache
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.lengths = np.asarray(cache.lengths)[self.indices]
+        self.prompt_lengths = np.asarray(cache.prompt_lengths)[self.indices]
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        return self.cache[int(self.indices[index])]
+
+    @property
+    def num_tokens(self) -> int:
+        return int(self.lengths.sum())
+
+
+def _batched(iterable: Iterable, n: int) -> Iterator[list]:
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, n))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _prompt_token_count(offsets: Sequence[Tuple[int, int]], prompt_chars: int) -> int:
+    # First token that starts inside the response; a token straddling the boundary stays prompt.
+    # Special tokens have empty (0, 0) spans and never end the prompt.
+    for index, (start, end) in enumerate(offsets):
+        if end > start and start >= prompt_chars:
+            return index
+    return len(offsets)
+
+
+def encode_samples(tokenizer, samples: List[Tuple[str, str]], max_seq_length: int) -> Tuple[List[List[int]], List[int]]:
+    """Tokenize (prompt, completion) pairs as one text each.
+
+    Returns the token ids and, per sample, the number of leading prompt tokens. The pair is
+    tokenized together (not prompt and completion separately) so merges across the boundary
+    match what the model sees at inference time.
+    """
+    texts = [prompt + completion for prompt, completion in samples]
+    if getattr(tokenizer, "is_fast", False):
+        encoded = tokenizer(texts, max_length=max_seq_length, truncation=True, return_offsets_mapping=True)
+        prompt_lengths = [
+            _prompt_token_count(offsets, len(prompt))
+            for (prompt, _), offsets in zip(samples, encoded["offset_mapping"])
+        ]
+        return encoded["input_ids"], prompt_lengths
+
+    # Slow tokenizers have no offsets: count the prompt's own tokens instead
+    ids = tokenizer(texts, max_length=max_seq_length, truncation=True)["input_ids"]
+    prompt_ids = tokenizer([prompt for prompt, _ in samples], max_length=max_seq_length, truncation=True)["input_ids"]
+    return ids, [min(len(p), len(x)) for p, x in zip(prompt_ids, ids)]
+
+
+def _encode_batch(tokenizer, samples: List[Tuple[str, str]], max_seq_length: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Flat ids + lengths pickle much cheaper than a list of lists when coming back from a worker
+    ids, prompt_lengths = encode_samples(tokenizer, samples, max_seq_length)
+    lengths = np.fromiter((len(x) for x in ids), dtype=np.int64, count=len(ids))
+    flat = np.fromiter(itertools.chain.from_iterable(ids), dtype=TOKEN_DTYPE, count=int(lengths.sum()))
+    return flat, lengths, np.asarray(prompt_lengths, dtype=np.int32)
+
+
+_worker_state = None
+
+
+def _pool_init(tokenizer, max_seq_length: int):
+    global _worker_state
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    _worker_state = (tokenizer, max_seq_length)
+
+
+def _pool_encode(samples: List[Tuple[str, str]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    tokenizer, max_seq_length = _worker_state
+    return _encode_batch(tokenizer, samples, max_seq_length)
+
+
+def encode_batches(samples: Iterable[Tuple[str, str]], tokenizer, max_seq_length: int, num_proc: int = 1,
+                   batch_size: int = 1000) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Tokenize (prompt, completion) `samples` in batches, in order, optionally across a process pool."""
+    batches = _batched(samples, batch_size)
+    if num_proc <= 1:
+        for batch in batches:
+            yield _encode_batch(tokenizer, batch, max_seq_length)
+        return
+
+    # spawn: forking after the fast tokenizer has used its thread pool can deadlock
+    with mp.get_context("spawn").Pool(num_proc, initializer=_pool_init, initargs=(tokenizer, max_seq_length)) as pool:
+        # Bounded in-flight queue instead of imap, whose feeder would read the whole corpus ahead
+        pending = collections.deque()
+        for batch in batches:
+            pending.append(pool.apply_async(_pool_encode, (batch,)))
+            if len(pending) >= 2 * num_proc:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def build_token_cache(path: str, samples: Iterable[Tuple[str, str]], tokenizer, max_seq_length: int,
+                      meta: Optional[dict] = None, num_proc: int = 1, batch_size: int = 1000) -> TokenCache:
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    # Build in a sibling temp dir and rename, so an interrupted run never leaves a half cache
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+    try:
+        offsets = [np.zeros(1, dtype=np.int64)]
+        prompt_lengths = []
+        num_samples, num_tokens = 0, 0
+        start = time.perf_counter()
+        with open(os.path.join(tmp_dir, "tokens.bin"), "wb") as f, \
+                tqdm(desc="Tokenizing", unit=" samples", leave=False) as progress:
+            for flat, lengths, prompts in encode_batches(samples, tokenizer, max_seq_length, num_proc, batch_size):
+                f.write(flat.tobytes())
+                offsets.append(num_tokens + np.cumsum(lengths))
+                prompt_lengths.append(prompts)
+                num_samples += len(lengths)
+                num_tokens += len(flat)
+                progress.update(len(lengths))
+                progress.set_postfix(tokens_per_s=f"{num_tokens / max(time.perf_counter() - start, 1e-9):.0f}")
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        logger.info(
+            f"Tokenized {num_samples} samples / {num_tokens} tokens in {elapsed:.1f}s with {max(num_proc, 1)} process(es) "
+            f"({num_samples / elapsed:.0f} samples/s, {num_tokens / elapsed:.0f} tokens/s)"
+        )
+        offsets = np.concatenate(offsets)
+        np.save(os.path.join(tmp_dir, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+        prompt_lengths = np.concatenate(prompt_lengths) if prompt_lengths else np.zeros(0, dtype=np.int32)
+        np.save(os.path.join(tmp_dir, "prompt_lengths.npy"), prompt_lengths)
+
+        meta = dict(meta or {})
+        meta.update({
+            "version": CACHE_VERSION,
+            "max_seq_length": max_seq_length,
+            "num_samples": num_samples,
+            "num_tokens": num_tokens,
+            "num_prompt_tokens": int(prompt_lengths.sum()),
+        })
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+
+        try:
+            os.replace(tmp_dir, path)
+        except OSError:
+            # Another process finished the same cache first; keep theirs
+            if not TokenCache.exists(path):
+                raise
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return TokenCache(path)
+
+
+def get_token_cache(dataset_files: Sequence[str], tokenizer, max_seq_length: int, cache_dir: str,
+                    samples_fn: Callable[[], Iterable[Tuple[str, str]]], num_proc: int = 1,
+                    batch_size: int = 1000) -> TokenCache:
+    """Return the cache for this dataset/tokenizer/length, tokenizing only on a miss.
+
+    `samples_fn` yields (prompt, completion) pairs and is only called on a miss, so a hit
+    never parses the dataset files.
+    """
+    dataset_hash = files_sha256(dataset_files)
+    tokenizer_fp = tokenizer_fingerprint(tokenizer)
+    path = os.path.join(cache_dir, cache_key(dataset_hash, tokenizer_fp, max_seq_length))
+
+    if TokenCache.exists(path):
+        cache = TokenCache(path)
+        logger.info(f"Token cache hit: {path} ({len(cache)} samples, {cache.num_tokens} tokens)")
+        return cache
+
+    logger.info(f"Token cache miss, tokenizing into {path}")
+    cache = build_token_cache(path, samples_fn(), tokenizer, max_seq_length, meta={
+        "dataset_files": list(dataset_files),
+        "dataset_sha256": dataset_hash,
+        "tokenizer": getattr(tokenizer, "name_or_path", type(tokenizer).__name__),
+        "tokenizer_fingerprint": tokenizer_fp,
+    }, num_proc=num_proc, batch_size=batch_size)
+    logger.info(f"Token cache written: {len(cache)} samples, {cache.num_tokens} tokens")
+    return cache
@@ -1,36 +1,58 @@
 import transformers
-from transformers import Trainer, TrainingArguments, TrainerCallback
+from transformers import EarlyStoppingCallback, Trainer, TrainingArguments, TrainerCallback
+from transformers.trainer import OPTIMIZER_NAME, SCALER_NAME, SCHEDULER_NAME, TRAINER_STATE_NAME, TRAINING_ARGS_NAME
+from transformers.trainer_callback import ExportableState
+from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR, get_last_checkpoint, has_length, speed_metrics
+from transformers.utils import ADAPTER_SAFE_WEIGHTS_NAME
+import numpy as np
 import torch
+import torch.nn.functional as F
+from accelerate.data_loader import prepare_data_loader
+from peft import PeftModel, get_peft_model_state_dict
+from safetensors.torch import save_file
+from torch.utils.data import DataLoader, IterableDataset
+from .checkpointing import CheckpointWriter, rotate_checkpoints, to_cpu
 from .config import AppConfig
+from .data_handler import TokenBudgetBatchSampler, DynamicPaddingCollator, PackedDataset, length_sorted_batches
 from .utils import setup_logger, get_gpu_memory_usage
+from typing import Callable, Dict, List, Optional
+import copy
+import dataclasses
+import json
+import math
+import os
+import random
 import time
 
 logger = setup_logger("Trainer")
 
+DATA_STATE_NAME = "data_state.json"
+
 class MonitoringCallback(TrainerCallback):
     def __init__(self):
         self.start_time = time.time()
         self.last_log_time = time.time()
-        self.total_tokens_processed = 0
 
     def on_log(self, args, state, control, logs=None, **kwargs):
         if logs:
             current_time = time.time()
             elapsed_total = current_time - self.start_time
             
-            # Estimate tokens - crude approximation if not directly provided
-            # Standard HF logs don't give "tokens processed" directly in step logs usually,
-            # but we can infer from batch size * seq len * steps roughly or rely on 'loss'.
-            # Better: The prompt wants "tokens/sec".
-            # We can calculate it if we knew the input sizes, but let's approximate or just log step speed.
-            # Using samples/sec from logs is safer.
-            
-            # logs often has: 'loss', 'learning_rate', 'epoch', 'step'
-            
-            # Let's augment the log with GPU usage
+            # Throughput and step timing come from InstructTrainer.log()
             gpu_stats = get_gpu_memory_usage()
             
             logger.info(f"Step {state.global_step} | Loss: {logs.get('loss', 'N/A')} | Epoch: {logs.get('epoch', 'N/A')}")
+            if "padding_ratio" in logs:
+                logger.info(f"Padding: {logs['fixed_padding_ratio']:.1%} at max_seq_length -> {logs['padding_ratio']:.1%} actual")
+            if "tokens_per_s" in logs:
+                logger.info(
+                    f"Throughput: {logs['tokens_per_s']:.0f} tokens/s | Step: {logs['step_ms']:.0f} ms "
+                    f"(data {logs['data_wait_ms']:.0f}, fwd/bwd {logs['fwd_bwd_ms']:.0f}, optimizer {logs['optimizer_ms']:.0f})"
+                )
+                mfu = f", MFU {logs['mfu']:.1%}" if "mfu" in logs else ""
+                logger.info(f"Compute: {logs['tflops']:.2f} TFLOP/s{mfu}")
+            if "eval_loss" in logs:
+                logger.info(f"Eval: loss {logs['eval_loss']:.4f} | perplexity {logs['eval_perplexity']:.2f} | {logs['eval_runtime']:.1f}s")
             if isinstance(gpu_stats, dict):
                  logger.info(f"VRAM Used: {gpu_stats['used_gb']} GB")
 
@@ -41,22 +63,618 @@ class MonitoringCallback(TrainerCallback):
                     eta_seconds = (elapsed_total / percent_done) - elapsed_total
                     logger.info(f"ETA: {int(eta_seconds // 60)}m {int(eta_seconds % 60)}s")
 
+def count_flop_params(model) -> Dict[str, int]:
+    # Embedding lookups do no matmul work, so their weights are left out
+    embeddings = {id(p) for m in model.modules() if isinstance(m, torch.nn.Embedding) for p in m.parameters()}
+    counts = {"trainable": 0, "frozen": 0}
+    for param in model.parameters():
+        if id(param) not in embeddings:
+            counts["trainable" if param.requires_grad else "frozen"] += param.numel()
+    config = getattr(model, "config", None)
+    counts["layers"] = getattr(config, "num_hidden_layers", None) or getattr(config, "n_layer", 0)
+    counts["hidden"] = getattr(config, "hidden_size", None) or getattr(config, "n_embd", 0)
+    return counts
+
+def flops_per_token(counts: Dict[str, int], seq_length: float) -> float:
+    """Training FLOPs per token: 6N for trainable weights, 4N for frozen ones (activation
+    gradients only) plus the attention score/value matmuls over `seq_length`."""
+    return 6 * counts["trainable"] + 4 * counts["frozen"] + 12 * counts["layers"] * counts["hidden"] * seq_length
+
+class StepMetricsCallback(TrainerCallback):
+    # Closes every optimizer step of InstructTrainer; the Trainer has no hook around optimizer.step()
+    def __init__(self, trainer: "InstructTrainer"):
+        self.trainer = trainer
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.trainer._start_step_metrics()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        self.trainer._end_step(state)
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self.trainer._close_metrics_file()
+
+class DataStateCallback(TrainerCallback):
+    # Tracks the data position saved with every checkpoint and restores it when training resumes
+    def __init__(self, trainer: "InstructTrainer"):
+        self.trainer = trainer
+
+    def on_train_begin(self, args, state, control, train_dataloader=None, **kwargs):
+        self.trainer._restore_data_state(state, train_dataloader)
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        self.trainer._begin_data_epoch()
+
+class InstructTrainer(Trainer):
+    """Trainer with an optional custom batch sampler and per-step instrumentation.
+
+    Every optimizer step is split into data wait (fetching the accumulation batches),
+    forward/backward, optimizer (clipping, step, scheduler, zero_grad) and other time
+    (callbacks, logging, saving). Real token counts come from the attention masks, or from
+    `num_tokens` for packed rows. Window averages go into the step logs; each step is also
+    appended to `metrics_file` in output_dir.
+
+    Every checkpoint records the data epoch and the batches consumed in it (`data_state.json`).
+    Streamed datasets seek to that position on resume instead of the Trainer fetching and
+    dropping every consumed batch; for map-style datasets the Trainer's own skip only walks
+    the sampler's indices. A warning is logged when settings that decide the sample order
+    changed since the checkpoint.
+
+    Checkpoints of a single-process LoRA run hold the adapter weights, optimizer, scheduler,
+    scaler and RNG states in the Trainer's file layout. Training only blocks while they are
+    copied to host memory; a CheckpointWriter serializes them in the background, renames the
+    finished directory into place and keeps the last `save_total_limit` checkpoints plus the
+    best one. The blocked time of every save is logged and appended to `metrics_file`.
+
+    Evaluation runs over eval batches collated once (length-sorted, dynamically padded) and
+    reports the token-weighted eval_loss and its perplexity.
+
+    The loss runs the decoder body and projects only the hidden states of supervised positions
+    (label != -100) through the LM head, so masked prompt and padding tokens never pay for the
+    vocabulary-sized logits. Models whose head does more than a plain projection, and
+    multi-process runs (whose wrapper must see the full forward), use the model's own loss.
+    """
+
+    def __init__(self, *args, batch_sampler=None, max_seq_length: int = None,
+                 metrics_file: Optional[str] = None, peak_tflops: Optional[float] = None,
+                 response_only: bool = False, save_total_limit: Optional[int] = None,
+                 async_checkpointing: bool = True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_sampler = batch_sampler
+        self.max_seq_length = max_seq_length
+        self.metrics_file = metrics_file
+        self.peak_tflops = peak_tflops
+        self.response_only = response_only
+        self.save_total_limit = save_total_limit
+        self.async_checkpointing = async_checkpointing
+        self._checkpoint_writer = None
+        self._metrics_fh = None
+        self._flop_counts = None
+        self._eval_batches = None
+        self._lm_parts = None
+        self._resume_checkpoint = None
+        self._data_epoch = 0
+        self._data_batches = 0
+        self._data_worker_samples: List[int] = []
+        self._data_next_worker = 0
+        self._data_epoch_started = False
+        self._reset_padding_stats()
+        self._reset_step()
+        self._reset_window()
+        self.add_callback(StepMetricsCallback(self))
+        self.add_callback(DataStateCallback(self))
+
+    def _reset_padding_stats(self):
+        # Real-token count stays on device until log time to avoid a sync per step
+        self._real_tokens = 0
+        self._padded_slots = 0
+        self._num_sequences = 0
+
+    def get_train_dataloader(self):
+        if getattr(self.train_dataset, "shards_by_rank", False):
+            return self._get_rank_sharded_dataloader()
+        if self.batch_sampler is None:
+            return super().get_train_dataloader()
+        dataloader = DataLoader(
+            self.train_dataset,
+            batch_sampler=self.batch_sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            prefetch_factor=self.args.dataloader_prefetch_factor,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+        return self.accelerator.prepare(dataloader)
+
+    def _get_rank_sharded_dataloader(self):
+        # accelerate would split the stream across processes again, so prepare it as a single process
+        dataloader = DataLoader(
+            self.train_dataset,
+            batch_size=self._train_batch_size,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            prefetch_factor=self.args.dataloader_prefetch_factor,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+        return prepare_data_loader(
+            dataloader,
+            device=self.args.device,
+            num_processes=1,
+            process_index=0,
+            put_on_device=True,
+            dispatch_batches=False,
+        )
+
+    def _reset_step(self):
+        self._step = {"data_wait": 0.0, "fwd_bwd": 0.0, "tokens": 0, "slots": 0, "sequences": 0}
+
+    def _reset_window(self):
+        self._window = {"steps": 0, "wall": 0.0, "data_wait": 0.0, "fwd_bwd": 0.0, "optimizer": 0.0, "tokens": 0, "flops": 0.0}
+
+    def _sync(self):
+        # CUDA kernels run asynchronously; without a sync the time lands in whichever phase waits next
+        if self.args.device.type == "cuda":
+            torch.cuda.synchronize()
+
+    def _start_step_metrics(self):
+        self._reset_step()
+        self._step_start = time.perf_counter()
+        self._fwd_bwd_end = None
+        self._flop_counts = count_flop_params(self.model)
+        if self.metrics_file and self.is_world_process_zero():
+            path = os.path.join(self.args.output_dir, self.metrics_file)
+            os.makedirs(self.args.output_dir, exist_ok=True)
+            # Appends, so a resumed run continues the same file
+            self._metrics_fh = open(path, "a", encoding="utf-8")
+            self._write_metrics({
+                "event": "run_start",
+                "world_size": self.args.world_size,
+                "device": str(self.args.device),
+                "peak_tflops": self.peak_tflops,
+                "flop_params": self._flop_counts,
+            })
+            logger.info(f"Writing step metrics to {path}")
+
+    def _write_metrics(self, record: Dict):
+        if self._metrics_fh is None:
+            return
+        record["time"] = round(time.time(), 3)
+        self._metrics_fh.write(json.dumps(record) + "\n")
+        self._metrics_fh.flush()
+
+    def _close_metrics_file(self):
+        if self._metrics_fh is not None:
+            self._metrics_fh.close()
+            self._metrics_fh = None
+
+    def get_batch_samples(self, *args, **kwargs):
+        # Fetches all gradient-accumulation batches of the next optimizer step
+        start = time.perf_counter()
+        batches = super().get_batch_samples(*args, **kwargs)
+        self._step["data_wait"] += time.perf_counter() - start
+        self._data_batches += len(batches[0])
+        for batch in batches[0]:
+            worker = batch.pop("data_worker", None)
+            if worker is not None:
+                self._count_worker_samples(worker, len(batch["input_ids"]))
+        return batches
+
+    def _count_worker_samples(self, worker: int, samples: int):
+        # The DataLoader asks its workers in turn, skipping exhausted ones, so the next batch is due from worker + 1
+        counts = self._data_worker_samples
+        counts.extend([0] * (worker + 1 - len(counts)))
+        counts[worker] += samples
+        self._data_next_worker = (worker + 1) % max(1, self.args.dataloader_num_workers)
+
+    def train(self, resume_from_checkpoint=None, *args, **kwargs):
+        # Resolved the same way as the Trainer does, DataStateCallback reads the data position from it
+        checkpoint = resume_from_checkpoint
+        if checkpoint is True:
+            checkpoint = get_last_checkpoint(self.args.output_dir)
+        self._resume_checkpoint = checkpoint or None
+        if self.args.world_size == 1 and self.args.should_save:
+            self._checkpoint_writer = CheckpointWriter(self.args.output_dir, self.save_total_limit,
+                                                       background=self.async_checkpointing)
+        try:
+            return super().train(resume_from_checkpoint, *args, **kwargs)
+        finally:
+            # Also on errors, so the last checkpoint started is complete on disk
+            writer, self._checkpoint_writer = self._checkpoint_writer, None
+            if writer is not None:
+                writer.close()
+
+    def _snapshots_checkpoint(self, model) -> bool:
+        # Adapter-only snapshots need a single LoRA adapter and a device whose RNG state we capture
+        return (
+            self._checkpoint_writer is not None
+            and isinstance(model, PeftModel)
+            and len(model.peft_config) == 1
+            and not (self.is_deepspeed_enabled or self.is_fsdp_enabled)
+            and self.args.device.type in ("cpu", "cuda")
+        )
+
+    def _save_checkpoint(self, model, trial):
+        start = time.perf_counter()
+        run_dir = self._get_output_dir(trial=trial)
+        checkpoint = os.path.join(run_dir, f"{PREFIX_CHECKPOINT_DIR}-{self.state.global_step}")
+        unwrapped = self.accelerator.unwrap_model(model)
+        if not self._snapshots_checkpoint(unwrapped):
+            super()._save_checkpoint(model, trial)
+            if self.args.should_save:
+                with open(os.path.join(checkpoint, DATA_STATE_NAME), "w") as f:
+                    json.dump(self._data_state(), f, indent=2)
+                rotate_checkpoints(run_dir, self.save_total_limit, self.state.best_model_checkpoint)
+            return
+
+        # Earlier checkpoints are complete on disk after this, only the current one is still unwritten
+        waited = self._checkpoint_writer.wait()
+        if trial is None:
+            self.store_flos()
+        if self.state.best_global_step:
+            best = os.path.join(run_dir, f"{PREFIX_CHECKPOINT_DIR}-{self.state.best_global_step}")
+            if self.state.best_global_step == self.state.global_step or os.path.exists(best):
+                self.state.best_model_checkpoint = best
+        for cb in [cb for cb in self.callback_handler.callbacks + [self.control] if isinstance(cb, ExportableState)]:
+            name = cb.__class__.__name__
+            if isinstance(self.state.stateful_callbacks[name], list):
+                self.state.stateful_callbacks[name].append(cb.state())
+            else:
+                self.state.stateful_callbacks[name] = cb.state()
+
+        files = self._checkpoint_snapshot(unwrapped)
+        self._checkpoint_writer.submit(os.path.basename(checkpoint), files, self.state.best_model_checkpoint)
+        blocked = time.perf_counter() - start
+        logger.info(
+            f"Checkpoint {self.state.global_step}: training blocked {blocked * 1000:.0f} ms "
+            f"({waited * 1000:.0f} ms waiting for the previous write)"
+        )
+        self._write_metrics({
+            "event": "checkpoint",
+            "step": self.state.global_step,
+            "blocked_ms": round(blocked * 1000, 2),
+            "wait_ms": round(waited * 1000, 2),
+        })
+
+    def _checkpoint_snapshot(self, model) -> Dict[str, Callable[[str], None]]:
+        # Host copies of everything the checkpoint holds; the returned writers only touch these copies
+        adapter_name = model.active_adapter
+        adapter = to_cpu(get_peft_model_state_dict(model, adapter_name=adapter_name))
+        adapter_config = copy.deepcopy(model.peft_config[adapter_name])
+        adapter_config.inference_mode = True
+        optimizer = to_cpu(self.optimizer.state_dict())
+        scheduler = copy.deepcopy(self.lr_scheduler.state_dict())
+        rng_states = {
+            "python": random.getstate(),
+            "numpy": np.random.get_state(),
+            "cpu": torch.random.get_rng_state(),
+        }
+        if torch.cuda.is_available():
+            rng_states["cuda"] = torch.cuda.random.get_rng_state()
+        trainer_state = json.dumps(dataclasses.asdict(self.state), indent=2, sort_keys=True) + "\n"
+        data_state = self._data_state()
+
+        def write_text(text):
+            def write(path):
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(text)
+            return write
+
+        files = {
+            ADAPTER_SAFE_WEIGHTS_NAME: lambda path: save_file(adapter, path, metadata={"format": "pt"}),
+            "adapter_config.json": lambda path: adapter_config.save_pretrained(os.path.dirname(path)),
+            TRAINING_ARGS_NAME: lambda path: torch.save(self.args, path),
+            OPTIMIZER_NAME: lambda path: torch.save(optimizer, path),
+            SCHEDULER_NAME: lambda path: torch.save(scheduler, path),
+            "rng_state.pth": lambda path: torch.save(rng_states, path),
+            TRAINER_STATE_NAME: write_text(trainer_state),
+            DATA_STATE_NAME: write_text(json.dumps(data_state, indent=2)),
+        }
+        scaler = getattr(self.accelerator, "scaler", None)
+        if scaler is not None:
+            scaler_state = to_cpu(scaler.state_dict())
+            files[SCALER_NAME] = lambda path: torch.save(scaler_state, path)
+        return files
+
+    def _load_best_model(self):
+        # The best checkpoint may still be in the writer's queue
+        if self._checkpoint_writer is not None:
+            self._checkpoint_writer.wait()
+        super()._load_best_model()
+
+    def _data_settings(self) -> Dict:
+        # What decides the sample order; a resumed run only replays it when these are unchanged
+        return {
+            "batch_size": self._train_batch_size,
+            "world_size": self.args.world_size,
+            "num_workers": self.args.dataloader_num_workers,
+            "seed": self.args.seed,
+            "num_samples": len(self.train_dataset) if has_length(self.train_dataset) else None,
+        }
+
+    def _data_state(self) -> Dict:
+        return {
+            "epoch": self._data_epoch,
+            "batches": self._data_batches,
+            "worker_samples": self._data_worker_samples,
+            "next_worker": self._data_next_worker,
+            **self._data_settings(),
+        }
+
+    def _begin_data_epoch(self):
+        # The first epoch of a run continues the restored position, later ones start over
+        if self._data_epoch_started:
+            self._data_epoch += 1
+            self._data_batches = 0
+            self._data_worker_samples, self._data_next_worker = [], 0
+        self._data_epoch_started = True
+
+    def _restore_data_state(self, state, train_dataloader):
+        self._data_epoch, self._data_batches, self._data_epoch_started = 0, 0, False
+        self._data_worker_samples, self._data_next_worker = [], 0
+        if self._resume_checkpoint is None:
+            return
+        path = os.path.join(self._resume_checkpoint, DATA_STATE_NAME)
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                saved = json.load(f)
+            changed = [key for key, value in self._data_settings().items() if saved.get(key) != value]
+            if changed:
+                logger.warning(
+                    f"{', '.join(changed)} changed since {self._resume_checkpoint}; "
+                    "the resumed run will not see the samples in the same order"
+                )
+        else:
+            # Checkpoints without a data state: the same position the Trainer derives from the step
+            steps_in_epoch = (len(train_dataloader) if train_dataloader is not None and has_length(train_dataloader)
+                              else self.args.max_steps * self.args.gradient_accumulation_steps)
+            epoch = int(state.epoch or 0)
+            saved = {"epoch": epoch, "batches": round(((state.epoch or 0) - epoch) * steps_in_epoch),
+                     "batch_size": self._train_batch_size}
+        self._data_epoch, self._data_batches = saved["epoch"], saved["batches"]
+        # Per-worker positions only hold for the same readers (ranks x workers)
+        num_workers = max(1, self.args.dataloader_num_workers)
+        worker_samples = saved.get("worker_samples")
+        if (worker_samples is None or len(worker_samples) > num_workers
+                or saved.get("num_workers") != self.args.dataloader_num_workers
+                or saved.get("world_size") != self.args.world_size):
+            worker_samples = None
+        else:
+            worker_samples = worker_samples + [0] * (num_workers - len(worker_samples))
+            self._data_worker_samples, self._data_next_worker = worker_samples, saved.get("next_worker", 0)
+        if train_dataloader is not None and has_length(train_dataloader) and self._data_batches >= len(train_dataloader):
+            # Saved on the last step of an epoch; the Trainer resumes at the start of the next one
+            self._data_epoch, self._data_batches = self._data_epoch + 1, 0
+            self._data_worker_samples, self._data_next_worker = [], 0
+
+        if hasattr(self.train_dataset, "resume_from"):
+            if worker_samples is None and self.args.dataloader_num_workers > 1:
+                logger.warning(
+                    f"{self._resume_checkpoint} has no per-worker data position for {num_workers} workers; "
+                    "the stream resumes at an estimated position"
+                )
+            self.train_dataset.resume_from(self._data_epoch, self._data_batches, saved["batch_size"],
+                                           worker_samples, self._data_next_worker)
+            logger.info(f"Data stream resumes in epoch {self._data_epoch} after {self._data_batches} batches")
+
+    def _count_tokens(self, inputs):
+        num_tokens = inputs.pop("num_tokens", None)
+        if num_tokens is not None:
+            return num_tokens.sum(), inputs["input_ids"].numel(), inputs["input_ids"].shape[0]
+        attention_mask = inputs.get("attention_mask")
+        if attention_mask is not None:
+            return attention_mask.sum(), attention_mask.numel(), attention_mask.shape[0]
+        input_ids = inputs["input_ids"]
+        return input_ids.numel(), input_ids.numel(), input_ids.shape[0]
+
+    def training_step(self, model, inputs, *args, **kwargs):
+        real, slots, sequences = self._count_tokens(inputs)
+        self._real_tokens = self._real_tokens + real
+        self._padded_slots += slots
+        self._num_sequences += sequences
+        self._step["tokens"] = self._step["tokens"] + real
+        self._step["slots"] += slots
+        self._step["sequences"] += sequences
+
+        start = time.perf_counter()
+        loss = super().training_step(model, inputs, *args, **kwargs)
+        self._sync()
+        self._fwd_bwd_end = time.perf_counter()
+        self._step["fwd_bwd"] += self._fwd_bwd_end - start
+        return loss
+
+    def _causal_lm_parts(self, model):
+        # (decoder body, LM head) when the loss may bypass the model's forward, else None
+        if self._lm_parts is None:
+            causal = self.accelerator.unwrap_model(model)
+            if hasattr(causal, "get_base_model"):
+                causal = causal.get_base_model()
+            config = getattr(causal, "config", None)
+            body = getattr(causal, getattr(causal, "base_model_prefix", ""), None)
+            head = causal.get_output_embeddings() if hasattr(causal, "get_output_embeddings") else None
+            supported = (
+                self.args.world_size == 1
+                and self.label_smoother is None
+                and self.compute_loss_func is None
+                and isinstance(body, torch.nn.Module) and body is not causal
+                and isinstance(head, torch.nn.Linear)
+                and config is not None
+                and not getattr(config, "final_logit_softcapping", None)
+                and getattr(config, "logit_scale", None) is None
+                and not getattr(config, "output_router_logits", False)
+            )
+            self._lm_parts = (body, head) if supported else False
+            if not supported:
+                logger.info("Model loss path: full logits (supervised-only projection not applicable)")
+        return self._lm_parts or None
+
+    def _supervised_loss_sum(self, parts, inputs):
+        # Summed next-token loss over supervised positions and their count
+        body, head = parts
+        labels = inputs["labels"]
+        features = {k: v for k, v in inputs.items() if k != "labels"}
+        with self.accelerator.autocast():
+            hidden = body(**features, use_cache=False).last_hidden_state
+            targets = labels[:, 1:]
+            mask = targets != -100
+            logits = head(hidden[:, :-1][mask])
+        loss = F.cross_entropy(logits.float(), targets[mask], reduction="sum")
+        return loss, mask.sum()
+
+    def compute_loss(self, model, inputs, return_outputs=False, num_items_in_batch=None):
+        parts = None if return_outputs or "labels" not in inputs else self._causal_lm_parts(model)
+        if parts is None:
+            return super().compute_loss(model, inputs, return_outputs, num_items_in_batch)
+        loss, count = self._supervised_loss_sum(parts, inputs)
+        # Same normalization the model applies, which training_step relies on for gradient accumulation
+        if self.model_accepts_loss_kwargs and num_items_in_batch is not None:
+            return loss / num_items_in_batch
+        return loss / count.clamp(min=1)
+
+    def _end_step(self, state):
+        self._sync()
+        now = time.perf_counter()
+        step = self._step
+        wall = now - self._step_start
+        optimizer = now - self._fwd_bwd_end if self._fwd_bwd_end is not None else 0.0
+        tokens = int(step["tokens"])
+        seq_length = step["slots"] / max(1, step["sequences"])
+        flops = tokens * flops_per_token(self._flop_counts, seq_length)
+
+        record = {
+            "event": "step",
+            "step": state.global_step,
+            "epoch": round(state.epoch or 0, 4),
+            "wall_ms": round(wall * 1000, 2),
+            "data_wait_ms": round(step["data_wait"] * 1000, 2),
+            "fwd_bwd_ms": round(step["fwd_bwd"] * 1000, 2),
+            "optimizer_ms": round(optimizer * 1000, 2),
+            "other_ms": round(max(0.0, wall - step["data_wait"] - step["fwd_bwd"] - optimizer) * 1000, 2),
+            "tokens": tokens,
+            "padded_tokens": step["slots"],
+            "sequences": step["sequences"],
+            "tokens_per_s": round(tokens / wall, 1) if wall > 0 else None,
+            "tflops": round(flops / wall / 1e12, 4) if wall > 0 else None,
+        }
+        if self.peak_tflops and record["tflops"] is not None:
+            record["mfu"] = round(record["tflops"] / self.peak_tflops, 4)
+        self._write_metrics(record)
+
+        window = self._window
+        window["steps"] += 1
+        window["wall"] += wall
+        window["data_wait"] += step["data_wait"]
+        window["fwd_bwd"] += step["fwd_bwd"]
+        window["optimizer"] += optimizer
+        window["tokens"] += tokens
+        window["flops"] += flops
+
+        # The next step starts now, so logging and checkpointing show up as its "other" time
+        self._reset_step()
+        self._step_start = now
+        self._fwd_bwd_end = None
+
+    def _window_logs(self) -> Dict:
+        window = self._window
+        steps, wall = window["steps"], window["wall"]
+        logs = {
+            "tokens_per_s": round(window["tokens"] / wall, 1),
+            "step_ms": round(wall / steps * 1000, 2),
+            "data_wait_ms": round(window["data_wait"] / steps * 1000, 2),
+            "fwd_bwd_ms": round(window["fwd_bwd"] / steps * 1000, 2),
+            "optimizer_ms": round(window["optimizer"] / steps * 1000, 2),
+            # Per device; multiply by world_size for the whole job
+            "tflops": round(window["flops"] / wall / 1e12, 4),
+        }
+        if self.peak_tflops:
+            logs["mfu"] = round(logs["tflops"] / self.peak_tflops, 4)
+        self._reset_window()
+        return logs
+
+    def _get_eval_batches(self) -> List[Dict]:
+        if self._eval_batches is None:
+            collator = DynamicPaddingCollator(self.eval_dataset.pad_token_id, pad_to_multiple_of=8,
+                                              response_only=self.response_only)
+            batches = length_sorted_batches(self.eval_dataset.lengths, self.args.per_device_eval_batch_size)
+            self._eval_batches = [collator([self.eval_dataset[i] for i in batch]) for batch in batches]
+            if self.args.dataloader_pin_memory:
+                self._eval_batches = [{k: v.pin_memory() for k, v in batch.items()} for batch in self._eval_batches]
+        return self._eval_batches
+
+    def evaluate(self, eval_dataset=None, ignore_keys=None, metric_key_prefix: str = "eval"):
+        if eval_dataset is not None and eval_dataset is not self.eval_dataset:
+            return super().evaluate(eval_dataset, ignore_keys, metric_key_prefix)
+
+        start_time = time.time()
+        batches = self._get_eval_batches()
+        model = self.model
+        was_training = model.training
+        model.eval()
+        parts = self._causal_lm_parts(model)
+        loss_sum = torch.zeros((), dtype=torch.float64, device=self.args.device)
+        tokens = torch.zeros((), dtype=torch.long, device=self.args.device)
+        with torch.no_grad():
+            # Every process takes its share of the batches; the sums are reduced below
+            for batch in batches[self.args.process_index::self.args.world_size]:
+                batch = self._prepare_inputs(batch)
+                with self.compute_loss_context_manager():
+                    if parts is not None:
+                        loss, count = self._supervised_loss_sum(parts, batch)
+                        loss_sum += loss.double()
+                        tokens += count
+                        continue
+                    loss = model(**batch).loss
+                # The model averages over shifted labels, so weight each batch by its label count
+                count = (batch["labels"][:, 1:] != -100).sum()
+                loss_sum += loss.double() * count
+                tokens += count
+        if self.args.world_size > 1:
+            loss_sum = self.accelerator.reduce(loss_sum, reduction="sum")
+            tokens = self.accelerator.reduce(tokens, reduction="sum")
+        model.train(was_training)
+
+        eval_loss = (loss_sum / tokens.clamp(min=1)).item()
+        metrics = {
+            f"{metric_key_prefix}_loss": eval_loss,
+            f"{metric_key_prefix}_perplexity": math.exp(eval_loss) if eval_loss < 700 else float("inf"),
+            f"{metric_key_prefix}_tokens": int(tokens),
+        }
+        metrics.update(speed_metrics(metric_key_prefix, start_time, num_samples=len(self.eval_dataset), num_steps=len(batches)))
+        self.log(metrics)
+        self.control = self.callback_handler.on_evaluate(self.args, self.state, self.control, metrics)
+        return metrics
+
+    def log(self, logs, *args, **kwargs):
+        if self._padded_slots and "loss" in logs:
+            real = float(self._real_tokens)
+            logs["padding_ratio"] = round(1 - real / self._padded_slots, 4)
+            if self.max_seq_length:
+                logs["fixed_padding_ratio"] = round(1 - real / (self._num_sequences * self.max_seq_length), 4)
+            else:
+                logs["fixed_padding_ratio"] = logs["padding_ratio"]
+            self._reset_padding_stats()
+        if self._window["steps"] and self._window["wall"] > 0 and "loss" in logs:
+            logs.update(self._window_logs())
+        super().log(logs, *args, **kwargs)
+        self._write_metrics({"event": "log", "step": self.state.global_step, **logs})
+
 class LLMTrainer:
-    def __init__(self, config: AppConfig, model, tokenizer, dataset):
+    def __init__(self, config: AppConfig, model, tokenizer, dataset, eval_dataset=None):
         self.config = config
         self.model = model
         self.tokenizer = tokenizer
         self.dataset = dataset
+        # Held-out split; enables periodic evaluation, early stopping and best-checkpoint selection
+        self.eval_dataset = eval_dataset
     
-    def train(self):
-        # GPU kontrolü
-        if not torch.cuda.is_available():
-            raise RuntimeError("CUDA not available! GPU training required.")
-        
-        device = torch.cuda.current_device()
-        logger.info(f"Using GPU: {torch.cuda.get_device_name(device)}")
-        
+    def build_trainer(self, callbacks=None) -> InstructTrainer:
+        # Everything train() sets up short of running it; benchmark.py drives it on CPU
         logger.info("Initializing Trainer...")
+        cuda = torch.cuda.is_available()
+
+        streaming = isinstance(self.dataset, IterableDataset)
+        if streaming and self.config.training.max_steps <= 0:
+            raise ValueError("Streaming datasets have no length, set training.max_steps")
+        training = self.config.training
+        evaluation = self.eval_dataset is not None
         
         training_args = TrainingArguments(
             output_dir=self.config.training.output_dir,
@@ -66,24 +684,85 @@ class LLMTrainer:
             logging_steps=self.config.training.logging_steps,
             save_steps=self.config.training.save_steps,
             num_train_epochs=self.config.training.num_train_epochs,
+            max_steps=self.config.training.max_steps,
             optim=self.config.training.optim,
             warmup_steps=self.config.training.warmup_steps,
-            fp16=True,  # A5000 için FP16 kullan
-            dataloader_pin_memory=True,  # GPU transfer hızını artır
-            dataloader_num_workers=0,  # CPU yükünü azalt
+            fp16=cuda,  # A5000 için FP16 kullan
+            dataloader_pin_memory=cuda,  # GPU transfer hızını artır
+            dataloader_num_workers=self.config.training.dataloader_num_workers,
+            dataloader_prefetch_factor=self.config.training.dataloader_prefetch_factor,
             remove_unused_columns=False,
+            # A streamed dataset seeks to the checkpoint's position itself, see InstructTrainer
+            ignore_data_skip=streaming,
             report_to="none",
             ddp_find_unused_parameters=False,
+            eval_strategy="steps" if evaluation else "no",
+            eval_steps=training.eval_steps or training.save_steps,
+            per_device_eval_batch_size=training.eval_batch_size,
+            # The best checkpoint by eval_loss is kept from rotation and loaded back at the end
+            load_best_model_at_end=evaluation,
+            metric_for_best_model="eval_loss",
+            greater_is_better=False,
         )
 
-        trainer = Trainer(
+        batch_sampler = None
+        response_only = self.config.data.supervision == "response"
+        # Fixed batches arrive padded to max_seq_length; the collator only builds their labels
+        data_collator = DynamicPaddingCollator(self.tokenizer.pad_token_id, response_only=response_only)
+        if isinstance(self.dataset, PackedDataset):
+            # Rows are already full and carry position_ids instead of an attention_mask
+            data_collator = transformers.default_data_collator
+            if self.config.training.batching == "token_budget":
+                logger.warning("Packing is enabled, ignoring token_budget batching")
+        elif self.config.training.batching == "token_budget" and streaming:
+            # Lengths are unknown up front; keep batch_size but still pad per batch
+            data_collator = DynamicPaddingCollator(self.tokenizer.pad_token_id, pad_to_multiple_of=8,
+                                                   response_only=response_only)
+            logger.warning("token_budget batching needs sample lengths, streaming falls back to batch_size with dynamic padding")
+        elif self.config.training.batching == "token_budget":
+            batch_sampler = TokenBudgetBatchSampler(
+                self.dataset.lengths,
+                self.config.training.max_tokens_per_batch,
+                seed=training_args.seed,
+            )
+            data_collator = DynamicPaddingCollator(self.tokenizer.pad_token_id, pad_to_multiple_of=8,
+                                                   response_only=response_only)
+            logger.info(f"Token-budget batching: {len(batch_sampler)} batches of <= {self.config.training.max_tokens_per_batch} tokens")
+
+        callbacks = [MonitoringCallback()] + list(callbacks or [])
+        if evaluation and training.early_stopping_patience:
+            callbacks.append(EarlyStoppingCallback(training.early_stopping_patience, training.early_stopping_threshold))
+        if self.config.profiling is not None:
+            # Imported only when profiling is configured, otherwise nothing is hooked
+            from .profiling import ProfilerCallback
+            callbacks.append(ProfilerCallback(self.config.profiling, self.config.training.output_dir))
+
+        trainer = InstructTrainer(
             model=self.model,
             args=training_args,
             train_dataset=self.dataset,
-            data_collator=transformers.DataCollatorForLanguageModeling(self.tokenizer, mlm=False),
-            callbacks=[MonitoringCallback()]
+            eval_dataset=self.eval_dataset,
+            data_collator=data_collator,
+            callbacks=callbacks,
+            batch_sampler=batch_sampler,
+            max_seq_length=self.config.data.max_seq_length,
+            metrics_file=self.config.training.metrics_file,
+            peak_tflops=self.config.training.peak_tflops,
+            response_only=response_only,
+            save_total_limit=training.save_total_limit,
+            async_checkpointing=training.async_checkpointing,
         )
+        return trainer
+
+    def train(self):
+        # GPU kontrolü
+        if not torch.cuda.is_available():
+            raise RuntimeError("CUDA not available! GPU training required.")
+        
+        device = torch.cuda.current_device()
+        logger.info(f"Using GPU: {torch.cuda.get_device_name(device)}")
 
+        trainer = self.build_trainer()
         logger.info("Starting training...")
         
         # Handle Resume
@@ -101,6 +780,9 @@ class LLMTrainer:
         train_result = trainer.train(resume_from_checkpoint=resume_from_checkpoint)
         
         logger.info("Training completed.")
+        if trainer.state.best_model_checkpoint:
+            # best_metric may come from an evaluation between saves, so it is logged apart from the checkpoint
+            logger.info(f"Best eval_loss: {trainer.state.best_metric:.4f}; final model is {trainer.state.best_model_checkpoint}")
         logger.info(f"Saving final model to {self.config.training.output_dir}")
         trainer.save_model()
         self.tokenizer.save_pretrained(self.config.training.output_dir)
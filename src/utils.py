@@ -1,7 +1,8 @@
+import contextlib
 import logging
-import torch
+import time
 import os
-import psutil
+from typing import Dict
 from rich.logging import RichHandler
 from rich.console import Console
 
@@ -18,7 +19,11 @@ def setup_logger(name: str = "LLM_Trainer", log_file: str = "training.log", leve
     )
     return logging.getLogger(name)
 
+# torch and psutil are imported where they are used: the config, API and CLI entry points
+# import this module and should not pay for them
+
 def get_gpu_memory_usage():
+    import torch
     if not torch.cuda.is_available():
         return "CUDA Not Available"
     
@@ -30,7 +35,27 @@ def get_gpu_memory_usage():
         "free_gb": round(free_mem / (1024**3), 2)
     }
 
+@contextlib.contextmanager
+def timed(timings: Dict[str, float], name: str):
+    # Records the wall time of the block in seconds under `name`
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round(time.perf_counter() - start, 3)
+
+def configure_cpu_threads(num_threads: int = None) -> int:
+    # Hyper-threads rarely help matmul-bound inference, so default to physical cores
+    import psutil
+    import torch
+    if num_threads is None:
+        num_threads = psutil.cpu_count(logical=False) or os.cpu_count() or 1
+    torch.set_num_threads(num_threads)
+    return num_threads
+
 def print_system_info():
+    import psutil
+    import torch
     logger = logging.getLogger("LLM_Trainer")
     logger.info("System Info:")
     logger.info(f"CPU Cores: {psutil.cpu_count(logical=True)}")
@@ -46,6 +71,7 @@ def print_system_info():
 def set_seed(seed: int = 42):
     import random
     import numpy as np
+    import torch
     random.seed(seed)
     np.random.seed(seed)
     torch.manual_seed(seed)
@@ -0,0 +1,80 @@
+import json
+from types import SimpleNamespace
+from src.bulk_inference import completed_ids, run_bulk
+
+class FakeEvaluator:
+    """Answers with the question reversed and records how it was called."""
+
+    def __init__(self, max_batch_size=4):
+        self.config = SimpleNamespace(inference=SimpleNamespace(max_batch_size=max_batch_size))
+        self.calls = []
+
+    def tokenizer(self, texts):
+        return {"input_ids": [text.split() for text in texts]}
+
+    def check_adapter(self, name):
+        pass
+
+    def _row(self, question):
+        return {"answer": question[::-1], "generated_tokens": 1}
+
+    def generate_batch(self, questions, use_adapter=False, adapter=None, max_batch_size=None):
+        self.calls.append((list(questions), max_batch_size))
+        return [self._row(q) for q in questions]
+
+    def compare_batch(self, questions, adapters=None, max_batch_size=None):
+        self.calls.append((list(questions), max_batch_size))
+        return [{"question": q, "base_model": self._row(q), "finetuned_model": self._row(q)} for q in questions]
+
+def write_questions(path, count):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(count):
+            f.write(json.dumps({"id": f"q{i}", "question": f"soru {i}"}) + "\n")
+
+def read_ids(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["id"] for line in f]
+
+def test_resume_skips_written_ids_and_drops_a_torn_line(tmp_path):
+    questions, output = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_questions(questions, 6)
+    with open(output, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"id": "q0", "question": "soru 0"}) + "\n")
+        f.write(json.dumps({"id": "q3", "question": "soru 3"}) + "\n")
+        f.write('{"id": "q4", "quest')
+
+    evaluator = FakeEvaluator()
+    summary = run_bulk(evaluator, str(questions), str(output), mode="base", progress=False)
+
+    assert summary["skipped"] == 2 and summary["questions"] == 4
+    asked = [q for batch, _ in evaluator.calls for q in batch]
+    assert sorted(asked) == ["soru 1", "soru 2", "soru 4", "soru 5"]
+    assert sorted(read_ids(output)) == [f"q{i}" for i in range(6)]
+
+    # A second run has nothing left to do
+    again = run_bulk(FakeEvaluator(), str(questions), str(output), mode="base", progress=False)
+    assert again["questions"] == 0 and again["skipped"] == 6
+
+def test_completed_ids_of_missing_file_is_empty(tmp_path):
+    assert completed_ids(str(tmp_path / "missing.jsonl")) == set()
+
+def test_default_batch_size_follows_the_config(tmp_path):
+    questions, output = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_questions(questions, 10)
+    evaluator = FakeEvaluator(max_batch_size=4)
+    run_bulk(evaluator, str(questions), str(output), mode="compare", progress=False)
+    # Base and fine-tuned rows of a question share a generate call
+    assert [len(batch) for batch, _ in evaluator.calls] == [2, 2, 2, 2, 2]
+    assert {rows for _, rows in evaluator.calls} == {None}
+
+def test_explicit_batch_size_overrides_the_config_cap(tmp_path):
+    questions, output = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_questions(questions, 10)
+
+    evaluator = FakeEvaluator(max_batch_size=4)
+    run_bulk(evaluator, str(questions), str(output), mode="finetuned", batch_size=8, progress=False)
+    assert [(len(batch), rows) for batch, rows in evaluator.calls] == [(8, 8), (2, 8)]
+
+    evaluator = FakeEvaluator(max_batch_size=4)
+    run_bulk(evaluator, str(questions), str(tmp_path / "compare.jsonl"), mode="compare", batch_size=5, progress=False)
+    assert [(len(batch), rows) for batch, rows in evaluator.calls] == [(5, 10), (5, 10)]
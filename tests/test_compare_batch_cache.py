@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import pytest
+from fastapi import HTTPException
+from src.api import main
+from src.api.scheduler import BatchScheduler
+from src.response_cache import ResponseCache
+
+class FakeEvaluator:
+    default_adapter = "adapter"
+
+    def __init__(self):
+        self.asked = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def check_adapter(self, name):
+        pass
+
+    def cache_identity(self, adapter=None):
+        return {"adapter": adapter or self.default_adapter}
+
+    def compare_batch(self, questions, adapters=None):
+        self.release.wait(5)
+        self.asked.append(list(questions))
+        row = {"answer": "", "prefill_ms": 1.0, "response_time_ms": 2.0, "generated_tokens": 1, "tokens_used": 3}
+        return [{"question": q, "base_model": {**row, "answer": f"base {q}"}, "finetuned_model": row} for q in questions]
+
+@pytest.fixture
+def served(monkeypatch):
+    evaluator = FakeEvaluator()
+    scheduler = BatchScheduler(lambda items: main.run_compare_batch(evaluator, items),
+                               max_batch_size=2, max_wait_ms=1, max_queue_size=4)
+    cache = ResponseCache()
+    monkeypatch.setattr(main, "evaluator", evaluator)
+    monkeypatch.setattr(main, "scheduler", scheduler)
+    monkeypatch.setattr(main, "response_cache", cache)
+    return evaluator, scheduler, cache
+
+def test_batch_generates_only_distinct_misses(served):
+    evaluator, scheduler, _ = served
+
+    async def scenario():
+        await scheduler.start()
+        try:
+            await main.compare_models(main.CompareRequest(question="a"))
+            request = main.CompareBatchRequest(questions=["a", "b", " b ", "c"])
+            return await main.compare_models_batch(request)
+        finally:
+            await scheduler.stop()
+
+    response = asyncio.run(scenario())
+    assert evaluator.asked[0] == ["a"]
+    assert sorted(q for batch in evaluator.asked[1:] for q in batch) == ["b", "c"]
+    assert [r["question"] for r in response["results"]] == ["a", "b", " b ", "c"]
+    assert [r["base_model"]["answer"] for r in response["results"]] == ["base a", "base b", "base b", "base c"]
+
+def test_rejected_batch_leaves_nothing_in_flight(served):
+    evaluator, scheduler, cache = served
+    evaluator.release.clear()
+
+    async def scenario():
+        await scheduler.start()
+        try:
+            # One batch of two is generating and four questions fill the queue
+            busy = asyncio.ensure_future(scheduler.submit_many([(q, None, 0.0) for q in "uvwxyz"]))
+            while scheduler.queue_depth < 4:
+                await asyncio.sleep(0.001)
+            with pytest.raises(HTTPException) as rejected:
+                await main.compare_models_batch(main.CompareBatchRequest(questions=["p", "q"]))
+            in_flight = cache.stats()["in_flight"]
+            evaluator.release.set()
+            await busy
+            return rejected.value, in_flight
+        finally:
+            evaluator.release.set()
+            await scheduler.stop()
+
+    rejected, in_flight = asyncio.run(scenario())
+    assert rejected.status_code == 429
+    assert in_flight == 0
+    assert all("p" not in batch for batch in evaluator.asked)
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+from src import evaluator as evaluator_module
+from src.adapter_registry import AdapterRegistry
+from src.config import InferenceConfig
+from src.evaluator import Evaluator
+
+def merged_evaluator(monkeypatch, quantized=False):
+    # The state Evaluator.__init__ leaves behind with inference.merged_checkpoint set
+    loaded, quantized_models = [], []
+    monkeypatch.setattr(evaluator_module, "load_model", lambda config, **kwargs: loaded.append(kwargs) or object())
+    monkeypatch.setattr(evaluator_module, "quantize_dynamic_int8", quantized_models.append)
+    evaluator = Evaluator.__new__(Evaluator)
+    evaluator.config = SimpleNamespace(model=SimpleNamespace(name_or_path="base"),
+                                       inference=InferenceConfig(warmup_prompt="Merhaba"))
+    evaluator.adapters = AdapterRegistry(None)
+    evaluator.base_model = None
+    evaluator.merged_model = object()
+    evaluator.quantized = quantized
+    return evaluator, loaded, quantized_models
+
+def test_base_model_is_loaded_once_on_demand(monkeypatch):
+    evaluator, loaded, quantized_models = merged_evaluator(monkeypatch, quantized=True)
+    assert evaluator.model is None
+
+    evaluator._ensure_base_model()
+    evaluator._ensure_base_model()
+
+    assert len(loaded) == 1
+    assert evaluator.model is evaluator.base_model is not None
+    assert quantized_models == [evaluator.base_model]
+
+def test_warmup_does_not_load_the_base_model(monkeypatch):
+    evaluator, loaded, _ = merged_evaluator(monkeypatch)
+    calls = []
+    evaluator.generate_batch = lambda questions, use_adapter=False, **kwargs: calls.append(use_adapter)
+    evaluator.compare_batch = lambda questions, *args, **kwargs: calls.append("compare")
+
+    evaluator.warmup()
+
+    assert calls == [True]
+    assert loaded == []
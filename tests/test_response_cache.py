@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+from src.response_cache import ResponseCache
+
+def test_concurrent_misses_share_one_computation():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def scenario():
+        cache = ResponseCache()
+        key = ResponseCache.make_key("Soru?", {"adapter": "a"})
+        results = await asyncio.gather(*(cache.get_or_compute(key, compute) for _ in range(5)))
+        again = await cache.get_or_compute(key, compute)
+        return cache, results, again
+
+    cache, results, again = asyncio.run(scenario())
+    assert results == ["answer"] * 5 and again == "answer"
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert (stats["misses"], stats["coalesced"], stats["hits"]) == (1, 4, 1)
+
+def test_keys_ignore_whitespace_differences():
+    identity = {"adapter": "a"}
+    assert ResponseCache.make_key(" Soru  nedir? ", identity) == ResponseCache.make_key("Soru nedir?", identity)
+    assert ResponseCache.make_key("Soru", identity) != ResponseCache.make_key("Soru", {"adapter": "b"})
+
+def test_get_or_compute_many_computes_distinct_misses_once():
+    requested = []
+
+    async def compute(indices):
+        requested.append(list(indices))
+        return [f"value-{i}" for i in indices]
+
+    async def scenario():
+        cache = ResponseCache()
+        cache.put("hit", "cached")
+        return cache, await cache.get_or_compute_many(["hit", "a", "b", "a"], compute)
+
+    cache, results = asyncio.run(scenario())
+    assert results == ["cached", "value-1", "value-2", "value-1"]
+    assert requested == [[1, 2]]
+    assert cache.get("a") == (True, "value-1")
+
+def test_get_or_compute_many_joins_inflight_single_requests():
+    calls = []
+
+    async def single():
+        calls.append("single")
+        await asyncio.sleep(0.01)
+        return "from-single"
+
+    async def many(indices):
+        calls.append(list(indices))
+        return ["from-batch" for _ in indices]
+
+    async def scenario():
+        cache = ResponseCache()
+        first = asyncio.ensure_future(cache.get_or_compute("a", single))
+        await asyncio.sleep(0)
+        return await asyncio.gather(first, cache.get_or_compute_many(["a", "b"], many))
+
+    first, batch = asyncio.run(scenario())
+    assert first == "from-single"
+    assert batch == ["from-single", "from-batch"]
+    assert calls == ["single", [1]]
+
+def test_failed_batch_leaves_nothing_cached_or_in_flight():
+    async def compute(indices):
+        raise RuntimeError("queue full")
+
+    async def scenario():
+        cache = ResponseCache()
+        with pytest.raises(RuntimeError):
+            await cache.get_or_compute_many(["a", "b"], compute)
+        await asyncio.sleep(0)
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert cache.stats()["in_flight"] == 0
+    assert cache.get("a") == (False, None)
@@ -0,0 +1,120 @@
+import asyncio
+import threading
+import pytest
+from src.api.scheduler import BatchScheduler, QueueFullError, SchedulerStoppedError
+
+def run(coro):
+    return asyncio.run(coro)
+
+def test_concurrent_requests_share_a_batch():
+    batches = []
+
+    def batch_fn(items):
+        batches.append(list(items))
+        return [item * 2 for item in items]
+
+    async def scenario():
+        scheduler = BatchScheduler(batch_fn, max_batch_size=4, max_wait_ms=50)
+        await scheduler.start()
+        try:
+            return await asyncio.gather(*(scheduler.submit(i) for i in range(3)))
+        finally:
+            await scheduler.stop()
+
+    assert run(scenario()) == [0, 2, 4]
+    assert batches == [[0, 1, 2]]
+
+def test_partial_batch_runs_after_max_wait():
+    async def scenario():
+        scheduler = BatchScheduler(lambda items: items, max_batch_size=8, max_wait_ms=20)
+        await scheduler.start()
+        try:
+            return await asyncio.wait_for(scheduler.submit("only"), timeout=2)
+        finally:
+            await scheduler.stop()
+
+    assert run(scenario()) == "only"
+
+def test_full_queue_rejects_without_enqueuing():
+    release = threading.Event()
+
+    def batch_fn(items):
+        release.wait(5)
+        return items
+
+    async def scenario():
+        scheduler = BatchScheduler(batch_fn, max_batch_size=1, max_wait_ms=0, max_queue_size=2)
+        await scheduler.start()
+        try:
+            busy = asyncio.ensure_future(scheduler.submit_many(["a", "b", "c"]))
+            while scheduler.in_flight == 0:
+                await asyncio.sleep(0.001)
+            assert scheduler.queue_depth == 2
+            with pytest.raises(QueueFullError):
+                await scheduler.submit("d")
+            assert scheduler.queue_depth == 2
+            release.set()
+            return await busy
+        finally:
+            release.set()
+            await scheduler.stop()
+
+    assert run(scenario()) == ["a", "b", "c"]
+
+def test_oversized_batch_is_admitted_in_chunks():
+    batches = []
+
+    def batch_fn(items):
+        batches.append(len(items))
+        return [item + 1 for item in items]
+
+    async def scenario():
+        scheduler = BatchScheduler(batch_fn, max_batch_size=4, max_wait_ms=1, max_queue_size=8)
+        await scheduler.start()
+        try:
+            return await asyncio.wait_for(scheduler.submit_many(list(range(50))), timeout=5)
+        finally:
+            await scheduler.stop()
+
+    assert run(scenario()) == list(range(1, 51))
+    assert max(batches) <= 4
+    assert sum(batches) == 50
+
+def test_stop_fails_requests_waiting_for_room():
+    release = threading.Event()
+
+    def batch_fn(items):
+        release.wait(5)
+        return items
+
+    async def scenario():
+        scheduler = BatchScheduler(batch_fn, max_batch_size=1, max_wait_ms=0, max_queue_size=2)
+        await scheduler.start()
+        waiting = asyncio.ensure_future(scheduler.submit_many(list(range(10))))
+        while scheduler.in_flight == 0:
+            await asyncio.sleep(0.001)
+        release.set()
+        await scheduler.stop()
+        with pytest.raises(SchedulerStoppedError):
+            await asyncio.wait_for(waiting, timeout=2)
+
+    run(scenario())
+
+def test_items_arriving_at_the_deadline_are_not_lost():
+    async def scenario():
+        scheduler = BatchScheduler(lambda items: items, max_batch_size=64, max_wait_ms=0.5)
+        await scheduler.start()
+        try:
+            results = []
+            for round_ in range(50):
+                # Staggered submissions race each collection deadline
+                tasks = []
+                for i in range(8):
+                    tasks.append(asyncio.ensure_future(scheduler.submit((round_, i))))
+                    await asyncio.sleep(0.0002 * (i % 3))
+                results += await asyncio.wait_for(asyncio.gather(*tasks), timeout=2)
+            return results
+        finally:
+            await scheduler.stop()
+
+    assert len(run(scenario())) == 400
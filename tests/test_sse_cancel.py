@@ -0,0 +1,91 @@
+import asyncio
+import contextlib
+import threading
+import time
+import pytest
+import torch
+from src.api import main
+from src.api.main import sse_events
+from src.evaluator import Evaluator
+
+class FakeTokenizer:
+    eos_token_id = 0
+
+    def decode(self, tokens, skip_special_tokens=True):
+        return "x" * len(tokens)
+
+class EndlessModel:
+    """Emits one token every few milliseconds until a stopping criterion fires."""
+
+    def __init__(self):
+        self.stopped = threading.Event()
+
+    def generate(self, input_ids, streamer, stopping_criteria, **kwargs):
+        streamer.put(input_ids)
+        for _ in range(10_000):
+            time.sleep(0.005)
+            streamer.put(torch.tensor([1]))
+            if stopping_criteria[0](input_ids, None).all():
+                break
+        self.stopped.set()
+        streamer.end()
+
+def make_evaluator(model):
+    # Only what stream_batch touches; the real constructor would load weights
+    evaluator = Evaluator.__new__(Evaluator)
+    evaluator.tokenizer = FakeTokenizer()
+    evaluator._generate_lock = threading.Lock()
+    evaluator._prepare = lambda *args: (model, {"input_ids": torch.tensor([[1, 2]])}, {}, contextlib.nullcontext())
+    return evaluator
+
+def test_disconnect_mid_stream_cancels_generation():
+    model = EndlessModel()
+    evaluator = make_evaluator(model)
+    cancel = threading.Event()
+
+    async def disconnect():
+        stream = sse_events(evaluator.stream_batch(["q"], cancel=cancel), cancel)
+        assert '"type": "token"' in await stream.__anext__()
+        # The client goes away while the next event is still being pulled in a worker thread
+        reader = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0.001)
+        reader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await reader
+        await asyncio.sleep(0.1)
+
+    asyncio.run(disconnect())
+    assert cancel.is_set()
+    assert model.stopped.wait(2)
+    assert evaluator._generate_lock.acquire(timeout=2)
+
+def test_cancel_before_generation_skips_it():
+    model = EndlessModel()
+    evaluator = make_evaluator(model)
+    cancel = threading.Event()
+    cancel.set()
+    events = list(evaluator.stream_batch(["q"], cancel=cancel))
+    assert not model.stopped.is_set()
+    assert [event["type"] for event in events] == ["done"]
+
+def test_finished_stream_ends_with_end_event(monkeypatch):
+    class ShortModel(EndlessModel):
+        def generate(self, input_ids, streamer, stopping_criteria, **kwargs):
+            streamer.put(input_ids)
+            for token in (5, 6, 0):
+                streamer.put(torch.tensor([token]))
+            streamer.end()
+
+    evaluator = make_evaluator(ShortModel())
+    evaluator.default_adapter = None
+    # Completion events are recorded in the metrics against the served evaluator
+    monkeypatch.setattr(main, "evaluator", evaluator)
+    cancel = threading.Event()
+
+    async def collect():
+        return [chunk async for chunk in sse_events(evaluator.stream_batch(["q"], cancel=cancel), cancel)]
+
+    chunks = asyncio.run(collect())
+    assert '"type": "done"' in chunks[-2]
+    assert chunks[-1] == 'data: {"type": "end"}\n\n'
+    assert cancel.is_set()